@@ -112,6 +112,9 @@ class CmdLoot(Command):
         if obj is None:
             return
         if obj.db.corpse:
+            # loot is only created when the corpse is first opened
+            if hasattr(obj, "materialize_loot"):
+                obj.materialize_loot()
             if len(obj.contents) == 0:
                 self.caller.msg("That corpse is empty.")
                 obj.db.destroy_me = True
@@ -1,4 +1,4 @@
-from ev import Object, create_object
+from ev import Object, create_object, search_object, spawn
 import random
 
 class ItemFactory(Object):
@@ -20,52 +20,85 @@ class ItemFactory(Object):
         self.db.uncommon_items = [ 'Gently Used Blade' ]
 
    
-    def create_lootset(self, number_of_items, loot_tier='t1'):
-        loot_set = []
-        print "begin loot set logic"
+    def roll_lootset(self, number_of_items, loot_tier='t1', seed=None):
+        """
+        Decide what a lootset contains without creating anything.
+
+        Returns a tuple (uncommon, items) where uncommon is the name of
+        an uncommon item to drop (or None) and items is a list of
+        (name, desc, crafting_group) tuples. Passing the same seed
+        always gives the same result, which is what lets a mob carry
+        only a loot recipe until its corpse is actually looted.
+        """
+        rng = random.Random(seed) if seed is not None else random
+        uncommon = None
+        items = []
         if number_of_items == 0:
-            return []
+            return uncommon, items
+        if rng.random() < .02:
+            uncommon = rng.choice(self.db.uncommon_items)
         #loot_groups are important.  Each one represents a school of crafting...well roughly anyhow.
-        self.check_for_uncommon_drop(loot_set)
-        print loot_set
         loot_groups = ['armor']
         lg = 'armor'
         for x in range(0, number_of_items):
             if loot_tier == 't1':
                 if lg == 'armor':
-                    rn = random.random()
-                    print rn
-                    if rn < .05:
-                        name = random.choice(self.db.t1_old_armor_husks)
+                    if rng.random() < .05:
+                        name = rng.choice(self.db.t1_old_armor_husks)
                         desc = "This old set of armor while damaged, could probably be repaired."
                     else:
-                        print "in comps"
-                        name = random.choice(self.db.t1_armor_comp_names)
+                        name = rng.choice(self.db.t1_armor_comp_names)
                         desc = "Components used in the crafting of wonderful sets of armor."
-                
-                print "out of name gen" 
-                item = create_object("game.gamesrc.objects.world.item.Item", key=name, location=self)
-                item.desc = desc
-                a = item.db.attributes
-                a['lootable'] = True
-                a['crafting_material'] = True
-                a['crafting_group'] = lg
-                item.db.type = 'crafting_materials'
-                item.db.attributes = a
+            items.append((name, desc, lg))
+        return uncommon, items
+
+    def create_lootset(self, number_of_items, loot_tier='t1', location=None, seed=None):
+        """
+        Create the items of a lootset at location (default is the
+        factory itself). See roll_lootset for the meaning of seed.
+        """
+        loot_set = []
+        uncommon, items = self.roll_lootset(number_of_items, loot_tier=loot_tier, seed=seed)
+        if uncommon:
+            self.check_for_uncommon_drop(loot_set, location=location, item_name=uncommon)
+        for name, desc, lg in items:
+            item = create_object("game.gamesrc.objects.world.item.Item", key=name, location=location or self)
+            item.desc = desc
+            a = item.db.attributes
+            a['lootable'] = True
+            a['crafting_material'] = True
+            a['crafting_group'] = lg
+            item.db.type = 'crafting_materials'
+            item.db.attributes = a
             loot_set.append(item)
         return loot_set
-    
-    def check_for_uncommon_drop(self, loot_set):
-        rn = random.random()
-        if rn < .02:
-            print "I should be dropping an uncommon"
+
+    def create_loot_recipe(self, number_of_items, loot_tier='t1'):
+        """
+        Return a recipe describing a lootset, to be stored on a mob
+        and turned into items later with materialize_loot.
+        """
+        return {"factory": self, "count": number_of_items,
+                "tier": loot_tier, "seed": random.getrandbits(32)}
+
+    def materialize_loot(self, recipe, location):
+        """
+        Create the lootset described by recipe at location. This gives
+        exactly the same items as creating them eagerly would have.
+        """
+        return self.create_lootset(recipe["count"], loot_tier=recipe["tier"],
+                                   location=location, seed=recipe["seed"])
+
+    def check_for_uncommon_drop(self, loot_set, location=None, item_name=None):
+        if item_name is None:
+            if random.random() >= .02:
+                return
             item_name = random.choice(self.db.uncommon_items)
-            storage_item = search_object(item_name)[0]
-            loot_item = storage_item.copy()
-            loot_set.append(loot_item)
-        else:
-            return
-            
+        storage_item = search_object(item_name)[0]
+        loot_item = storage_item.copy()
+        if location:
+            loot_item.location = location
+        loot_set.append(loot_item)
 
 
 class MobFactory(Object):
@@ -82,30 +115,41 @@ class MobFactory(Object):
         self.db.item_factory = create_object(ItemFactory, key='%s_loot_factory' % self.id)
         
 
-    def create_mob_set(self, number_of_mobs):
-        self.db.mob_set = []
-            
-        for x in range(0, number_of_mobs):
-            mob_name = random.choice(self.db.mob_names)
-            mob_obj = create_object("game.gamesrc.objects.world.npc.Npc", key=mob_name, location=self)
-            mob_obj.tags.add("%s_mobs" % self.id)
+    def create_mob_set(self, number_of_mobs, location=None):
+        """
+        Spawn a set of mobs in one batch. The mobs are created directly
+        at location (default is the factory itself), so there is no
+        need to move them afterwards.
+        """
+        mob_names = self.db.mob_names
+        level_range = self.db.level_range
+        difficulty = self.db.difficulty
+        prototypes = [{"typeclass": "game.gamesrc.objects.world.npc.Npc",
+                       "key": random.choice(mob_names),
+                       "location": location or self,
+                       "tags": "%s_mobs" % self.id} for x in range(0, number_of_mobs)]
+
+        def setup_mob(mob_obj):
+            "called on each mob before the batch is saved"
             a = mob_obj.db.attributes
-            a['level'] = random.randrange(self.db.level_range[0], self.db.level_range[1])
+            a['level'] = random.randrange(level_range[0], level_range[1])
             mob_obj.db.attributes = a
-            mob_obj.db.difficulty_rating = self.db.difficulty
+            mob_obj.db.difficulty_rating = difficulty
             mob_obj.generate_attributes()
-            self.db.mob_set.append(mob_obj)
-            rn = random.random()
-            if rn >= .20:
+            if random.random() >= .20:
                 self.create_mob_loot(mob_obj)
-        return self.db.mob_set
+
+        mob_set = spawn(*prototypes, at_spawn=setup_mob) if prototypes else []
+        self.db.mob_set = mob_set
+        return mob_set
 
     def create_mob_loot(self, m):
-        print "beginning create_mob_loot"
+        """
+        Give the mob a loot recipe. The actual items are only created
+        when the corpse is looted (see Npc.materialize_loot), so mobs
+        that are never killed and looted cost no item objects.
+        """
         itemf = self.db.item_factory
         rn = random.randrange(0,4)
-        ls = itemf.create_lootset(rn, loot_tier='t1')
-        print ls
-        for i in ls:
-            i.move_to(m, quiet=True)
-        print "done with mob_loot"
+        if rn:
+            m.db.loot_recipe = itemf.create_loot_recipe(rn, loot_tier='t1')
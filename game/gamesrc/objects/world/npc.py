@@ -180,6 +180,21 @@ class Npc(Object):
         l.db.mobs = mobs
         self.tags.add('corpse')
         self.key = "Corpse of %s" % self.name
+
+    def materialize_loot(self):
+        """
+        Create the items described by this mob's loot recipe (set by
+        MobFactory.create_mob_loot) inside the mob. Does nothing if the
+        loot has already been created or the mob has no loot.
+        """
+        recipe = self.db.loot_recipe
+        if not recipe:
+            return []
+        del self.db.loot_recipe
+        factory = recipe.get("factory")
+        if not factory:
+            return []
+        return factory.materialize_loot(recipe, self)
         
 
     
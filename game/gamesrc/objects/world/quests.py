@@ -4,6 +4,90 @@ from src.utils import create, utils
 from ev import Object
 from game.gamesrc.objects import copyreader
 
+# names of the structures checked by the build_* objectives
+_STRUCTURE_NAMES = {'gold_mine': 'Gold Mine',
+                    'training_ground': 'Training Grounds',
+                    'defenses': 'Defenses'}
+
+
+def objective_event_key(objective):
+    """
+    Compile an objective dict into the event key it reacts to, such as
+    "kill:rat", "gather:crafting_materials" or "build:Gold Mine".
+    """
+    otype = objective['type']
+    if otype == 'kill':
+        return 'kill' if 'counter' in objective else None
+    for prefix in ('kill', 'gather', 'use'):
+        if otype.startswith(prefix + '_'):
+            return '%s:%s' % (prefix, otype[len(prefix) + 1:])
+    if otype == 'loot_rare_item':
+        return 'loot:rare'
+    if otype.startswith('build'):
+        for struct, name in _STRUCTURE_NAMES.items():
+            if struct in otype:
+                return 'build:%s' % name
+        return None
+    return otype
+
+
+def mob_event_keys(mob):
+    "All the event keys a kill of this mob triggers."
+    aliases = mob.aliases.all()
+    keys = set(['kill:%s' % mob.name.lower(),
+                'kill:%s' % mob.db.deity])
+    if mob.location:
+        keys.add('kill:%s' % mob.location.db.dungeon_type)
+    if 'kill_%s' % mob.db.mob_type in aliases:
+        keys.add('kill:%s' % mob.db.mob_type)
+    for alias in aliases:
+        if alias.startswith('kill_'):
+            keys.add('kill:%s' % alias[5:])
+    if 'boss_mob' in aliases:
+        keys.add('kill:boss')
+    if 'kill' in aliases:
+        keys.add('kill')
+    return keys
+
+
+def item_event_keys(item):
+    "All the event keys looting this item triggers."
+    keys = set(['gather:%s' % item.db.type,
+                'gather:%s' % item.name.lower()])
+    if item.db.lootset == 'rare':
+        keys.add('loot:rare')
+    return keys
+
+
+def structure_event_keys(structure_manager):
+    "Event keys for the structures already built/levelled in a lair."
+    keys = set('build:%s' % name for name in (structure_manager.db.already_built or ()))
+    structures = structure_manager.db.structures or {}
+    if any(structures[struct].db.level > 1 for struct in structures):
+        keys.add('level_structure')
+    return keys
+
+
+def _index_quest(index, quest_name, quest):
+    "Add the open objectives of quest to the objective index."
+    objectives = quest.db.objectives or {}
+    for objective in objectives:
+        if objectives[objective]['completed']:
+            continue
+        key = objective_event_key(objectives[objective])
+        if key:
+            index.setdefault(key, []).append((quest_name, objective))
+
+
+def _unindex_quest(index, quest_name):
+    "Remove all objectives of the named quest from the objective index."
+    for key in index.keys():
+        entries = [entry for entry in index[key] if entry[0] != quest_name]
+        if entries:
+            index[key] = entries
+        else:
+            del index[key]
+
 
 class QuestManager(Object):
     """
@@ -25,6 +109,8 @@ class QuestManager(Object):
         active_quests = self.db.active_quests
         active_quests['%s' % quest_to_add.name] = quest_to_add
         self.db.active_quests = active_quests
+        if self.ndb.objective_index is not None:
+            _index_quest(self.ndb.objective_index, '%s' % quest_to_add.name, quest_to_add)
 
     def complete_quest(self, quest_to_remove):
         character = self.db.character
@@ -87,74 +173,68 @@ class QuestManager(Object):
         active_quests = self.db.active_quests
         del active_quests[quest_to_remove.name]
         self.db.active_quests = active_quests
+        if self.ndb.objective_index is not None:
+            _unindex_quest(self.ndb.objective_index, quest_to_remove.name)
+
+    def _get_objective_index(self):
+        """
+        Return the objective index, building it from the active quests
+        if needed (it is kept on ndb, so it is rebuilt after a reload).
+        """
+        index = self.ndb.objective_index
+        if index is None:
+            index = {}
+            active_quests = self.db.active_quests
+            for quest_name in active_quests:
+                _index_quest(index, quest_name, active_quests[quest_name])
+            self.ndb.objective_index = index
+        return index
 
     def check_quest_flags(self, mob=None, item=None):
+        """
+        Advance all active objectives matching the killed mob and/or the
+        looted item. Only objectives indexed under one of the event keys
+        of the mob/item are looked at, and the objectives of each quest
+        are assigned only once no matter how many of them advance.
+        """
         character = self.db.character
-        print character.db.lair.db.structure_manager_id
-        structure_manager = self.search(character.db.lair.db.structure_manager_id, location=character.db.lair, global_search=False)
-        active_quests  = self.db.active_quests
-        active_quests_temp = active_quests
-        print "QuestManager.check_quest_flags: Checking active quests"
-        for quest in active_quests_temp:
-            quest_obj = active_quests[quest]
-            quest_objectives = quest_obj.db.objectives
-            print "QuestManager.check_quest_flags: Checking objectives for %s" % quest_obj.name
-            for objective in quest_objectives:
-                print "QuestManager.check_quest_flags: Checking %s" % objective
-                if quest_objectives[objective]['completed']:
-                    continue
-                if mob is not None:
-                    if 'kill_%s' % mob.db.mob_type in quest_objectives[objective]['type']:
-                        if 'kill_%s' % mob.db.mob_type in mob.aliases:
-                            quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif '%s' % quest_objectives[objective]['type'] in mob.aliases:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'kill_%s' % mob.name.lower() in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character) 
-                    elif 'boss_mob' in mob.aliases and 'kill_boss' in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'kill_%s' % mob.db.deity in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character) 
-                    elif 'kill_%s' % mob.location.db.dungeon_type in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'kill' in quest_objectives[objective]['type']:
-                        if 'kill' in mob.aliases and 'counter' in quest_objectives[objective].keys():
-                            quest_obj.tick_counter_objective(objective, caller=self.db.character)                
-                    
-                if item is not None:
-                    if 'gather_%s' % item.db.type in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'gather_%s' % item.name.lower() in quest_objectives[objective]['type']:
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'loot_rare_item' in quest_objectives[objective]['type'] and item.db.lootset == 'rare':
-                        quest_obj.tick_counter_objective(objective, caller=self.db.character)
-                    elif 'build' in quest_objectives[objective]['type']:
-                        if 'gold_mine' in quest_objectives[objective]['type']:
-                            if "Gold Mine" in structure_manager.db.already_built:
-                                quest_obj.tick_counter_objective(objective, caller=character)
-                        elif 'training_ground' in quest_objectives[objective]['type']:
-                            if 'Training Grounds' in structure_manager.db.already_built:
-                                quest_obj.tick_counter_objective(objective, caller=character)
-                        elif 'defenses' in quest_objectives[objective]['type']:
-                            if 'Defenses' in structure_manager.db.already_built:
-                                quest_obj.tick_counter_objective(objective, caller=character)
-                    elif 'level_structure' in quest_objectives[objective]['type']:
-                        for struct in structure_manager.db.structures:
-                            if structure_manager.db.structures[struct].db.level > 1:
-                                quest_obj.tick_counter_objective(objective, caller=character)
-                                break
-                    elif 'use' in quest_objectives[objective]['type']:
-                        command = quest_objectives[objective]['type'].split('_')[1]
-                        print command, character.last_cmd
-                        try:
-                            if character.last_cmd.strip() == command.strip():
-                                quest_obj.tick_counter_objective(objective, caller=character)
-                        except AttributeError:
-                            return
-                        
-                   
+        index = self._get_objective_index()
+        if not index:
+            return
+        keys = set()
+        if mob is not None:
+            keys.update(mob_event_keys(mob))
+        if item is not None:
+            keys.update(item_event_keys(item))
+            if any(key.startswith("build:") or key == "level_structure" for key in index):
+                structure_manager = self.get_structure_manager()
+                if structure_manager is not None:
+                    keys.update(structure_event_keys(structure_manager))
+            last_cmd = getattr(character, "last_cmd", None)
+            if last_cmd:
+                keys.add("use:%s" % last_cmd.strip())
+
+        to_tick = {}
+        for key in keys:
+            for quest_name, objective in index.get(key, ()):
+                to_tick.setdefault(quest_name, set()).add(objective)
+        if not to_tick:
+            return
+        active_quests = self.db.active_quests
+        for quest_name, objectives in to_tick.items():
+            quest_obj = active_quests.get(quest_name)
+            if quest_obj is not None:
+                quest_obj.tick_counter_objectives(objectives, caller=character)
         self.cleanup_completed_quests()
-                            
+
+    def get_structure_manager(self):
+        "Find the structure manager in the character's lair, if any."
+        character = self.db.character
+        lair = character.db.lair
+        if lair is None:
+            return None
+        return self.search(lair.db.structure_manager_id, location=lair, global_search=False)
+
 #    def check_prereqs(self):
           
     def find_quest(self, quest, completed=False):
@@ -264,15 +344,31 @@ class Quest(Object):
         self.check_objectives(objectives,caller)
 
     def tick_counter_objective(self, objective, caller):
-        objectives = self.db.objectives
-        objectives[objective]['counter'] = objectives[objective]['counter'] + 1
-        caller.msg("{yQuest objective advanced! %s: %s/%s{n" % (objectives[objective]['objective_name'], objectives[objective]['counter'], objectives[objective]['threshold']))
-        if objectives[objective]['counter'] > objectives[objective]['threshold']:
-            objectives[objective]['counter'] = objectives[objective]['threshold']
+        self.tick_counter_objectives([objective], caller)
 
-        if objectives[objective]['counter'] >= objectives[objective]['threshold']:
-            self.complete_objective(objectives, objective, caller)
+    def tick_counter_objectives(self, to_tick, caller):
+        """
+        Advance several objectives at once. The objectives are changed
+        on a plain copy which is then saved with a single assignment.
+        Objectives already completed are skipped.
+        """
+        objectives = dict((name, dict(objective)) for name, objective in (self.db.objectives or {}).items())
+        completed = False
+        for objective in to_tick:
+            if objective not in objectives or objectives[objective]['completed']:
+                continue
+            objectives[objective]['counter'] = objectives[objective]['counter'] + 1
+            caller.msg("{yQuest objective advanced! %s: %s/%s{n" % (objectives[objective]['objective_name'], objectives[objective]['counter'], objectives[objective]['threshold']))
+            if objectives[objective]['counter'] > objectives[objective]['threshold']:
+                objectives[objective]['counter'] = objectives[objective]['threshold']
+
+            if objectives[objective]['counter'] >= objectives[objective]['threshold']:
+                objectives[objective]['completed'] = True
+                caller.msg("{yYou have completed a quest objective!{n")
+                completed = True
         self.db.objectives = objectives
+        if completed:
+            self.check_objectives(objectives, caller)
 
     def check_objectives(self, objectives, caller):
         quest_log = caller.db.quest_log
@@ -32,12 +32,11 @@ class Zone(Object):
                 self.db.mob_map['%s' % mob.dbref ] = room
 
             if len(room.db.mobs) < 2:
-                #create mobs
+                #create mobs directly in the room
                 rn = random.randrange(0,10)
-                mob_set = mf.create_mob_set(rn)
-                for mob in mob_set:
-                    mob.move_to(room, quiet=True)
-                    mobs.append(mob)
+                mob_set = mf.create_mob_set(rn, location=room)
+                if mob_set:
+                    room.db.mobs = list(mobs) + mob_set
             else:
                 pass
                 room.db.mobs +=  mob_set
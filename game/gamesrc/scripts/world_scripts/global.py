@@ -1,4 +1,4 @@
-from ev import Script, search_object_tag
+from ev import Script, search_object_tag, managers
 from src.utils import search
 
 class MobRunner(Script):
@@ -68,7 +68,7 @@ class ZoneRunner(Script):
         print "mob_level()"
         [z.figure_mob_levels() for z in self.ndb.subscribers]
         print "corpse delete"
-        [c.delete() for c in self.ndb.corpses if c.db.destroy_me is True]
+        managers.objects.bulk_delete([c for c in self.ndb.corpses if c.db.destroy_me is True])
 
     def at_stop(self):
         self.db.subscribers = [z.dbref for z in self.ndb.subscribers]
@@ -32,6 +32,9 @@ command line. The process is as follows:
 12) We have a unique cmdobject, primed for use. Call all hooks:
     at_pre_cmd(), cmdobj.parse(), cmdobj.func() and finally at_post_cmd().
 
+If command profiling is on (see src.server.profiler), the time, queries
+and messages of each of these phases are recorded per command.
+
 
 """
 
@@ -43,6 +46,7 @@ from django.conf import settings
 from src.comms.channelhandler import CHANNELHANDLER
 from src.utils import logger, utils
 from src.commands.cmdparser import at_multimatch_cmd
+from src.server.profiler import CMD_PROFILER
 from src.utils.utils import string_suggestions, to_unicode
 
 from django.utils.translation import ugettext as _
@@ -107,8 +111,6 @@ def get_and_merge_cmdsets(caller, session, player, obj,
 
     Note that this function returns a deferred!
     """
-    local_obj_cmdsets = [None]
-
     @inlineCallbacks
     def _get_channel_cmdsets(player, player_cmdset):
         "Channel-cmdsets"
@@ -120,9 +122,9 @@ def get_and_merge_cmdsets(caller, session, player, obj,
 
     @inlineCallbacks
     def _get_local_obj_cmdsets(obj, obj_cmdset):
-        "Object-level cmdsets"
+        "Object-level cmdsets, as (cmdset, object) pairs"
         # Gather cmdsets from location, objects in location or carried
-        local_obj_cmdsets = [None]
+        local_obj_cmdsets = []
         try:
             location = obj.location
         except Exception:
@@ -143,14 +145,9 @@ def get_and_merge_cmdsets(caller, session, player, obj,
             # is not seeing e.g. the commands on a fellow player (which is why
             # the no_superuser_bypass must be True)
             local_obj_cmdsets = \
-                yield [lobj.cmdset.current for lobj in local_objlist
-                   if (lobj.cmdset.current and
+                yield [(lobj.cmdset.merged, lobj) for lobj in local_objlist
+                   if (lobj.cmdset.merged and
                    lobj.locks.check(caller, 'call', no_superuser_bypass=True))]
-            for cset in local_obj_cmdsets:
-                #This is necessary for object sets, or we won't be able to
-                # separate the command sets from each other in a busy room.
-                cset.old_duplicates = cset.duplicates
-                cset.duplicates = True
         returnValue(local_obj_cmdsets)
 
     @inlineCallbacks
@@ -161,58 +158,74 @@ def get_and_merge_cmdsets(caller, session, player, obj,
         except Exception:
             logger.log_trace()
         try:
-            returnValue(obj.cmdset.current)
+            returnValue(obj.cmdset.merged)
         except AttributeError:
             returnValue(None)
 
+    # the cmdsets are gathered unbound, as (cmdset, object to bind
+    # it to, is a local object's cmdset)
     if callertype == "session":
         # we are calling the command from the session level
         report_to = session
         session_cmdset = yield _get_cmdset(session)
-        cmdsets = [session_cmdset]
+        cmdsets = [(session_cmdset, session, False)]
         if player:  # this automatically implies logged-in
             player_cmdset = yield _get_cmdset(player)
             channel_cmdset = yield _get_channel_cmdsets(player, player_cmdset)
-            cmdsets.extend([player_cmdset, channel_cmdset])
+            cmdsets.extend([(player_cmdset, player, False), (channel_cmdset, None, False)])
             if obj:
                 obj_cmdset = yield _get_cmdset(obj)
                 local_obj_cmdsets = yield _get_local_obj_cmdsets(obj, obj_cmdset)
-                cmdsets.extend([obj_cmdset] + local_obj_cmdsets)
+                cmdsets.append((obj_cmdset, obj, False))
+                cmdsets.extend((cset, lobj, True) for cset, lobj in local_obj_cmdsets)
     elif callertype == "player":
         # we are calling the command from the player level
         report_to = player
         player_cmdset = yield _get_cmdset(player)
         channel_cmdset = yield _get_channel_cmdsets(player, player_cmdset)
-        cmdsets = [player_cmdset, channel_cmdset]
+        cmdsets = [(player_cmdset, player, False), (channel_cmdset, None, False)]
         if obj:
             obj_cmdset = yield _get_cmdset(obj)
             local_obj_cmdsets = yield _get_local_obj_cmdsets(obj, obj_cmdset)
-            cmdsets.extend([obj_cmdset] + local_obj_cmdsets)
+            cmdsets.append((obj_cmdset, obj, False))
+            cmdsets.extend((cset, lobj, True) for cset, lobj in local_obj_cmdsets)
     elif callertype == "object":
         # we are calling the command from the object level
         report_to = obj
         obj_cmdset = yield _get_cmdset(obj)
         local_obj_cmdsets = yield _get_local_obj_cmdsets(obj, obj_cmdset)
-        cmdsets = [obj_cmdset] + local_obj_cmdsets
+        cmdsets = [(obj_cmdset, obj, False)]
+        cmdsets.extend((cset, lobj, True) for cset, lobj in local_obj_cmdsets)
     else:
         raise Exception("get_and_merge_cmdsets: callertype %s is not valid." % callertype)
     #cmdsets = yield [caller_cmdset] + [player_cmdset] +
     #          [channel_cmdset] + local_obj_cmdsets
 
     # weed out all non-found sets
-    cmdsets = yield [cmdset for cmdset in cmdsets
-                     if cmdset and cmdset.key != "_EMPTY_CMDSET"]
+    cmdsets = yield [source for source in cmdsets
+                     if source[0] and source[0].key != "_EMPTY_CMDSET"]
     # report cmdset errors to user (these should already have been logged)
-    yield [report_to.msg(cmdset.errmessage) for cmdset in cmdsets
-           if cmdset.key == "_CMDSET_ERROR"]
+    yield [report_to.msg(source[0].errmessage) for source in cmdsets
+           if source[0].key == "_CMDSET_ERROR"]
 
     if cmdsets:
         # faster to do tuple on list than to build tuple directly
-        mergehash = tuple([id(cmdset) for cmdset in cmdsets])
+        mergehash = tuple([(id(cset), id(cobj)) for cset, cobj, is_local in cmdsets])
         if mergehash in _CMDSET_MERGE_CACHE:
             # cached merge exist; use that
             cmdset = _CMDSET_MERGE_CACHE[mergehash]
         else:
+            sources = cmdsets
+            # only the sets actually merged are bound to their objects
+            cmdsets = []
+            for cset, cobj, is_local in sources:
+                if cobj is not None:
+                    cset = cset.bind(cobj.cmdset.obj)
+                if is_local:
+                    #This is necessary for object sets, or we won't be able to
+                    # separate the command sets from each other in a busy room.
+                    cset.duplicates = True
+                cmdsets.append(cset)
             # we group and merge all same-prio cmdsets separately (this avoids
             # order-dependent clashes in certain cases, such as
             # when duplicates=True)
@@ -237,13 +250,14 @@ def get_and_merge_cmdsets(caller, session, player, obj,
                 cmdset = yield merging_cmdset + cmdset
             # store the full sets for diagnosis
             cmdset.merged_from = cmdsets
+            # keep the unbound sets and their objects alive while the
+            # merge is cached, so their ids are not reused
+            cmdset.merge_sources = sources
             # cache
             _CMDSET_MERGE_CACHE[mergehash] = cmdset
     else:
         cmdset = None
 
-    for cset in (cset for cset in local_obj_cmdsets if cset):
-        cset.duplicates = cset.old_duplicates
     #print "merged set:", cmdset.key
     returnValue(cmdset)
 
@@ -297,11 +311,17 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
     # we assign the caller with preference 'bottom up'
     caller = obj or player or session
 
+    # measure the phases of the command, if profiling
+    profile = CMD_PROFILER.begin() if CMD_PROFILER.enabled else None
+    profkey = None
+
     try:  # catch bugs in cmdhandler itself
         try:  # catch special-type commands
 
             cmdset = yield get_and_merge_cmdsets(caller, session, player, obj,
                                                   callertype, sessid)
+            if profile:
+                profile.lap("merge")
             if not cmdset:
                 # this is bad and shouldn't happen.
                 raise NoCmdSets
@@ -316,6 +336,8 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
             # This also checks for permissions, so all commands in match
             # are commands the caller is allowed to call.
             matches = yield _COMMAND_PARSER(raw_string, cmdset, caller)
+            if profile:
+                profile.lap("match")
 
             # Deal with matches
 
@@ -373,6 +395,7 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
                 raise ExecSystemCommand(cmd, sysarg)
 
             # A normal command.
+            profkey = cmd.key
 
             # Assign useful variables to the instance
             cmd.caller = caller
@@ -402,17 +425,25 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
 
             # pre-command hook
             abort = yield cmd.at_pre_cmd()
+            if profile:
+                profile.lap("pre_cmd")
             if abort:
                 # abort sequence
                 returnValue(abort)
 
             # Parse and execute
             yield cmd.parse()
+            if profile:
+                profile.lap("parse")
             # (return value is normally None)
             ret = yield cmd.func()
+            if profile:
+                profile.lap("func")
 
             # post-command hook
             yield cmd.at_post_cmd()
+            if profile:
+                profile.lap("post_cmd")
 
             if cmd.save_for_next:
                 # store a reference to this command, possibly
@@ -430,6 +461,7 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
             # or fall back to a return string.
             syscmd = exc.syscmd
             sysarg = exc.sysarg
+            profkey = syscmd.key if syscmd else "(no command)"
             if syscmd:
                 syscmd.caller = caller
                 syscmd.cmdstring = syscmd.key
@@ -449,7 +481,11 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
 
                 # parse and run the command
                 yield syscmd.parse()
+                if profile:
+                    profile.lap("parse")
                 yield syscmd.func()
+                if profile:
+                    profile.lap("func")
             elif sysarg:
                 # return system arg
                 caller.msg(exc.sysarg)
@@ -477,3 +513,7 @@ def cmdhandler(called_by, raw_string, _testing=False, callertype="session", sess
         string += " Please contact an admin and/or file a bug report."
         logger.log_trace(_(string))
         caller.msg(string % format_exc())
+
+    finally:
+        if profile:
+            profile.finish(profkey or "(no command)")
@@ -14,7 +14,8 @@ See CmdHandler for practical examples on how to apply cmdsets
 together to create interesting in-game effects.
 """
 
-from weakref import WeakKeyDictionary
+from bisect import insort
+from copy import copy
 from django.utils.translation import ugettext as _
 from src.utils.utils import inherits_from, is_iter
 __all__ = ("CmdSet",)
@@ -41,6 +42,20 @@ class _CmdSetMeta(type):
         super(_CmdSetMeta, mcs).__init__(*args, **kwargs)
 
 
+def _bind_command(cmd, obj):
+    """
+    Get a copy of cmd with obj as its cmd.obj. Commands already bound
+    to an object are returned as they are.
+    """
+    if getattr(cmd, "obj", None) is not None:
+        return cmd
+    bound = copy(cmd)
+    # the lockhandler must be rebuilt for the copy
+    bound.__dict__.pop("lockhandler", None)
+    bound.obj = obj
+    return bound
+
+
 class CmdSet(object):
     """
     This class describes a unique cmdset that understands priorities. CmdSets
@@ -121,6 +136,12 @@ class CmdSet(object):
                             player can then not even ask staff for help if
                             something goes wrong)
 
+        shared - the cmdsethandler creates only one instance of this
+                 cmdset, shared by all objects carrying it, and binds
+                 its commands to each object (as cmd.obj) when they are
+                 used. Set this to False if at_cmdset_creation depends
+                 on self.cmdsetobj, to get one instance per object.
+
 
     """
     __metaclass__ = _CmdSetMeta
@@ -135,6 +156,9 @@ class CmdSet(object):
     no_channels = False
     permanent = False
     errmessage = ""
+    shared = True
+    # set on the shared instances kept by the cmdsethandler
+    is_template = False
     # pre-store properties to duplicate straight off
     to_duplicate = ("key", "cmdsetobj", "no_exits", "no_objs",
                     "no_channels", "permanent", "mergetype",
@@ -150,7 +174,13 @@ class CmdSet(object):
         """
         if key:
             self.key = key
-        self.commands = []
+        self._commands = []
+        # index of the commands: {key or alias: positions in
+        # self.commands, in order} and {key: number of commands}
+        self._names = {}
+        self._keys = {}
+        # {id(cmd): position}
+        self._positions = {}
         self.system_commands = []
         self.actual_mergetype = self.mergetype
         self.cmdsetobj = cmdsetobj
@@ -160,20 +190,70 @@ class CmdSet(object):
 
         # initialize system
         self.at_cmdset_creation()
-        self._contains_cache = WeakKeyDictionary()#{}
+
+    # the command storage. self.commands can be read and replaced,
+    # but must not be changed in-place since that bypasses the index.
+
+    def _get_commands(self):
+        return self._commands
+
+    def _set_commands(self, commands):
+        "Replace all commands"
+        self._commands = []
+        self._names, self._keys, self._positions = {}, {}, {}
+        for cmd in commands:
+            self._index(cmd, len(self._commands))
+            self._commands.append(cmd)
+
+    commands = property(_get_commands, _set_commands)
+
+    def _index(self, cmd, pos):
+        "Add cmd, stored at pos, to the index"
+        # an instance can be stored more than once (by a Union with
+        # duplicates); we remember where it is first
+        positions = self._positions
+        if positions.get(id(cmd), pos) >= pos:
+            positions[id(cmd)] = pos
+        self._keys[cmd.key] = self._keys.get(cmd.key, 0) + 1
+        names = self._names
+        for name in cmd._matchset:
+            if name in names:
+                insort(names[name], pos)
+            else:
+                names[name] = [pos]
+
+    def _unindex(self, cmd, pos):
+        "Remove cmd, stored at pos, from the index"
+        if self._positions.get(id(cmd)) == pos:
+            del self._positions[id(cmd)]
+        if self._keys[cmd.key] > 1:
+            self._keys[cmd.key] -= 1
+        else:
+            del self._keys[cmd.key]
+        names = self._names
+        for name in cmd._matchset:
+            names[name].remove(pos)
+            if not names[name]:
+                del names[name]
+
+    def _first_match(self, cmd):
+        """
+        Position of the first command matching cmd (a command or a
+        key string) - the one 'cmd == command' is True for - or None.
+        """
+        positions = self._names.get(getattr(cmd, "key", cmd))
+        return positions[0] if positions else None
 
     # Priority-sensitive merge operations for cmdsets
 
     def _union(self, cmdset_a, cmdset_b):
         "C = A U B. CmdSet A is assumed to have higher priority"
         cmdset_c = cmdset_a._duplicate()
-        # we make copies, not refs by use of [:]
-        cmdset_c.commands = cmdset_a.commands[:]
         if cmdset_a.duplicates and cmdset_a.priority == cmdset_b.priority:
-            cmdset_c.commands.extend(cmdset_b.commands)
+            cmdset_c.commands = cmdset_a.commands + cmdset_b.commands
         else:
-            cmdset_c.commands.extend([cmd for cmd in cmdset_b
-                                      if not cmd in cmdset_a])
+            cmdset_c.commands = cmdset_a.commands + [cmd for cmd in cmdset_b
+                                                     if not cmd in cmdset_a]
         return cmdset_c
 
     def _intersect(self, cmdset_a, cmdset_b):
@@ -182,7 +262,9 @@ class CmdSet(object):
         if cmdset_a.duplicates and cmdset_a.priority == cmdset_b.priority:
             for cmd in [cmd for cmd in cmdset_a if cmd in cmdset_b]:
                 cmdset_c.add(cmd)
-                cmdset_c.add(cmdset_b.get(cmd))
+                cmd_b = cmdset_b.get(cmd)
+                if cmd_b:
+                    cmdset_c.add(cmd_b)
         else:
             cmdset_c.commands = [cmd for cmd in cmdset_a if cmd in cmdset_b]
         return cmdset_c
@@ -190,7 +272,7 @@ class CmdSet(object):
     def _replace(self, cmdset_a, cmdset_b):
         "C = A + B where the result is A."
         cmdset_c = cmdset_a._duplicate()
-        cmdset_c.commands = cmdset_a.commands[:]
+        cmdset_c.commands = cmdset_a.commands
         return cmdset_c
 
     def _remove(self, cmdset_a, cmdset_b):
@@ -228,6 +310,20 @@ class CmdSet(object):
         #cmdset.key_mergetypes = self.key_mergetypes.copy() #copy.deepcopy(self.key_mergetypes)
         #return cmdset
 
+    def bind(self, cmdsetobj):
+        """
+        Returns a copy of this cmdset with its commands bound to
+        cmdsetobj (as cmd.obj). This is how the cmdsethandler makes
+        per-object cmdsets out of the shared ones; commands already
+        bound to an object keep their binding.
+        """
+        cmdset = self._duplicate()
+        cmdset.cmdsetobj = cmdsetobj
+        cmdset.actual_mergetype = self.actual_mergetype
+        cmdset.commands = [_bind_command(cmd, cmdsetobj) for cmd in self.commands]
+        cmdset.system_commands = [cmd for cmd in cmdset.commands if cmd.key.startswith("__")]
+        return cmdset
+
     def __str__(self):
         """
         Show all commands in cmdset when printing it.
@@ -246,11 +342,14 @@ class CmdSet(object):
         by command name and aliases). This allows for things
         like 'if cmd in cmdset'
         """
-        ret = self._contains_cache.get(othercmd)
-        if ret is None:
-            ret = othercmd in self.commands
-            self._contains_cache[othercmd] = ret
-        return ret
+        try:
+            # a command matches if the key of one of ours is among
+            # its key and aliases
+            keys = self._keys
+            return any(name in keys for name in othercmd._matchset)
+        except AttributeError:
+            # a string matches any of our keys and aliases
+            return othercmd in self._names
 
     def __add__(self, cmdset_b):
         """
@@ -363,19 +462,30 @@ class CmdSet(object):
             cmds = [self._instantiate(c) for c in cmd]
         else:
             cmds = [self._instantiate(cmd)]
-        commands = self.commands
+        commands = self._commands
         system_commands = self.system_commands
         for cmd in cmds:
             # add all commands
             if not hasattr(cmd, 'obj'):
                 cmd.obj = self.cmdsetobj
-            try:
-                ic = commands.index(cmd)
-                commands[ic] = cmd  # replace
-            except ValueError:
+            pos = self._first_match(cmd)
+            oldpos = self._positions.get(id(cmd))
+            if oldpos is not None:
+                if pos != oldpos or self._keys[cmd.key] > 1:
+                    # already here; move it to replace the first match
+                    # (identical instances are only kept once)
+                    commands[pos] = cmd
+                    self.commands = [other for ipos, other in enumerate(commands)
+                                     if other is not cmd or ipos == pos]
+                    commands = self._commands
+            elif pos is not None:
+                # replace
+                self._unindex(commands[pos], pos)
+                commands[pos] = cmd
+                self._index(cmd, pos)
+            else:
+                self._index(cmd, len(commands))
                 commands.append(cmd)
-            # extra run to make sure to avoid doublets
-            self.commands = list(set(commands))
             #print "In cmdset.add(cmd):", self.key, cmd
             # add system_command to separate list as well,
             # for quick look-up
@@ -392,7 +502,8 @@ class CmdSet(object):
         cmd can be either a cmd instance or a key string.
         """
         cmd = self._instantiate(cmd)
-        self.commands = [oldcmd for oldcmd in self.commands if oldcmd != cmd]
+        self.commands = [oldcmd for oldcmd in self._commands if oldcmd != cmd]
+        self.system_commands = [oldcmd for oldcmd in self.system_commands if oldcmd != cmd]
 
     def get(self, cmd):
         """
@@ -400,14 +511,13 @@ class CmdSet(object):
         given command. cmd may be either a command instance or
         a key string.
         """
-        cmd = self._instantiate(cmd)
-        for thiscmd in self.commands:
-            if thiscmd == cmd:
-                return thiscmd
+        pos = self._first_match(self._instantiate(cmd))
+        if pos is not None:
+            return self._commands[pos]
 
     def count(self):
         "Return number of commands in set"
-        return len(self.commands)
+        return len(self._commands)
 
     def get_system_cmds(self):
         """
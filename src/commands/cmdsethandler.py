@@ -62,6 +62,16 @@ Since any number of CommandSets can be piled on top of each other, you
 can then implement separate sets for different situations. For
 example, you can have a 'On a boat' set, onto which you then tack on
 the 'Fishing' set. Fishing from a boat? No problem!
+
+Cmdsets added by python path or class are not instantiated for every
+object. The handler uses one shared instance (a template) of each
+cmdset class, and merged stacks of such templates are shared too. The
+merged set is only bound to the handler's object (giving each command
+its cmd.obj) when the cmdhandler merges it for a command, or when
+handler.current is read. The bound copy is not kept. Thousands of objects
+carrying the same cmdsets thus don't each hold a copy of all their
+commands. Cmdset classes with shared=False, and cmdsets added as
+instances, are used as they are.
 """
 from django.conf import settings
 from src.utils import logger, utils
@@ -69,10 +79,14 @@ from src.commands.cmdset import CmdSet
 from src.server.models import ServerConfig
 
 from django.utils.translation import ugettext as _
-__all__ = ("import_cmdset", "CmdSetHandler")
+__all__ = ("import_cmdset", "get_template", "CmdSetHandler")
 
 _CACHED_CMDSETS = {}
 _CMDSET_PATHS = utils.make_iter(settings.CMDSET_PATHS)
+# shared cmdset instances {(path, permanent): cmdset}
+_CMDSET_TEMPLATES = {}
+# merged stacks of templates {stack ids: (stack, merged, mergetypes)}
+_MERGED_TEMPLATES = {}
 
 class _ErrorCmdSet(CmdSet):
     "This is a special cmdset used to report errors"
@@ -85,7 +99,30 @@ class _EmptyCmdSet(CmdSet):
     priority = -101
     mergetype = "Union"
 
-def import_cmdset(path, cmdsetobj, emit_to_obj=None, no_logging=False):
+
+def get_template(cmdsetclass, cmdsetobj=None, permanent=False):
+    """
+    Get the shared instance of cmdsetclass. Shared instances are
+    never bound to an object and must not be modified. If the class
+    is not shared (shared=False), a new instance for cmdsetobj is
+    returned instead.
+    """
+    if not cmdsetclass.shared:
+        cmdset = cmdsetclass(cmdsetobj)
+        cmdset.permanent = permanent
+        return cmdset
+    key = (cmdsetclass.path, permanent)
+    template = _CMDSET_TEMPLATES.get(key)
+    if not template or template.__class__ is not cmdsetclass:
+        template = cmdsetclass()
+        template.permanent = permanent
+        template.is_template = True
+        _CMDSET_TEMPLATES[key] = template
+    return template
+
+
+def import_cmdset(path, cmdsetobj, emit_to_obj=None, no_logging=False,
+                  template=False, permanent=False):
     """
     This helper function is used by the cmdsethandler to load a cmdset
     instance from a python module, given a python_path. It's usually accessed
@@ -99,6 +136,9 @@ def import_cmdset(path, cmdsetobj, emit_to_obj=None, no_logging=False):
     no_logging - don't log/send error messages. This can be useful
                 if import_cmdset is just used to check if this is a
                 valid python path or not.
+    template - return the shared instance of the cmdset (see
+               get_template) instead of a new one.
+    permanent - set the permanent flag of the returned cmdset.
     function returns None if an error was encountered or path not found.
     """
 
@@ -119,8 +159,11 @@ def import_cmdset(path, cmdsetobj, emit_to_obj=None, no_logging=False):
                 cmdsetclass = module.__dict__[classname]
                 _CACHED_CMDSETS[wanted_cache_key] = cmdsetclass
             #instantiate the cmdset (and catch its errors)
+            if template:
+                return get_template(cmdsetclass, cmdsetobj, permanent)
             if callable(cmdsetclass):
                 cmdsetclass = cmdsetclass(cmdsetobj)
+                cmdsetclass.permanent = permanent
             return cmdsetclass
         except ImportError, e:
             errstring += _("Error loading cmdset '%s': %s.")
@@ -172,10 +215,10 @@ class CmdSetHandler(object):
 
         # the id of the "merged" current cmdset for easy access.
         self.key = None
-        # this holds the "merged" current command set
-        self.current = None
+        # this holds the "merged" current command set (not bound to obj)
+        self._current = None
         # this holds a history of CommandSets
-        self.cmdset_stack = [_EmptyCmdSet(cmdsetobj=self.obj)]
+        self.cmdset_stack = [get_template(_EmptyCmdSet)]
         # this tracks which mergetypes are actually in play in the stack
         self.mergetype_stack = ["Union"]
 
@@ -207,36 +250,69 @@ class CmdSetHandler(object):
             string += "\n"
 
         # Display the currently active cmdset, limited by self.obj's permissions
+        current = self._current
         mergetype = self.mergetype_stack[-1]
-        if mergetype != self.current.mergetype:
+        if mergetype != current.mergetype:
             merged_on = self.cmdset_stack[-2].key
             mergetype = _("custom %(mergetype)s on cmdset '%(merged_on)s'") % \
                           {"mergetype": mergetype, "merged_on":merged_on}
         if mergelist:
             string += _(" <Merged %(mergelist)s (%(mergetype)s, prio %(prio)i)>: %(current)s") % \
                     {"mergelist": "+".join(mergelist),
-                     "mergetype": mergetype, "prio": self.current.priority,
-                     "current":self.current}
+                     "mergetype": mergetype, "prio": current.priority,
+                     "current": current}
         else:
             permstring = "non-perm"
-            if self.current.permanent:
+            if current.permanent:
                 permstring = "perm"
             string += _(" <%(key)s (%(mergetype)s, prio %(prio)i, %(permstring)s)>: %(keylist)s") % \
-                     {"key": self.current.key, "mergetype": mergetype,
-                      "prio": self.current.priority, "permstring": permstring,
-                      "keylist": ", ".join(cmd.key for cmd in sorted(self.current, key=lambda o: o.key))}
+                     {"key": current.key, "mergetype": mergetype,
+                      "prio": current.priority, "permstring": permstring,
+                      "keylist": ", ".join(cmd.key for cmd in sorted(current, key=lambda o: o.key))}
         return string.strip()
 
-    def _import_cmdset(self, cmdset_path, emit_to_obj=None):
+    @property
+    def merged(self):
+        """
+        The merged cmdset of the stack, as shared between objects
+        (its commands are not bound to this handler's object).
+        """
+        return self._current
+
+    @property
+    def current(self):
+        """
+        The merged cmdset of the stack, with its commands bound to
+        this handler's object. This is a new copy on every read.
+        """
+        if self._current is None:
+            return None
+        return self._current.bind(self.obj)
+
+    def _import_cmdset(self, cmdset_path, emit_to_obj=None, permanent=False):
         """
         Method wrapper for import_cmdset.
         load a cmdset from a module.
         cmdset_path - the python path to an cmdset object.
         emit_to_obj - object to send error messages to
+        permanent - get the permanent version of the cmdset
         """
         if not emit_to_obj:
             emit_to_obj = self.obj
-        return import_cmdset(cmdset_path, self.obj, emit_to_obj)
+        return import_cmdset(cmdset_path, self.obj, emit_to_obj,
+                             template=True, permanent=permanent)
+
+    def _load_cmdset(self, cmdset, emit_to_obj=None, permanent=False):
+        """
+        Get the cmdset to put in the stack from a python path, a
+        cmdset class or a cmdset instance (used as-is).
+        """
+        if isinstance(cmdset, basestring):
+            return self._import_cmdset(cmdset, emit_to_obj, permanent)
+        if callable(cmdset):
+            return get_template(cmdset, self.obj, permanent)
+        cmdset.permanent = permanent
+        return cmdset
 
     def update(self, init_mode=False):
         """
@@ -254,13 +330,21 @@ class CmdSetHandler(object):
                 self.cmdset_stack = []
                 for pos, path in enumerate(storage):
                     if pos == 0 and not path:
-                        self.cmdset_stack = [_EmptyCmdSet(cmdsetobj=self.obj)]
+                        self.cmdset_stack = [get_template(_EmptyCmdSet)]
                     elif path:
-                        cmdset = self._import_cmdset(path)
+                        cmdset = self._import_cmdset(path, permanent=True)
                         if cmdset:
-                            cmdset.permanent = cmdset.key != '_CMDSET_ERROR'
                             self.cmdset_stack.append(cmdset)
 
+        stack_key = None
+        if all(cmdset.is_template for cmdset in self.cmdset_stack):
+            # stacks of shared cmdsets merge the same way for everyone
+            stack_key = tuple(id(cmdset) for cmdset in self.cmdset_stack)
+            merged = _MERGED_TEMPLATES.get(stack_key)
+            if merged:
+                self._current, self.mergetype_stack = merged[1], list(merged[2])
+                return
+
         # merge the stack into a new merged cmdset
         new_current = None
         self.mergetype_stack = []
@@ -271,7 +355,11 @@ class CmdSetHandler(object):
             except TypeError:
                 continue
             self.mergetype_stack.append(new_current.actual_mergetype)
-        self.current = new_current
+        self._current = new_current
+        if stack_key:
+            # the stack is stored too, so its ids can't be reused
+            _MERGED_TEMPLATES[stack_key] = (tuple(self.cmdset_stack), new_current,
+                                            tuple(self.mergetype_stack))
 
     def add(self, cmdset, emit_to_obj=None, permanent=False):
         """
@@ -296,23 +384,16 @@ class CmdSetHandler(object):
         """
         if not (isinstance(cmdset, basestring) or utils.inherits_from(cmdset, CmdSet)):
             raise Exception(_("Only CmdSets can be added to the cmdsethandler!"))
-        if callable(cmdset):
-            cmdset = cmdset(self.obj)
-        elif isinstance(cmdset, basestring):
-            # this is (maybe) a python path. Try to import from cache.
-            cmdset = self._import_cmdset(cmdset)
+        cmdset = self._load_cmdset(cmdset, emit_to_obj, permanent)
         if cmdset and cmdset.key != '_CMDSET_ERROR':
-            if permanent and cmdset.key != '_CMDSET_ERROR':
+            if permanent:
                 # store the path permanently
-                cmdset.permanent = True
                 storage = self.obj.cmdset_storage
                 if not storage:
                     storage = ["", cmdset.path]
                 else:
                     storage.append(cmdset.path)
                 self.obj.cmdset_storage = storage
-            else:
-                cmdset.permanent = False
             self.cmdset_stack.append(cmdset)
             self.update()
 
@@ -326,13 +407,9 @@ class CmdSetHandler(object):
         permanent - save cmdset across reboots
         See also the notes for self.add(), which applies here too.
         """
-        if callable(cmdset):
-            if not utils.inherits_from(cmdset, CmdSet):
-                raise Exception(_("Only CmdSets can be added to the cmdsethandler!"))
-            cmdset = cmdset(self.obj)
-        elif isinstance(cmdset, basestring):
-            # this is (maybe) a python path. Try to import from cache.
-            cmdset = self._import_cmdset(cmdset)
+        if callable(cmdset) and not utils.inherits_from(cmdset, CmdSet):
+            raise Exception(_("Only CmdSets can be added to the cmdsethandler!"))
+        cmdset = self._load_cmdset(cmdset, emit_to_obj, permanent)
         if cmdset and cmdset.key != '_CMDSET_ERROR':
             if self.cmdset_stack:
                 self.cmdset_stack[0] = cmdset
@@ -341,16 +418,13 @@ class CmdSetHandler(object):
                 self.cmdset_stack = [cmdset]
                 self.mergetype_stack = [cmdset.mergetype]
 
-            if permanent and cmdset.key != '_CMDSET_ERROR':
-                cmdset.permanent = True
+            if permanent:
                 storage = self.obj.cmdset_storage
                 if storage:
                     storage[0] = cmdset.path
                 else:
                     storage = [cmdset.path]
                 self.obj.cmdset_storage = storage
-            else:
-                cmdset.permanent = False
             self.update()
 
     def delete(self, cmdset=None):
@@ -420,9 +494,9 @@ class CmdSetHandler(object):
                 else:
                     storage = [""]
                 self.cmdset_storage = storage
-            self.cmdset_stack[0] = _EmptyCmdSet(cmdsetobj=self.obj)
+            self.cmdset_stack[0] = get_template(_EmptyCmdSet)
         else:
-            self.cmdset_stack = [_EmptyCmdSet(cmdsetobj=self.obj)]
+            self.cmdset_stack = [get_template(_EmptyCmdSet)]
         self.update()
 
     def all(self):
@@ -467,7 +541,8 @@ class CmdSetHandler(object):
                 new_cmdset_stack.append(cmdset)
                 new_mergetype_stack.append("Union")
             else:
-                new_cmdset_stack.append(self._import_cmdset(cmdset.path))
+                new_cmdset_stack.append(self._import_cmdset(cmdset.path,
+                                                            permanent=cmdset.permanent))
                 new_mergetype_stack.append(cmdset.mergetype)
         self.cmdset_stack = new_cmdset_stack
         self.mergetype_stack = new_mergetype_stack
@@ -184,7 +184,7 @@ class Command(object):
         code-duplication here rather than issuing a method-lookup to __eq__.
         """
         try:
-            return not cmd.key in self._matcheset
+            return not cmd.key in self._matchset
         except AttributeError:
             return not cmd in self._matchset
 
@@ -276,7 +276,8 @@ class CmdBatchCommands(MuxCommand):
             caller.msg("Running Batch-command processor - Automatic mode for %s (this might take some time) ..." % python_path)
 
             procpool = False
-            if "PythonProcPool" in utils.server_services():
+            services = utils.server_services()
+            if "PythonProcPool" in services or "EvenniaProcessPool" in services:
                 if utils.uses_database("sqlite3"):
                     caller.msg("Batchprocessor disabled ProcPool under SQLite3.")
                 else:
@@ -384,7 +385,8 @@ class CmdBatchCode(MuxCommand):
             caller.msg("Running Batch-code processor - Automatic mode for %s ..." % python_path)
 
             procpool = False
-            if "PythonProcPool" in utils.server_services():
+            services = utils.server_services()
+            if "PythonProcPool" in services or "EvenniaProcessPool" in services:
                 if utils.uses_database("sqlite3"):
                     caller.msg("Batchprocessor disabled ProcPool under SQLite3.")
                 else:
@@ -5,7 +5,8 @@ Building and world design commands
 
 """
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Q, Max
+from twisted.internet.threads import deferToThread
 from src.objects.models import ObjectDB
 from src.locks.lockhandler import LockException
 from src.commands.default.muxcommand import MuxCommand
@@ -32,6 +33,8 @@ except ImportError:
     _LITERAL_EVAL = None
 
 # used by @find
+_FIND_PAGE_SIZE = 50
+_FIND_CHUNK_SIZE = 1000
 CHAR_TYPECLASS = settings.BASE_CHARACTER_TYPECLASS
 ROOM_TYPECLASS = settings.BASE_ROOM_TYPECLASS
 EXIT_TYPECLASS = settings.BASE_EXIT_TYPECLASS
@@ -1323,7 +1326,7 @@ class CmdSetAttribute(ObjManipCommand):
                 # deleting the attribute(s)
                 for attr in attrs:
                     if obj.attributes.has(attr):
-                        val = obj.attributes.has(attr)
+                        val = obj.attributes.get(attr)
                         obj.attributes.remove(attr)
                         string += "\nDeleted attribute '%s' (= %s) from %s." % (attr, val, obj.name)
                     else:
@@ -1709,7 +1712,7 @@ class CmdExamine(ObjManipCommand):
         string += "\n{wLocks{n:%s" % locks_string
 
 
-        if not (len(obj.cmdset.all()) == 1 and obj.cmdset.current.key == "_EMPTY_CMDSET"):
+        if not (len(obj.cmdset.all()) == 1 and obj.cmdset.merged.key == "_EMPTY_CMDSET"):
             stored_cmdsets = obj.cmdset.all()
             stored_cmdsets.sort(key=lambda x: x.priority, reverse=True)
             string += "\n{wStored Cmdset(s){n:\n %s" % ("\n ".join("%s [%s] (%s, prio %s)" % \
@@ -1845,24 +1848,86 @@ class CmdExamine(ObjManipCommand):
                 get_and_merge_cmdsets(obj, self.session, self.player, obj, mergemode).addCallback(get_cmdset_callback)
 
 
+def _find_typeclass_ok(path, typeclasses, cache):
+    """
+    Check if the typeclass at path inherits from all of the given
+    typeclass paths. Results are cached per path in cache.
+    """
+    if not typeclasses:
+        return True
+    if path not in cache:
+        try:
+            modpath, clsname = path.rsplit(".", 1)
+            typeclass = utils.variable_from_module(modpath, clsname)
+        except Exception:
+            typeclass = None
+        cache[path] = bool(typeclass) and all(inherits_from(typeclass, parent)
+                                              for parent in typeclasses)
+    return cache[path]
+
+
+def _find_scan(state):
+    """
+    Find the next page of @find results, adding them to state["page"].
+    The objects table is read in windows of ids, each continuing after
+    state["last_id"], so every query is bounded by the primary key
+    however few rows match, and no scan ever holds more than a window
+    of rows in memory. Setting state["cancelled"] aborts the scan
+    between windows.
+
+    This is run in a thread.
+    """
+    if state["max_id"] is None:
+        max_id = ObjectDB.objects.aggregate(Max("id"))["id__max"] or 0
+        state["max_id"] = min(max_id, state["high"]) if state["high"] is not None else max_id
+    page = state["page"]
+    while len(page) < state["pagesize"] and not state["cancelled"]:
+        if state["last_id"] >= state["max_id"]:
+            # we have seen the last matching row
+            state["done"] = True
+            break
+        window_end = state["last_id"] + _FIND_CHUNK_SIZE
+        rows = list(ObjectDB.objects.filter(state["query"], id__gt=state["last_id"], id__lte=window_end)
+                    .order_by("id").values_list("id", "db_key", "db_typeclass_path"))
+        for row in rows:
+            if row[0] <= state["last_id"]:
+                # the same object matched on several aliases
+                continue
+            state["last_id"] = row[0]
+            if _find_typeclass_ok(row[2], state["typeclasses"], state["typeclass_cache"]):
+                page.append(row)
+                if len(page) >= state["pagesize"]:
+                    break
+        else:
+            # the whole window was read
+            state["last_id"] = window_end
+
+
 class CmdFind(MuxCommand):
     """
     search the database for objects
 
     Usage:
       @find[/switches] <name or dbref or *player> [= dbrefmin[-dbrefmax]]
+      @find/more
+      @find/stop
 
     Switches:
       room - only look for rooms (location=None)
       exit - only look for exits (destination!=None)
       char - only look for characters (BASE_CHARACTER_TYPECLASS)
       exact- only exact matches are returned.
+      more - show the next page of matches of the last search
+      stop - cancel the last search
 
     Searches the database for an object of a particular name or exact #dbref.
     Use *playername to search for a player. The switches allows for
     limiting object matches to certain game entities. Dbrefmin and dbrefmax
     limits matches to within the given dbrefs range, or above/below if only
     one is given.
+
+    Name searches run in the background and show their matches one
+    page at a time. Use @find/more to continue and @find/stop to abort.
     """
 
     key = "@find"
@@ -1875,12 +1940,31 @@ class CmdFind(MuxCommand):
         caller = self.caller
         switches = self.switches
 
+        if "stop" in switches:
+            state = caller.ndb._find_state
+            if state and not state["done"]:
+                state["cancelled"] = True
+                caller.ndb._find_state = None
+                caller.msg("Search cancelled.")
+            else:
+                caller.msg("No search to cancel.")
+            return
+        if "more" in switches:
+            state = caller.ndb._find_state
+            if not state or state["done"]:
+                caller.msg("No more matches.")
+            elif state["running"]:
+                caller.msg("Still searching ...")
+            else:
+                self.next_page(state)
+            return
+
         if not self.args:
             caller.msg("Usage: @find <string> [= low [-high]]")
             return
 
         searchstring = self.lhs
-        low, high = 1, ObjectDB.objects.all().order_by("-id")[0].id
+        low, high = 1, None
         if self.rhs:
             if "-" in self.rhs:
                 # also support low-high syntax
@@ -1891,9 +1975,9 @@ class CmdFind(MuxCommand):
             if limlist and limlist[0].isdigit():
                 low = max(low, int(limlist[0]))
             if len(limlist) > 1 and limlist[1].isdigit():
-                high = min(high, int(limlist[1]))
-        low = min(low, high)
-        high = max(low, high)
+                high = int(limlist[1])
+        if high is not None:
+            low, high = min(low, high), max(low, high)
 
         is_dbref = utils.dbref(searchstring)
         is_player = searchstring.startswith("*")
@@ -1901,18 +1985,19 @@ class CmdFind(MuxCommand):
         restrictions = ""
         if self.switches:
             restrictions = ", %s" % (",".join(self.switches))
+        interval = "#%i-%s%s" % (low, "#%i" % high if high is not None else "", restrictions)
 
         if is_dbref or is_player:
 
             if is_dbref:
                 # a dbref search
                 result = caller.search(searchstring, global_search=True, quiet=True)
-                string = "{wExact dbref match{n(#%i-#%i%s):" % (low, high, restrictions)
+                string = "{wExact dbref match{n(%s):" % interval
             else:
                 # a player search
                 searchstring = searchstring.lstrip("*")
                 result = caller.search_player(searchstring, quiet=True)
-                string = "{wMatch{n(#%i-#%i%s):" % (low, high, restrictions)
+                string = "{wMatch{n(%s):" % interval
 
             if "room" in switches:
                 result = result if inherits_from(result, ROOM_TYPECLASS) else None
@@ -1923,53 +2008,98 @@ class CmdFind(MuxCommand):
 
             if not result:
                 string += "\n   {RNo match found.{n"
-            elif not low <= int(result[0].id) <= high:
+            elif not low <= int(result[0].id) <= (high if high is not None else result[0].id):
                 string += "\n   {RNo match found for '%s' in #dbref interval.{n" % (searchstring)
             else:
                 result=result[0]
                 string += "\n{g   %s(%s) - %s{n" % (result.key, result.dbref,
                                                     result.typeclass.path)
+            caller.msg(string.strip())
+            return
+
+        # Not a player/dbref search but a wider search; build a query
+        # for key and aliases and scan for it in the background.
+        limits = Q(id__gte=low) & (Q(id__lte=high) if high is not None else Q())
+        if "exact" in switches:
+            keyquery = Q(db_key__iexact=searchstring)
+            aliasquery = Q(db_tags__db_key__iexact=searchstring,
+                           db_tags__db_tagtype__iexact="alias")
         else:
-            # Not a player/dbref search but a wider search; build a queryset.
-            # Searchs for key and aliases
-            if "exact" in switches:
-                keyquery = Q(db_key__iexact=searchstring, id__gte=low, id__lte=high)
-                aliasquery = Q(db_tags__db_key__iexact=searchstring,
-                               db_tags__db_tagtype__iexact="alias",id__gte=low, id__lte=high)
-            else:
-                keyquery = Q(db_key__istartswith=searchstring, id__gte=low, id__lte=high)
-                aliasquery = Q(db_tags__db_key__istartswith=searchstring,
-                               db_tags__db_tagtype__iexact="alias", id__gte=low, id__lte=high)
-
-            results = ObjectDB.objects.filter(keyquery | aliasquery).distinct()
-            nresults = results.count()
-
-            if nresults:
-                # convert result to typeclasses.
-                results = [result.typeclass for result in results]
-                if "room" in switches:
-                    results = [obj for obj in results if inherits_from(obj, ROOM_TYPECLASS)]
-                if "exit" in switches:
-                    results = [obj for obj in results if inherits_from(obj, EXIT_TYPECLASS)]
-                if "char" in switches:
-                    results = [obj for obj in results if inherits_from(obj, CHAR_TYPECLASS)]
-                nresults = len(results)
-
-            # still results after type filtering?
-            if nresults:
-                if nresults > 1:
-                    string = "{w%i Matches{n(#%i-#%i%s):" % (nresults, low, high, restrictions)
-                    for res in results:
-                        string += "\n   {g%s(%s) - %s{n" % (res.key, res.dbref, res.path)
+            keyquery = Q(db_key__istartswith=searchstring)
+            aliasquery = Q(db_tags__db_key__istartswith=searchstring,
+                           db_tags__db_tagtype__iexact="alias")
+        typeclasses = [typeclass for switch, typeclass in (("room", ROOM_TYPECLASS),
+                                                           ("exit", EXIT_TYPECLASS),
+                                                           ("char", CHAR_TYPECLASS))
+                       if switch in switches]
+
+        old_state = caller.ndb._find_state
+        if old_state:
+            # a new search replaces any old one
+            old_state["cancelled"] = True
+        state = {"query": limits & (keyquery | aliasquery),
+                 "typeclasses": typeclasses,
+                 "typeclass_cache": {},
+                 "searchstring": searchstring,
+                 "interval": interval,
+                 "pagesize": _FIND_PAGE_SIZE,
+                 "last_id": low - 1,
+                 "high": high,
+                 "max_id": None,
+                 "page": [],
+                 "nfound": 0,
+                 "running": False,
+                 "cancelled": False,
+                 "done": False}
+        caller.ndb._find_state = state
+        self.next_page(state)
+
+    def next_page(self, state):
+        """
+        Show the next page of matches. The objects are scanned in a
+        thread and the page is shown when it is full or the scan is
+        done.
+        """
+        caller = self.caller
+
+        def _show_page(*args):
+            "Report the page; called in the main thread"
+            state["running"] = False
+            if state["cancelled"]:
+                return
+            page, state["page"] = state["page"], []
+            nfound = state["nfound"] + len(page)
+            if state["done"] and not state["nfound"]:
+                # all matches fit on one page
+                if not page:
+                    string = "{wMatch{n(%s):" % state["interval"]
+                    string += "\n   {RNo matches found for '%s'{n" % state["searchstring"]
+                elif len(page) == 1:
+                    string = "{wOne Match{n(%s):" % state["interval"]
                 else:
-                    string = "{wOne Match{n(#%i-#%i%s):" % (low, high, restrictions)
-                    string += "\n   {g%s(%s) - %s{n" % (results[0].key, results[0].dbref, results[0].path)
+                    string = "{w%i Matches{n(%s):" % (nfound, state["interval"])
+            elif not page:
+                string = "{wNo more matches{n(%s)." % state["interval"]
+            else:
+                string = "{wMatches %i-%i{n(%s):" % (state["nfound"] + 1, nfound, state["interval"])
+            for dbid, key, path in page:
+                string += "\n   {g%s(#%i) - %s{n" % (key, dbid, path)
+            state["nfound"] = nfound
+            if state["done"]:
+                if caller.ndb._find_state is state:
+                    caller.ndb._find_state = None
             else:
-                string = "{wMatch{n(#%i-#%i%s):" % (low, high, restrictions)
-                string += "\n   {RNo matches found for '%s'{n" % searchstring
+                string += "\n{wUse @find/more for more matches or @find/stop to end the search.{n"
+            caller.msg(string.strip())
 
-        # send result
-        caller.msg(string.strip())
+        def _scan_error(failure):
+            "Called in the main thread if the scan failed"
+            state["running"] = False
+            state["done"] = True
+            caller.msg("{RSearch failed: %s{n" % failure.getErrorMessage())
+
+        state["running"] = True
+        deferToThread(_find_scan, state).addCallbacks(_show_page, _scan_error)
 
 
 class CmdTeleport(MuxCommand):
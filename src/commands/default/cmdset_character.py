@@ -45,6 +45,7 @@ class CharacterCmdSet(CmdSet):
         self.add(system.CmdAbout())
         self.add(system.CmdTime())
         self.add(system.CmdServerLoad())
+        self.add(system.CmdProfile())
         #self.add(system.CmdPs())
 
         # Admin commands
@@ -65,6 +65,7 @@ class PlayerCmdSet(CmdSet):
         self.add(comms.CmdCBoot())
         self.add(comms.CmdCemit())
         self.add(comms.CmdCWho())
+        self.add(comms.CmdChanHistory())
         self.add(comms.CmdCdesc())
         self.add(comms.CmdPage())
         self.add(comms.CmdIRC2Chan())
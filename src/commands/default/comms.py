@@ -9,10 +9,10 @@ for easy handling.
 """
 from django.conf import settings
 from src.comms.models import ChannelDB, Msg
+from src.comms.channelhistory import CHANNEL_HISTORY
 #from src.comms import irc, imc2, rss
 from src.players.models import PlayerDB
 from src.players import bots
-from src.comms.channelhandler import CHANNELHANDLER
 from src.utils import create, utils, prettytable, evtable
 from src.utils.utils import make_iter
 from src.commands.default.muxcommand import MuxCommand, MuxPlayerCommand
@@ -20,7 +20,7 @@ from src.commands.default.muxcommand import MuxCommand, MuxPlayerCommand
 # limit symbol import for API
 __all__ = ("CmdAddCom", "CmdDelCom", "CmdAllCom",
            "CmdChannels", "CmdCdestroy", "CmdCBoot", "CmdCemit",
-           "CmdCWho", "CmdChannelCreate", "CmdClock", "CmdCdesc",
+           "CmdCWho", "CmdChanHistory", "CmdChannelCreate", "CmdClock", "CmdCdesc",
            "CmdPage", "CmdIRC2Chan", "CmdRSS2Chan")#, "CmdIMC2Chan", "CmdIMCInfo",
            #"CmdIMCTell")
 
@@ -338,7 +338,6 @@ class CmdCdestroy(MuxPlayerCommand):
         msgobj = create.create_message(caller, message, channel)
         channel.msg(msgobj)
         channel.delete()
-        CHANNELHANDLER.update()
         self.msg("Channel '%s' was destroyed." % channel_key)
 
 
@@ -398,9 +397,8 @@ class CmdCBoot(MuxPlayerCommand):
                      player.character.nicks.get(category="channel") or []
                      if nick.db_real.lower() == channel.key]:
             nick.delete()
-        # disconnect player
+        # disconnect player (this also updates the player's channel cmdset)
         channel.disconnect(player)
-        CHANNELHANDLER.update()
 
 
 class CmdCemit(MuxPlayerCommand):
@@ -486,6 +484,64 @@ class CmdCWho(MuxPlayerCommand):
         self.msg(string.strip())
 
 
+class CmdChanHistory(MuxPlayerCommand):
+    """
+    view the message history of a channel
+
+    Usage:
+      @chanhistory <channel> [= <page>]
+      @chanhistory/search <channel> = <text>
+
+    Shows the latest messages sent to a channel you can listen to.
+    Page 1 is the most recent messages, higher pages go further back
+    in time. With /search, shows recent messages containing text.
+    """
+    key = "@chanhistory"
+    aliases = ["@chist"]
+    locks = "cmd: not pperm(channel_banned)"
+    help_category = "Comms"
+
+    def func(self):
+        "implement function"
+
+        if not self.args:
+            string = "Usage: @chanhistory[/search] <channel> [= <page or text>]"
+            self.msg(string)
+            return
+
+        channel = find_channel(self.caller, self.lhs)
+        if not channel:
+            return
+        if not channel.access(self.caller, "listen"):
+            string = "You can't access this channel."
+            self.msg(string)
+            return
+        if not channel.db.keep_log:
+            self.msg("Channel '%s' does not keep a log." % channel.key)
+            return
+        if "search" in self.switches:
+            if not self.rhs:
+                self.msg("Usage: @chanhistory/search <channel> = <text>")
+                return
+            entries = CHANNEL_HISTORY.search(channel, self.rhs)
+            header = "Messages on %s matching '%s'" % (channel.key, self.rhs)
+        else:
+            try:
+                page = max(1, int(self.rhs)) if self.rhs else 1
+            except ValueError:
+                self.msg("The page must be a number.")
+                return
+            entries = CHANNEL_HISTORY.get_page(channel, page=page - 1)
+            header = "History of %s (page %i)" % (channel.key, page)
+        if not entries:
+            self.msg("No messages found.")
+            return
+        string = "{w%s:{n" % header
+        for entry in entries:
+            string += "\n {x%s{n %s" % (entry.db_date_sent.strftime("%m-%d %H:%M"), entry.db_message)
+        self.msg(string)
+
+
 class CmdChannelCreate(MuxPlayerCommand):
     """
     create a new channel
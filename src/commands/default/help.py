@@ -10,8 +10,8 @@ from collections import defaultdict
 from src.utils.utils import fill, dedent
 from src.commands.command import Command
 from src.help.models import HelpEntry
+from src.help.helpindex import HELP_INDEX
 from src.utils import create
-from src.utils.utils import string_suggestions
 from src.commands.default.muxcommand import MuxCommand
 
 # limit symbol import for API
@@ -103,10 +103,10 @@ class CmdHelp(Command):
         # having to allow doublet commands to manage exits etc.
         cmdset.make_unique(caller)
 
-        # retrieve all available commands and database topics
+        # retrieve all available commands; database topics are
+        # looked up through the help index
         all_cmds = [cmd for cmd in cmdset if cmd.auto_help and cmd.access(caller)]
-        all_topics = [topic for topic in HelpEntry.objects.all() if topic.access(caller, 'view', default=True)]
-        all_categories = list(set([cmd.help_category.lower() for cmd in all_cmds] + [topic.help_category.lower() for topic in all_topics]))
+        cmd_categories = set(cmd.help_category.lower() for cmd in all_cmds)
 
         if query in ("list", "all"):
             # we want to list all available help entries, grouped by category
@@ -114,20 +114,18 @@ class CmdHelp(Command):
             hdict_topic = defaultdict(list)
             # create the dictionaries {category:[topic, topic ...]} required by format_help_list
             [hdict_cmd[cmd.help_category].append(cmd.key) for cmd in all_cmds]
-            [hdict_topic[topic.help_category].append(topic.key) for topic in all_topics]
+            [hdict_topic[topic.help_category].append(topic.key) for topic in HELP_INDEX.visible_topics(caller)]
             # report back
             self.msg(format_help_list(hdict_cmd, hdict_topic))
             return
 
         # Try to access a particular command
 
-        # build vocabulary of suggestions and rate them by string similarity.
-        vocabulary = [cmd.key for cmd in all_cmds if cmd] + [topic.key for topic in all_topics] + all_categories
-        [vocabulary.extend(cmd.aliases) for cmd in all_cmds]
-        suggestions = [sugg for sugg in string_suggestions(query, set(vocabulary), cutoff=suggestion_cutoff, maxnum=suggestion_maxnum)
-                       if sugg != query]
-        if not suggestions:
-            suggestions = [sugg for sugg in vocabulary if sugg != query and sugg.startswith(query)]
+        # find suggestions among commands, topics and categories
+        cmd_terms = [cmd.key for cmd in all_cmds if cmd] + list(cmd_categories)
+        [cmd_terms.extend(cmd.aliases) for cmd in all_cmds]
+        suggestions = HELP_INDEX.suggest(query, caller, cmd_terms=cmd_terms,
+                                         cutoff=suggestion_cutoff, maxnum=suggestion_maxnum)
 
         # try an exact command auto-help match
         match = [cmd for cmd in all_cmds if cmd == query]
@@ -139,17 +137,17 @@ class CmdHelp(Command):
             return
 
         # try an exact database help entry match
-        match = list(HelpEntry.objects.find_topicmatch(query, exact=True))
-        if len(match) == 1:
-            self.msg(format_help_entry(match[0].key,
-                     match[0].entrytext,
+        match = HELP_INDEX.find_topic(query, caller)
+        if match:
+            self.msg(format_help_entry(match.key,
+                     match.entrytext,
                      suggested=suggestions))
             return
 
         # try to see if a category name was entered
-        if query in all_categories:
+        if query in cmd_categories or HELP_INDEX.has_category(query, caller):
             self.msg(format_help_list({query:[cmd.key for cmd in all_cmds if cmd.help_category==query]},
-                                        {query:[topic.key for topic in all_topics if topic.help_category==query]}))
+                                        {query:[topic.key for topic in HELP_INDEX.visible_topics(caller, category=query)]}))
             return
 
         # no exact matches found. Just give suggestions.
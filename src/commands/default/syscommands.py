@@ -19,7 +19,6 @@ the line is just added to the editor buffer).
 """
 
 from src.comms.models import ChannelDB
-from src.utils import create
 
 # The command keys the engine is calling
 # (the actual names all start with __)
@@ -169,5 +168,4 @@ class SystemSendToChannel(MuxCommand):
             caller.msg(string % channelkey)
             return
         msg = "[%s] %s: %s" % (channel.key, caller.name, msg)
-        msgobj = create.create_message(caller, msg, channels=[channel])
-        channel.msg(msgobj)
\ No newline at end of file
+        channel.msg(msg, senders=caller)
\ No newline at end of file
@@ -15,6 +15,9 @@ from time import time as timemeasure
 from django.conf import settings
 #from src.server.caches import get_cache_sizes
 from src.server.sessionhandler import SESSIONS
+from src.server.stats import SERVER_STATS
+from src.server.procpool import PROCPOOL
+from src.server.profiler import CMD_PROFILER
 from src.scripts.models import ScriptDB
 from src.objects.models import ObjectDB
 from src.players.models import PlayerDB
@@ -31,7 +34,7 @@ _attribute_cache = None
 # limit symbol import for API
 __all__ = ("CmdReload", "CmdReset", "CmdShutdown", "CmdPy",
            "CmdScripts", "CmdObjects", "CmdService", "CmdAbout",
-           "CmdTime", "CmdServerLoad")
+           "CmdTime", "CmdServerLoad", "CmdProfile")
 
 
 class CmdReload(MuxCommand):
@@ -364,12 +367,12 @@ class CmdObjects(MuxCommand):
         else:
             nlim = 10
 
-        nobjs = ObjectDB.objects.count()
-        base_char_typeclass = settings.BASE_CHARACTER_TYPECLASS
-        nchars = ObjectDB.objects.filter(db_typeclass_path=base_char_typeclass).count()
-        nrooms = ObjectDB.objects.filter(db_location__isnull=True).exclude(db_typeclass_path=base_char_typeclass).count()
-        nexits = ObjectDB.objects.filter(db_location__isnull=False, db_destination__isnull=False).count()
-        nother = nobjs - nchars - nrooms - nexits
+        totals = SERVER_STATS.object_totals()
+        nobjs = totals["objects"]
+        nchars = totals["characters"]
+        nrooms = totals["rooms"]
+        nexits = totals["exits"]
+        nother = totals["others"]
 
         nobjs = nobjs or 1 # fix zero-div error with empty database
 
@@ -384,12 +387,12 @@ class CmdObjects(MuxCommand):
         # typeclass table
         typetable = EvTable("{wtypeclass{n", "{wcount{n", "{w%%{n", border="table", align="l")
         typetable.align = 'l'
-        dbtotals = ObjectDB.objects.object_totals()
+        dbtotals = SERVER_STATS.typeclass_totals()
         for path, count in dbtotals.items():
             typetable.add_row(path, count, "%.2f" % ((float(count) / nobjs) * 100))
 
         # last N table
-        objs = ObjectDB.objects.all().order_by("db_date_created")[max(0, nobjs - nlim):]
+        objs = reversed(ObjectDB.objects.all().order_by("-db_date_created")[:nlim])
         latesttable = EvTable("{wcreated{n", "{wdbref{n", "{wname{n", "{wtypeclass{n", align="l", border="table")
         latesttable.align = 'l'
         for obj in objs:
@@ -698,6 +701,17 @@ class CmdServerLoad(MuxCommand):
         loadtable.add_row(["Disk I/O", "%g reads, %g writes" % (rusage.ru_inblock, rusage.ru_oublock)])
         loadtable.add_row(["Network I/O", "%g in, %g out" % (rusage.ru_msgrcv, rusage.ru_msgsnd)])
         loadtable.add_row(["Context switching", "%g vol, %g forced, %g signals" % (rusage.ru_nvcsw, rusage.ru_nivcsw, rusage.ru_nsignals)])
+        totals = SERVER_STATS.object_totals()
+        loadtable.add_row(["Database objects", "%i (%i rooms, %i exits, %i characters)" % (totals["objects"],
+                            totals["rooms"], totals["exits"], totals["characters"])])
+        loadtable.add_row(["Players", "%i registered, %i connected" % (SERVER_STATS.num_players(),
+                                                                      SESSIONS.player_count())])
+        pstats = PROCPOOL.stats()
+        if pstats["workers"]:
+            loadtable.add_row(["Process pool", "%i workers, %i pending, %i queued, %i jobs (%i batches, %i errors)\n"
+                               "latency %.1f ms avg, %.1f ms max" % (pstats["workers"], pstats["pending"],
+                               pstats["queued"], pstats["jobs"], pstats["batches"], pstats["errors"],
+                               pstats["latency_avg"] * 1000, pstats["latency_max"] * 1000)])
 
         string = "{wServer CPU and Memory load:{n\n%s" % loadtable
 
@@ -723,3 +737,91 @@ class CmdServerLoad(MuxCommand):
 
         caller.msg(string)
 
+
+class CmdProfile(MuxCommand):
+    """
+    profile the time, queries and messages of commands
+
+    Usage:
+      @profile[/switches] [<command>]
+
+    Switches:
+      on - start profiling commands
+      off - stop profiling (the statistics so far are kept)
+      reset - forget the statistics so far
+      export - save the statistics as JSON in the log directory,
+               to cmdprofile.json or to the given file name
+
+    Without a command, this lists the profiled commands, the most
+    costly (in total time) first. Given a command key, the phases of
+    that command are shown: cmdset merging, input matching,
+    at_pre_cmd, parse, func and at_post_cmd.
+
+    Times are in milliseconds and p95 is the time 95% of the calls
+    stayed within. Queries, sql time and msgs are averages per call.
+    While profiling is on, every database query is logged, so turn
+    it off when done.
+    """
+    key = "@profile"
+    locks = "cmd:perm(profile) or perm(Immortals)"
+    help_category = "System"
+
+    def func(self):
+        "Implement the command"
+
+        caller = self.caller
+
+        if "on" in self.switches:
+            CMD_PROFILER.enable()
+            caller.msg("Command profiling started.")
+            return
+        if "off" in self.switches:
+            CMD_PROFILER.disable()
+            caller.msg("Command profiling stopped.")
+            return
+        if "reset" in self.switches:
+            CMD_PROFILER.reset()
+            caller.msg("Command profiling statistics cleared.")
+            return
+        if "export" in self.switches:
+            filename = None
+            if self.args:
+                # only allow writing to the log directory
+                filename = os.path.join(settings.LOG_DIR, os.path.basename(self.args.strip()))
+            try:
+                filename = CMD_PROFILER.export(filename)
+            except (IOError, OSError), err:
+                caller.msg("Could not export the statistics: %s" % err)
+                return
+            caller.msg("Command profiling statistics exported to %s." % filename)
+            return
+
+        string = "{wCommand profiling is %s{n" % ("on" if CMD_PROFILER.enabled else "off")
+        if CMD_PROFILER.started:
+            string += " (statistics of the last %s)" % utils.time_format(timemeasure() - CMD_PROFILER.started, 2)
+        if self.args:
+            key = self.args.strip()
+            rows = CMD_PROFILER.phase_summary(key) or CMD_PROFILER.phase_summary(key.lower())
+            if not rows:
+                caller.msg(string + "\nNo statistics for command '%s'." % key)
+                return
+            table = EvTable("{wphase{n", "{wcalls{n", "{wmean{n", "{wp95{n", "{wmax{n",
+                            "{wqueries{n", "{wsql{n", "{wmsgs{n", border="table", align="l")
+            for phase, ncalls, tmean, tp95, tmax, nqueries, sqltime, nmsgs in rows:
+                table.add_row(phase, ncalls, "%.2f" % (tmean * 1000), "%.2f" % (tp95 * 1000),
+                              "%.2f" % (tmax * 1000), "%.1f" % nqueries, "%.2f" % (sqltime * 1000),
+                              "%.1f" % nmsgs)
+            caller.msg(string + "\n{wPhases of %s:{n\n%s" % (key, table))
+            return
+
+        rows = CMD_PROFILER.summary()
+        if not rows:
+            caller.msg(string + "\nNo commands profiled.")
+            return
+        table = EvTable("{wcommand{n", "{wcalls{n", "{wtotal (s){n", "{wmean{n", "{wp95{n", "{wmax{n",
+                        "{wqueries{n", "{wsql{n", "{wmsgs{n", border="table", align="l")
+        for key, ncalls, ttotal, tmean, tp95, tmax, nqueries, sqltime, nmsgs in rows:
+            table.add_row(key, ncalls, "%.2f" % ttotal, "%.2f" % (tmean * 1000), "%.2f" % (tp95 * 1000),
+                          "%.2f" % (tmax * 1000), "%.1f" % nqueries, "%.2f" % (sqltime * 1000),
+                          "%.1f" % nmsgs)
+        caller.msg(string + "\n%s" % table)
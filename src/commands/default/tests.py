@@ -193,6 +193,7 @@ class TestSystem(CommandTest):
         self.call(system.CmdObjects(), "", "Object subtype totals")
         self.call(system.CmdAbout(), "", None)
         self.call(system.CmdServerLoad(), "", "Server CPU and Memory load:")
+        self.call(system.CmdProfile(), "", "Command profiling is off")
 
 
 from src.commands.default import admin
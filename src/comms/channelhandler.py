@@ -22,10 +22,32 @@ To delete a channel cleanly, delete the channel object, then call
 update() on the channelhandler. Or use Channel.objects.delete() which
 does this for you.
 
+The channel cmdsets of the most recently active players are cached,
+keyed by player id. Adding, changing or removing a channel only
+updates the cached cmdsets for that one channel, and a player's
+cmdset is rebuilt when they (un)subscribe, so channel edits don't
+cause every player's cmdset to be rebuilt at once.
+
+The handler also keeps the online subscribers of each channel, updated
+by the sessionhandler as players log in and out, so sending to a
+channel only has to go over the players actually connected. Messages
+for offline subscribers of channels with the deliver_offline Attribute
+set are kept in an in-memory mailbox and sent when the player logs in
+again (the mailbox does not survive a reload).
+
 """
+from collections import OrderedDict, defaultdict, deque
 from src.comms.models import ChannelDB
 from src.commands import cmdset, command
 
+# how many players' channel cmdsets to keep cached
+_MAX_CACHED_CMDSETS = 2000
+# how many messages to keep for each offline player
+_MAILBOX_SIZE = 50
+
+# delayed import
+_SESSIONS = None
+
 
 class ChannelCommand(command.Command):
     """
@@ -86,7 +108,15 @@ class ChannelHandler(object):
     """
     def __init__(self):
         self.cached_channel_cmds = []
-        self.cached_cmdsets = {}
+        # {channel id: (signature, cmd)}
+        self.channel_cmds = {}
+        # {player id: (player, cmdset)}, least recently used first
+        self.cached_cmdsets = OrderedDict()
+        # {channel id: {player id: player}} for the subscribers currently
+        # online. None until built from the connected sessions.
+        self.online = None
+        # {player id: deque([(channel id, text, from_obj)])}
+        self.mailbox = defaultdict(lambda: deque(maxlen=_MAILBOX_SIZE))
 
     def __str__(self):
         return ", ".join(str(cmd) for cmd in self.cached_channel_cmds)
@@ -96,6 +126,8 @@ class ChannelHandler(object):
         Reset the cache storage.
         """
         self.cached_channel_cmds = []
+        self.channel_cmds = {}
+        self.cached_cmdsets = OrderedDict()
 
     def _format_help(self, channel):
         "builds a doc string"
@@ -114,47 +146,176 @@ class ChannelHandler(object):
         """ % (key, ustring, desc)
         return string
 
-    def add_channel(self, channel):
+    def _signature(self, channel):
+        "What the channel command is built from"
+        return (channel.key.strip().lower(), tuple(sorted(channel.aliases.all())), str(channel.locks))
+
+    def add_channel(self, channel, signature=None):
         """
         Add an individual channel to the handler. This should be
-        called whenever a new channel is created. To
-        remove a channel, simply delete the channel object
-        and run self.update on the handler.
+        called whenever a new channel is created or an existing one
+        changes key, aliases or locks. To remove a channel, simply
+        delete the channel object (or use remove_channel).
         """
+        signature = signature or self._signature(channel)
+        old = self.channel_cmds.get(channel.id)
+        if old and old[0] == signature:
+            return
         # map the channel to a searchable command
-        cmd = ChannelCommand(key=channel.key.strip().lower(),
-                             aliases=channel.aliases.all(),
-                             locks="cmd:all();%s" % channel.locks,
+        cmd = ChannelCommand(key=signature[0],
+                             aliases=list(signature[1]),
+                             locks="cmd:all();%s" % signature[2],
                              help_category="Channel names",
                              obj=channel,
                              is_channel=True)
+        if old:
+            self._remove_cmd(old[1])
+        self.channel_cmds[channel.id] = (signature, cmd)
         self.cached_channel_cmds.append(cmd)
-        self.cached_cmdsets = {}
+        # only this channel has to be checked for the cached players
+        for player_id, (player, chan_cmdset) in self.cached_cmdsets.items():
+            if cmd.access(player, 'send'):
+                self.cached_cmdsets[player_id] = \
+                        (player, self._make_cmdset(chan_cmdset.commands + [cmd]))
+
+    def _remove_cmd(self, cmd):
+        "Remove a channel command from the handler and the cached cmdsets"
+        self.cached_channel_cmds = [ccmd for ccmd in self.cached_channel_cmds if ccmd is not cmd]
+        for player_id, (player, chan_cmdset) in self.cached_cmdsets.items():
+            if any(ccmd is cmd for ccmd in chan_cmdset.commands):
+                self.cached_cmdsets[player_id] = \
+                        (player, self._make_cmdset([ccmd for ccmd in chan_cmdset.commands
+                                                    if ccmd is not cmd]))
+
+    def _make_cmdset(self, cmds):
+        """
+        Create a new channel cmdset holding cmds. A cached cmdset is
+        never changed in place but replaced, since the cmdhandler
+        caches its merged cmdsets by the identity of the sets merged.
+        """
+        chan_cmdset = cmdset.CmdSet()
+        chan_cmdset.key = '_channelset'
+        chan_cmdset.priority = 120
+        chan_cmdset.duplicates = True
+        for cmd in cmds:
+            chan_cmdset.add(cmd)
+        return chan_cmdset
+
+    def remove_channel(self, channel_id):
+        "Remove the channel with the given id from the handler"
+        old = self.channel_cmds.pop(channel_id, None)
+        if old:
+            self._remove_cmd(old[1])
+        if self.online is not None:
+            self.online.pop(channel_id, None)
 
     def update(self):
-        "Updates the handler completely."
-        self.cached_channel_cmds = []
-        self.cached_cmdsets = {}
-        for channel in ChannelDB.objects.get_all_channels():
+        """
+        Updates the handler completely. Only the channels that were
+        added, changed or deleted since the last update are updated
+        in the cached cmdsets.
+        """
+        channels = list(ChannelDB.objects.get_all_channels())
+        for channel_id in set(self.channel_cmds).difference(channel.id for channel in channels):
+            self.remove_channel(channel_id)
+        for channel in channels:
             self.add_channel(channel)
 
+    def update_player(self, player):
+        """
+        Rebuild the channel cmdset of player, if it is cached. Called
+        when the player subscribes to or leaves a channel.
+        """
+        player = hasattr(player, "player") and player.player or player
+        if player and player.id in self.cached_cmdsets:
+            del self.cached_cmdsets[player.id]
+            self.get_cmdset(player)
+
     def get_cmdset(self, source_object):
         """
         Retrieve cmdset for channels this source_object has
         access to send to.
         """
-        if source_object in self.cached_cmdsets:
-            return self.cached_cmdsets[source_object]
-        else:
-            # create a new cmdset holding all channels
-            chan_cmdset = cmdset.CmdSet()
-            chan_cmdset.key = '_channelset'
-            chan_cmdset.priority = 120
-            chan_cmdset.duplicates = True
-            for cmd in [cmd for cmd in self.cached_channel_cmds
-                        if cmd.access(source_object, 'send')]:
-                chan_cmdset.add(cmd)
-            self.cached_cmdsets[source_object] = chan_cmdset
-            return chan_cmdset
+        cached = self.cached_cmdsets.pop(source_object.id, None)
+        if cached:
+            # re-insert to mark as recently used
+            self.cached_cmdsets[source_object.id] = cached
+            return cached[1]
+        # create a new cmdset holding all channels
+        chan_cmdset = self._make_cmdset([cmd for cmd in self.cached_channel_cmds
+                                         if cmd.access(source_object, 'send')])
+        self.cached_cmdsets[source_object.id] = (source_object, chan_cmdset)
+        if len(self.cached_cmdsets) > _MAX_CACHED_CMDSETS:
+            self.cached_cmdsets.popitem(last=False)
+        return chan_cmdset
+
+    # online subscribers
+
+    def _connected_players(self):
+        "Get {player id: player} of all logged-in players"
+        global _SESSIONS
+        if not _SESSIONS:
+            from src.server.sessionhandler import SESSIONS as _SESSIONS
+        return dict((sess.player.id, sess.player) for sess in _SESSIONS.get_sessions() if sess.player)
+
+    def _build_online(self):
+        "Build the online subscribers from the connected sessions (one query)"
+        self.online = defaultdict(dict)
+        players = self._connected_players()
+        if players:
+            through = ChannelDB.db_subscriptions.through
+            for channel_id, player_id in through.objects.filter(
+                    playerdb_id__in=players.keys()).values_list("channeldb_id", "playerdb_id"):
+                self.online[channel_id][player_id] = players[player_id]
+
+    def reset_online(self):
+        "Forget the online subscribers; they are rebuilt when next needed"
+        self.online = None
+
+    def player_online(self, player):
+        """
+        Called by the sessionhandler when player connects its first
+        session. Delivers any messages waiting in the mailbox.
+        """
+        if self.online is not None:
+            for channel_id in player.dbobj.subscription_set.values_list("id", flat=True):
+                self.online[channel_id][player.id] = player
+        messages = self.mailbox.pop(player.id, None)
+        if messages:
+            for channel_id, text, from_obj in messages:
+                player.msg(text, from_obj=from_obj, from_channel=channel_id)
+
+    def player_offline(self, player):
+        "Called by the sessionhandler when player's last session disconnects"
+        if self.online is not None:
+            for subscribers in self.online.values():
+                subscribers.pop(player.id, None)
+
+    def subscriber_added(self, channel, player):
+        "Called when player subscribes to channel"
+        if self.online is not None and player.id in self._connected_players():
+            self.online[channel.id][player.id] = player
+
+    def subscriber_removed(self, channel, player):
+        "Called when player unsubscribes from channel"
+        if self.online is not None:
+            self.online.get(channel.id, {}).pop(player.id, None)
+
+    def online_subscribers(self, channel):
+        "Return the players subscribed to channel that are online"
+        if self.online is None:
+            self._build_online()
+        return self.online.get(channel.id, {}).values()
+
+    def queue_offline(self, channel, text, from_obj=None):
+        """
+        Queue text for all offline subscribers of channel, to be sent
+        when they next log in.
+        """
+        online = self.online_subscribers(channel)
+        online_ids = set(player.id for player in online)
+        for player_id in channel.dbobj.db_subscriptions.values_list("id", flat=True):
+            if player_id not in online_ids:
+                self.mailbox[player_id].append((channel.id, text, from_obj))
 
 CHANNELHANDLER = ChannelHandler()
@@ -0,0 +1,203 @@
+"""
+Channel history
+
+This stores the messages of channels with the keep_log Attribute set.
+The most recent messages of each channel are kept in an in-memory
+ring buffer, so showing the recent history never touches the database.
+All messages are also appended (in batches) to the ChannelLogEntry
+table, which is indexed on (channel, date) and partitioned by day, and
+serves the older history. This is the only store of the messages of
+such channels; no Msg is saved for them.
+
+    from src.comms.channelhistory import CHANNEL_HISTORY
+
+    CHANNEL_HISTORY.add(channel, msgobj)
+    entries = CHANNEL_HISTORY.get_page(channel, page=0, pagesize=20)
+    entries = CHANNEL_HISTORY.search(channel, "dragon", days=7)
+
+The log is pruned by the ValidateChannelHandler script, removing days
+older than settings.CHANNEL_LOG_RETENTION_DAYS (or the channel's own
+log_retention_days Attribute, if set).
+
+"""
+import datetime
+from collections import deque
+from twisted.internet import reactor
+from django.conf import settings
+from src.comms.models import ChannelDB, ChannelLogEntry
+from src.utils import logger
+
+__all__ = ("CHANNEL_HISTORY",)
+
+_BUFFER_SIZE = settings.CHANNEL_LOG_BUFFER_SIZE
+_RETENTION_DAYS = settings.CHANNEL_LOG_RETENTION_DAYS
+# how often (in seconds) new entries are written to the database
+_FLUSH_INTERVAL = 5
+# searches read the log this many entries at a time, and give up
+# after this many
+_SEARCH_PAGE_SIZE = 500
+_SEARCH_MAX_SCAN = 20000
+
+
+class ChannelHistory(object):
+    """
+    Ring buffers of recent messages per channel, backed by the
+    ChannelLogEntry table.
+    """
+    def __init__(self):
+        # {channel id: deque of ChannelLogEntry, oldest first}
+        self.buffers = {}
+        # channel ids whose buffer holds their whole history
+        self.complete = set()
+        # entries not yet written to the database
+        self.pending = []
+        self.flush_call = None
+
+    def _get_buffer(self, channel_id):
+        "Get the ring buffer of a channel, loading it if needed"
+        buf = self.buffers.get(channel_id)
+        if buf is None:
+            entries = list(ChannelLogEntry.objects.filter(
+                        db_channel=channel_id).order_by("-db_date_sent")[:_BUFFER_SIZE])
+            buf = deque(reversed(entries), maxlen=_BUFFER_SIZE)
+            self.buffers[channel_id] = buf
+            if len(entries) < _BUFFER_SIZE:
+                self.complete.add(channel_id)
+        return buf
+
+    def add(self, channel, msgobj):
+        """
+        Add a sent message (a Msg or TempMsg) to the history of
+        channel. It is written to the database within a few seconds.
+        """
+        now = datetime.datetime.now()
+        senders = ", ".join(getattr(sender, "key", None) or str(sender) for sender in msgobj.senders)
+        entry = ChannelLogEntry(db_channel_id=channel.id, db_date_sent=now,
+                                db_partition=now.toordinal(), db_senders=senders[:255],
+                                db_header=msgobj.header, db_message=msgobj.message)
+        buf = self._get_buffer(channel.id)
+        if len(buf) == _BUFFER_SIZE:
+            # the oldest entry is pushed out
+            self.complete.discard(channel.id)
+        buf.append(entry)
+        self.pending.append(entry)
+        if not self.flush_call:
+            self.flush_call = reactor.callLater(_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        "Write all pending entries to the database"
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        pending, self.pending = self.pending, []
+        if pending:
+            try:
+                ChannelLogEntry.objects.bulk_create(pending)
+            except Exception:
+                logger.log_trace("Could not store the channel log.")
+
+    def _older(self, channel_id, buf):
+        """
+        The log entries of a channel older than its ring buffer,
+        newest first, as a queryset along the (channel, date) index.
+        """
+        self.flush()
+        entries = ChannelLogEntry.objects.filter(db_channel=channel_id)
+        if buf:
+            entries = entries.filter(db_date_sent__lt=buf[0].db_date_sent)
+        return entries.order_by("-db_date_sent")
+
+    def get_page(self, channel, page=0, pagesize=20):
+        """
+        Get a page of the history of channel. Page 0 holds the pagesize
+        most recent messages, page 1 the ones before that and so on.
+        The entries of a page are returned oldest first.
+        """
+        start, end = page * pagesize, (page + 1) * pagesize
+        entries = list(self._get_buffer(channel.id))
+        nbuf = len(entries)
+        if end <= nbuf or channel.id in self.complete:
+            return entries[max(0, nbuf - end):max(0, nbuf - start)]
+        # the page reaches past the buffer; the rest is read from
+        # the log entries before the oldest buffered one
+        older = list(self._older(channel.id, entries)[max(0, start - nbuf):end - nbuf])
+        older.reverse()
+        return older + entries[:max(0, nbuf - start)]
+
+    def search(self, channel, text, days=None, limit=50):
+        """
+        Find the most recent messages on channel containing text
+        (case-insensitive), optionally only within the last days.
+        The ring buffer is searched first, then the older log a page
+        at a time along the (channel, date) index, matching in memory
+        and stopping after _SEARCH_MAX_SCAN entries. Returned oldest
+        first.
+        """
+        text = text.lower()
+        since = datetime.datetime.now() - datetime.timedelta(days=days) if days else None
+        buf = self._get_buffer(channel.id)
+        found = []
+        for entry in reversed(buf):
+            if since and entry.db_date_sent < since:
+                break
+            if text in entry.db_message.lower():
+                found.append(entry)
+                if len(found) >= limit:
+                    break
+        else:
+            if channel.id not in self.complete:
+                older = self._older(channel.id, buf)
+                if since:
+                    older = older.filter(db_date_sent__gte=since)
+                for _ in xrange(_SEARCH_MAX_SCAN // _SEARCH_PAGE_SIZE):
+                    entries = list(older[:_SEARCH_PAGE_SIZE])
+                    found.extend(entry for entry in entries if text in entry.db_message.lower())
+                    if len(found) >= limit or len(entries) < _SEARCH_PAGE_SIZE:
+                        break
+                    # continue before the oldest entry read so far
+                    older = older.filter(db_date_sent__lt=entries[-1].db_date_sent)
+        found = found[:limit]
+        found.reverse()
+        return found
+
+    def clear(self, channel):
+        "Remove all history of channel"
+        self.flush()
+        ChannelLogEntry.objects.filter(db_channel=channel.id).delete()
+        self.buffers.pop(channel.id, None)
+        self.complete.discard(channel.id)
+
+    def forget(self, channel_id):
+        "Drop the buffer and unwritten entries of a deleted channel"
+        self.buffers.pop(channel_id, None)
+        self.complete.discard(channel_id)
+        self.pending = [entry for entry in self.pending if entry.db_channel_id != channel_id]
+
+    def prune(self):
+        """
+        Apply the retention policy, removing the days older than the
+        retention time of each channel (a retention of 0 or None
+        keeps everything).
+        """
+        self.flush()
+        today = datetime.date.today().toordinal()
+        custom = {}
+        for channel in ChannelDB.objects.get_all_channels():
+            days = channel.attributes.get("log_retention_days")
+            if days is not None:
+                custom[channel.id] = days
+        if _RETENTION_DAYS:
+            ChannelLogEntry.objects.filter(db_partition__lt=today - _RETENTION_DAYS).exclude(
+                        db_channel__in=custom.keys()).delete()
+        for channel_id, days in custom.items():
+            if days:
+                ChannelLogEntry.objects.filter(db_channel=channel_id,
+                                               db_partition__lt=today - days).delete()
+        for channel_id, buf in self.buffers.items():
+            days = custom.get(channel_id, _RETENTION_DAYS)
+            if days:
+                while buf and buf[0].db_partition < today - days:
+                    buf.popleft()
+
+
+CHANNEL_HISTORY = ChannelHistory()
@@ -3,7 +3,9 @@ Default Typeclass for Comms.
 
 See objects.objects for more information on Typeclassing.
 """
-from src.comms import Msg, TempMsg
+from src.comms import TempMsg
+from src.comms.channelhandler import CHANNELHANDLER
+from src.comms.channelhistory import CHANNEL_HISTORY
 from src.typeclasses.typeclass import TypeClass
 from src.utils import logger
 from src.utils.utils import make_iter
@@ -163,10 +165,12 @@ class Channel(TypeClass):
     def distribute_message(self, msg, online=False):
         """
         Method for grabbing all listeners that a message should be sent to on
-        this channel, and sending them a message.
+        this channel, and sending them a message. Only online subscribers
+        are sent the message; unless online is set, it is also queued for
+        the offline ones if the channel has deliver_offline set.
         """
-        # get all players connected to this channel and send to them
-        for player in self.dbobj.db_subscriptions.all():
+        # send to all online players connected to this channel
+        for player in CHANNELHANDLER.online_subscribers(self):
             player = player.typeclass
             try:
                 # note our addition of the from_channel keyword here. This could be checked
@@ -174,33 +178,36 @@ class Channel(TypeClass):
                 player.msg(msg.message, from_obj=msg.senders, from_channel=self.id)
             except AttributeError, e:
                 logger.log_trace("%s\nCannot send msg to player '%s'." % (e, player))
+        if not online and self.db.deliver_offline:
+            # keep the message for the offline players
+            CHANNELHANDLER.queue_offline(self, msg.message, from_obj=msg.senders)
 
     def msg(self, msgobj, header=None, senders=None, sender_strings=None,
             persistent=False, online=False, emit=False, external=False):
         """
         Send the given message to all players connected to channel. Note that
         no permission-checking is done here; it is assumed to have been
-        done before calling this method. The optional keywords are not used if
-        persistent is False.
+        done before calling this method.
 
         msgobj - a Msg/TempMsg instance or a message string. If one of the
                  former, the remaining keywords will be ignored. If a string,
-                 this will either be sent as-is (if persistent=False) or it
-                 will be used together with header and senders keywords to
-                 create a Msg instance on the fly.
+                 it will be used together with header and senders keywords
+                 to create a TempMsg instance on the fly.
         senders - an object, player or a list of objects or players.
-                 Optional if persistent=False.
+                 Optional.
         sender_strings - Name strings of senders. Used for external
                 connections where the sender is not a player or object. When
                 this is defined, external will be assumed.
         external - Treat this message agnostic of its sender.
-        persistent (default False) - ignored if msgobj is a Msg or TempMsg.
-                If True, a Msg will be created, using header and senders
-                keywords. If False, other keywords will be ignored.
-        online (bool) - If this is set true, only messages people who are
-                online. Otherwise, messages all players connected. This can
-                make things faster, but may not trigger listeners on players
-                that are offline.
+        persistent (default False) - kept for backwards compatibility.
+                Channel messages are never stored as Msg objects; if the
+                channel keeps a log (keep_log), the message is stored in
+                its history, whatever this is set to.
+        online (bool) - The message is only sent to the subscribers who
+                are online. If this is False and the channel has the
+                deliver_offline Attribute set, a copy is also queued for
+                each offline subscriber, to be delivered when they log in.
+                If True, offline subscribers never get the message.
         emit (bool) - Signals to the message formatter that this message is
                 not to be directly associated with a name.
         """
@@ -211,12 +218,9 @@ class Channel(TypeClass):
         if isinstance(msgobj, basestring):
             # given msgobj is a string
             msg = msgobj
-            if persistent and self.db.keep_log:
-                msgobj = Msg()
-                msgobj.save()
-            else:
-                # Use TempMsg, so this message is not stored.
-                msgobj = TempMsg()
+            # Use TempMsg, so no Msg is stored; channels keeping a log
+            # (keep_log) store the message in their history instead.
+            msgobj = TempMsg()
             msgobj.header = header
             msgobj.message = msg
             msgobj.channels = [self.dbobj]  # add this channel
@@ -230,6 +234,8 @@ class Channel(TypeClass):
                                         sender_strings=sender_strings,
                                         external=external)
         self.distribute_message(msgobj, online=online)
+        if self.db.keep_log:
+            CHANNEL_HISTORY.add(self, msgobj)
         self.post_send_message(msgobj)
         return True
 
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comms', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelLogEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('db_date_sent', models.DateTimeField(verbose_name=b'date sent', editable=False)),
+                ('db_partition', models.IntegerField(verbose_name=b'partition', editable=False, db_index=True)),
+                ('db_senders', models.CharField(max_length=255, verbose_name=b'senders', blank=True)),
+                ('db_header', models.TextField(null=True, verbose_name=b'header', blank=True)),
+                ('db_message', models.TextField(verbose_name=b'message')),
+                ('db_channel', models.ForeignKey(verbose_name=b'channel', to='comms.ChannelDB')),
+            ],
+            options={
+                'verbose_name': 'Channel log entry',
+                'verbose_name_plural': 'Channel log',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='channellogentry',
+            index_together=set([('db_channel', 'db_date_sent')]),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# entries to create per query
+_BATCH_SIZE = 500
+
+
+def copy_channel_msgs(apps, schema_editor):
+    """
+    Copy the messages stored as Msg objects on channels into the
+    channel log, so the history of a channel survives the move to
+    ChannelLogEntry. The Msg rows themselves are left alone.
+
+    The sender and receiver relations of Msg are not part of the
+    migration state, so they are read with plain SQL.
+    """
+    connection = schema_editor.connection
+    tables = connection.introspection.table_names()
+    if "comms_msg_db_receivers_channels" not in tables:
+        # no channel has ever been sent a stored message
+        return
+    ChannelLogEntry = apps.get_model("comms", "ChannelLogEntry")
+    cursor = connection.cursor()
+
+    senders = {}
+    for table, column, sender_table in (
+            ("comms_msg_db_sender_players", "playerdb_id", "players_playerdb"),
+            ("comms_msg_db_sender_objects", "objectdb_id", "objects_objectdb")):
+        if table not in tables:
+            continue
+        cursor.execute("SELECT s.msg_id, t.db_key FROM %s s "
+                       "INNER JOIN %s t ON t.id = s.%s "
+                       "INNER JOIN comms_msg_db_receivers_channels r ON r.msg_id = s.msg_id "
+                       "ORDER BY s.id" % (table, sender_table, column))
+        for msg_id, key in cursor.fetchall():
+            senders.setdefault(msg_id, []).append(key)
+
+    cursor.execute("SELECT m.id, r.channeldb_id, m.db_date_sent, m.db_sender_external, "
+                   "m.db_header, m.db_message FROM comms_msg m "
+                   "INNER JOIN comms_msg_db_receivers_channels r ON r.msg_id = m.id "
+                   "ORDER BY m.db_date_sent, m.id")
+    while True:
+        rows = cursor.fetchmany(_BATCH_SIZE)
+        if not rows:
+            break
+        entries = []
+        for msg_id, channel_id, date_sent, external, header, message in rows:
+            names = list(senders.get(msg_id, []))
+            if external:
+                names.append(external)
+            entries.append(ChannelLogEntry(db_channel_id=channel_id,
+                                           db_date_sent=date_sent,
+                                           db_partition=date_sent.toordinal(),
+                                           db_senders=", ".join(names)[:255],
+                                           db_header=header,
+                                           db_message=message or ""))
+        ChannelLogEntry.objects.bulk_create(entries)
+
+
+def remove_channel_log(apps, schema_editor):
+    "The copied entries are dropped with the log table"
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comms', '0002_channellogentry'),
+        ('players', '0001_initial'),
+        ('objects', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_channel_msgs, remove_channel_log),
+    ]
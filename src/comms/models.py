@@ -29,7 +29,7 @@ from src.comms.managers import identify_object
 from src.locks.lockhandler import LockHandler
 from src.utils.utils import crop, make_iter, lazy_property
 
-__all__ = ("Msg", "TempMsg", "ChannelDB")
+__all__ = ("Msg", "TempMsg", "ChannelDB", "ChannelLogEntry")
 
 
 _GA = object.__getattribute__
@@ -373,6 +373,15 @@ class ChannelDB(TypedObject):
     def __str__(self):
         return "Channel '%s' (%s)" % (self.key, self.typeclass.db.desc)
 
+    def _at_db_lock_storage_postsave(self):
+        """
+        This hook is called automatically after the key or locks were
+        saved. It updates the channel's command in the channelhandler.
+        """
+        from src.comms.channelhandler import CHANNELHANDLER
+        CHANNELHANDLER.add_channel(self)
+    _at_db_key_postsave = _at_db_lock_storage_postsave
+
     def has_connection(self, player):
         """
         Checks so this player is actually listening
@@ -397,6 +406,9 @@ class ChannelDB(TypedObject):
             return False
         # subscribe
         self.db_subscriptions.add(player.dbobj)
+        from src.comms.channelhandler import CHANNELHANDLER
+        CHANNELHANDLER.subscriber_added(self, player)
+        CHANNELHANDLER.update_player(player)
         # post-join hook
         self.typeclass.post_join_channel(player)
         return True
@@ -412,6 +424,9 @@ class ChannelDB(TypedObject):
             return False
         # disconnect
         self.db_subscriptions.remove(player.dbobj)
+        from src.comms.channelhandler import CHANNELHANDLER
+        CHANNELHANDLER.subscriber_removed(self, player)
+        CHANNELHANDLER.update_player(player)
         # post-disconnect hook
         self.typeclass.post_leave_channel(player.dbobj)
         return True
@@ -429,8 +444,46 @@ class ChannelDB(TypedObject):
         """
         Deletes channel while also cleaning up channelhandler
         """
+        channel_id = _GA(self, "id")
         _GA(self, "attributes").clear()
         _GA(self, "aliases").clear()
         super(ChannelDB, self).delete()
         from src.comms.channelhandler import CHANNELHANDLER
-        CHANNELHANDLER.update()
+        CHANNELHANDLER.remove_channel(channel_id)
+        from src.comms.channelhistory import CHANNEL_HISTORY
+        CHANNEL_HISTORY.forget(channel_id)
+
+
+#------------------------------------------------------------
+#
+# Channel log
+#
+#------------------------------------------------------------
+
+class ChannelLogEntry(models.Model):
+    """
+    One message in the history of a channel. The log is append-only
+    and partitioned by day (db_partition holds the day ordinal of
+    db_date_sent), so whole days can be dropped cheaply when applying
+    the retention policy. Entries are written and read through the
+    channel history store in src.comms.channelhistory.
+
+    The entry stores the text as it was sent to the listeners, not
+    references to the senders, so it stays valid when those are
+    deleted.
+    """
+    db_channel = models.ForeignKey("ChannelDB", verbose_name="channel", on_delete=models.CASCADE)
+    db_date_sent = models.DateTimeField('date sent', editable=False)
+    db_partition = models.IntegerField('partition', editable=False, db_index=True)
+    db_senders = models.CharField('senders', max_length=255, blank=True)
+    db_header = models.TextField('header', null=True, blank=True)
+    db_message = models.TextField('message')
+
+    class Meta:
+        "Define Django meta options"
+        verbose_name = "Channel log entry"
+        verbose_name_plural = "Channel log"
+        index_together = [("db_channel", "db_date_sent")]
+
+    def __str__(self):
+        return "[%s] %s" % (self.db_date_sent, crop(self.db_message, width=40))
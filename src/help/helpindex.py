@@ -0,0 +1,337 @@
+"""
+HelpIndex
+
+This keeps an in-memory index of the database help entries so the
+help command does not have to load and lock-check every entry and
+compare the query against the whole vocabulary on every call.
+
+The index is used through the instantiated HELP_INDEX in this module:
+
+    from src.help.helpindex import HELP_INDEX
+
+    topics = HELP_INDEX.visible_topics(caller)
+    suggestions = HELP_INDEX.suggest("lok", caller, cmd_terms=["look", "l"])
+
+It is built from the database the first time it is used and is then
+kept up to date through the post_save/post_delete signals of
+HelpEntry. Suggestions are found through an inverted index of
+character n-grams, so only terms sharing at least one n-gram with the
+query are rated (with the same measure as utils.string_similarity).
+
+Visibility is checked per entry. Only when the view lock of an entry
+uses nothing but lock functions depending on the caller alone (like
+perm() or all()) is the result shared with the other entries having
+the same view lock, so such a lock is only checked once per call.
+
+"""
+import re
+import math
+from collections import defaultdict
+from django.db.models.signals import post_save, post_delete
+from src.help.models import HelpEntry
+from src.utils.utils import dbref
+
+__all__ = ("HELP_INDEX",)
+
+# length of the n-grams used for finding suggestion candidates
+_NGRAM_SIZE = 2
+# how many command vocabularies (one per distinct cmdset) to remember
+_MAX_CMD_INDEXES = 50
+# lock functions whose result only depends on the caller, not on the
+# entry checked
+_CALLER_LOCKFUNCS = set(("true", "all", "false", "none", "superuser",
+                         "perm", "perm_above", "pperm", "pperm_above",
+                         "id", "pid", "dbref", "pdbref"))
+_RE_LOCKFUNC = re.compile(r"(\w+)\s*\(")
+
+
+def _char_vector(term):
+    "Character histogram of term and its length, as used by string_similarity"
+    vec = defaultdict(int)
+    for char in term:
+        vec[char] += 1
+    return vec, math.sqrt(sum(num ** 2 for num in vec.itervalues()))
+
+
+def _shared_view_lock(lockstring):
+    """
+    The view lock definition of lockstring if checking it only depends
+    on the caller (an empty string if there is no view lock), otherwise
+    None.
+    """
+    for lockdef in (lockstring or "").split(";"):
+        access_type, _, rhs = lockdef.partition(":")
+        if access_type.strip() == "view":
+            if all(funcname in _CALLER_LOCKFUNCS for funcname in _RE_LOCKFUNC.findall(rhs)):
+                return rhs.strip()
+            return None
+    return ""
+
+
+def _ngrams(term):
+    "The (lower-case, space-padded) n-grams of term"
+    term = " %s " % term.lower()
+    return set(term[i:i + _NGRAM_SIZE] for i in range(len(term) - _NGRAM_SIZE + 1))
+
+
+class NgramIndex(object):
+    """
+    Vocabulary with an inverted index of character n-grams. Terms
+    are reference counted, so the same term can be added by several
+    sources.
+    """
+    def __init__(self, terms=()):
+        self.terms = {}
+        self.refs = defaultdict(int)
+        self.index = defaultdict(set)
+        for term in terms:
+            self.add(term)
+
+    def add(self, term):
+        "Add a term to the vocabulary"
+        if not term:
+            return
+        self.refs[term] += 1
+        if term not in self.terms:
+            self.terms[term] = _char_vector(term)
+            for ngram in _ngrams(term):
+                self.index[ngram].add(term)
+
+    def remove(self, term):
+        "Remove a term from the vocabulary"
+        if term not in self.terms:
+            return
+        self.refs[term] -= 1
+        if self.refs[term] > 0:
+            return
+        del self.refs[term]
+        del self.terms[term]
+        for ngram in _ngrams(term):
+            terms = self.index.get(ngram)
+            if terms:
+                terms.discard(term)
+                if not terms:
+                    del self.index[ngram]
+
+    def candidates(self, query):
+        "All terms sharing at least one n-gram with query"
+        found = set()
+        for ngram in _ngrams(query):
+            found.update(self.index.get(ngram, ()))
+        return found
+
+    def rate(self, query, candidates=None):
+        """
+        Return a list of (similarity, term) for all candidates (default
+        is all terms sharing an n-gram with query).
+        """
+        qvec, qnorm = _char_vector(query)
+        if not qnorm:
+            return []
+        if candidates is None:
+            candidates = self.candidates(query)
+        rated = []
+        for term in candidates:
+            tvec, tnorm = self.terms[term]
+            if not tnorm:
+                continue
+            dot = sum(num * tvec.get(char, 0) for char, num in qvec.iteritems())
+            rated.append((float(dot) / (qnorm * tnorm), term))
+        return rated
+
+
+class HelpIndex(object):
+    """
+    Index of the database help entries, plus a small cache of
+    n-gram indexes for the command vocabularies of the cmdsets seen.
+    """
+    def __init__(self):
+        self.built = False
+        # {entry id: entry}
+        self.entries = {}
+        # {entry id: (key, lower-case category, shared view lock)}
+        self.entry_info = {}
+        # {lower-case key: [entry ids]}
+        self.keys = defaultdict(list)
+        self.categories = defaultdict(set)
+        self.ngrams = NgramIndex()
+        self.cmd_indexes = {}
+        self.cmd_index_order = []
+
+    # building and updating
+
+    def build(self):
+        "(Re)build the index from the database with one query."
+        self.built = False
+        self.entries, self.entry_info = {}, {}
+        self.keys = defaultdict(list)
+        self.categories = defaultdict(set)
+        self.ngrams = NgramIndex()
+        for entry in HelpEntry.objects.all():
+            self._add(entry)
+        self.built = True
+
+    def _check_built(self):
+        if not self.built:
+            self.build()
+
+    def _add(self, entry):
+        "Add entry to the index"
+        category = entry.db_help_category.lower()
+        self.entry_info[entry.id] = (entry.db_key, category,
+                                     _shared_view_lock(entry.db_lock_storage))
+        self.entries[entry.id] = entry
+        self.keys[entry.db_key.lower()].append(entry.id)
+        self.categories[category].add(entry.id)
+        self.ngrams.add(entry.db_key)
+        self.ngrams.add(category)
+
+    def _remove(self, entry_id):
+        "Remove the entry with the given id from the index"
+        info = self.entry_info.pop(entry_id, None)
+        if not info:
+            return
+        # the entry may already hold its new key, so use the indexed one
+        key, category = info[:2]
+        del self.entries[entry_id]
+        self.keys[key.lower()].remove(entry_id)
+        if not self.keys[key.lower()]:
+            del self.keys[key.lower()]
+        self.categories[category].discard(entry_id)
+        if not self.categories[category]:
+            del self.categories[category]
+        self.ngrams.remove(key)
+        self.ngrams.remove(category)
+
+    def update(self, entry):
+        "Called whenever entry was saved"
+        if self.built:
+            self._remove(entry.id)
+            self._add(entry)
+
+    def remove(self, entry):
+        "Called whenever entry was deleted"
+        if self.built:
+            self._remove(entry.id)
+
+    # access
+
+    def _visible_ids(self, caller, entry_ids=None):
+        """
+        Return the ids of the entries visible to caller. If entry_ids
+        is given, only these entries are considered. View locks
+        depending only on the caller are checked once per lock.
+        """
+        visible = set()
+        shared = {}
+        if entry_ids is None:
+            entry_ids = self.entries.keys()
+        for entry_id in entry_ids:
+            lock = self.entry_info[entry_id][2]
+            if lock is None:
+                access = self.entries[entry_id].access(caller, 'view', default=True)
+            elif lock in shared:
+                access = shared[lock]
+            else:
+                access = shared[lock] = self.entries[entry_id].access(caller, 'view', default=True)
+            if access:
+                visible.add(entry_id)
+        return visible
+
+    def visible_topics(self, caller, category=None):
+        """
+        Return all help entries visible to caller, optionally only
+        those in the given category.
+        """
+        self._check_built()
+        entry_ids = None
+        if category is not None:
+            entry_ids = self.categories.get(category.lower(), ())
+        return [self.entries[entry_id] for entry_id in self._visible_ids(caller, entry_ids)]
+
+    def find_topic(self, query, caller):
+        """
+        Return the help entry exactly matching query (a key or #dbref),
+        if it exists and caller may view it. Of several entries with the
+        same key, the first one caller may view is returned.
+        """
+        self._check_built()
+        entry_id = dbref(query)
+        if entry_id and entry_id in self.entries:
+            entry_ids = [entry_id]
+        else:
+            entry_ids = self.keys.get(query.lower(), ())
+        visible = self._visible_ids(caller, entry_ids)
+        if visible:
+            return self.entries[min(visible)]
+        return None
+
+    def has_category(self, category, caller):
+        "Check if category has any entries visible to caller"
+        self._check_built()
+        entry_ids = self.categories.get(category.lower())
+        return bool(entry_ids and self._visible_ids(caller, entry_ids))
+
+    def _get_cmd_index(self, cmd_terms):
+        "Get the (cached) n-gram index for a command vocabulary"
+        signature = frozenset(cmd_terms)
+        index = self.cmd_indexes.get(signature)
+        if index is None:
+            index = NgramIndex(signature)
+            self.cmd_indexes[signature] = index
+            self.cmd_index_order.append(signature)
+            if len(self.cmd_index_order) > _MAX_CMD_INDEXES:
+                del self.cmd_indexes[self.cmd_index_order.pop(0)]
+        return index
+
+    def suggest(self, query, caller, cmd_terms=(), cutoff=0.6, maxnum=5):
+        """
+        Suggest help topics similar to query.
+
+        query - the (lower-case) search string
+        caller - only topics visible to caller are suggested
+        cmd_terms - the command keys/aliases/categories available to caller
+        cutoff - minimum similarity (0..1) of suggestions
+        maxnum - maximum number of suggestions to return
+
+        Falls back to topics starting with query if no similar topics
+        were found.
+        """
+        self._check_built()
+        cmd_index = self._get_cmd_index(cmd_terms)
+        rated = dict((term, sim) for sim, term in cmd_index.rate(query))
+        db_candidates = self.ngrams.candidates(query)
+        if db_candidates:
+            # only keep database topics/categories the caller may see
+            entry_ids = set()
+            for term in db_candidates:
+                entry_ids.update(self.keys.get(term.lower(), ()))
+                entry_ids.update(self.categories.get(term, ()))
+            visible = self._visible_ids(caller, entry_ids)
+            db_candidates = [term for term in db_candidates
+                             if visible.intersection(self.keys.get(term.lower(), ()))
+                             or visible.intersection(self.categories.get(term, ()))]
+            for sim, term in self.ngrams.rate(query, db_candidates):
+                rated[term] = max(sim, rated.get(term, 0))
+        rated.pop(query, None)
+        suggestions = [term for sim, term in sorted(((sim, term) for term, sim in rated.items()),
+                                                    reverse=True) if sim >= cutoff][:maxnum]
+        if not suggestions:
+            suggestions = [term for term in rated if term.startswith(query)]
+        return suggestions
+
+
+HELP_INDEX = HelpIndex()
+
+
+def _update_index(sender, instance, **kwargs):
+    "Keep HELP_INDEX up to date on HelpEntry saves"
+    HELP_INDEX.update(instance)
+
+
+def _remove_from_index(sender, instance, **kwargs):
+    "Keep HELP_INDEX up to date on HelpEntry deletes"
+    HELP_INDEX.remove(instance)
+
+post_save.connect(_update_index, sender=HelpEntry)
+post_delete.connect(_remove_from_index, sender=HelpEntry)
@@ -2,19 +2,24 @@
 Custom manager for Objects.
 """
 from itertools import chain
+from django.db import transaction
 from django.db.models import Q
 from django.conf import settings
 from django.db.models.fields import exceptions
 from src.typeclasses.managers import TypedObjectManager
 from src.typeclasses.managers import returns_typeclass, returns_typeclass_list
+from src.objects.searchindex import SEARCH_INDEX
 from src.utils import utils
 from src.utils.utils import to_unicode, is_iter, make_iter, string_partial_matching
 
 __all__ = ("ObjectManager",)
 _GA = object.__getattribute__
+_SA = object.__setattr__
 
 # delayed import
 _ATTR = None
+_ScriptDB = None
+_TICKER_HANDLER = None
 
 
 # Try to use a custom way to parse id-tagged multimatches.
@@ -46,6 +51,7 @@ class ObjectManager(TypedObjectManager):
     get_contents
     object_search (interface to many of the above methods,
                    equivalent to ev.search_object)
+    bulk_delete
     copy_object
 
     """
@@ -181,6 +187,24 @@ class ObjectManager(TypedObjectManager):
         exclude_restriction = Q(pk__in=[_GA(obj, "id") for obj in make_iter(excludeobj)]) if excludeobj else Q()
         return self.filter(db_location=location).exclude(exclude_restriction)
 
+    def _get_objs_by_ids(self, ids, typeclasses=None):
+        """
+        Get the objects with the given ids, ordered by id, taking them
+        from the idmapper cache when possible.
+        """
+        objs, missing = [], []
+        for obj_id in ids:
+            obj = self.model.get_cached_instance(obj_id)
+            if obj is None:
+                missing.append(obj_id)
+            else:
+                objs.append(obj)
+        if missing:
+            objs.extend(self.filter(id__in=missing))
+        if typeclasses:
+            objs = [obj for obj in objs if _GA(obj, "db_typeclass_path") in typeclasses]
+        return sorted(objs, key=lambda obj: _GA(obj, "id"))
+
     @returns_typeclass_list
     def get_objs_with_key_or_alias(self, ostring, exact=True,
                                          candidates=None, typeclasses=None):
@@ -189,6 +213,9 @@ class ObjectManager(TypedObjectManager):
         matching based on the utils.string_partial_matching function.
         candidates - list of candidate objects to restrict on
         typeclasses - list of typeclass path strings to restrict on
+
+        Matching is done against the in-memory SEARCH_INDEX, so the
+        database is only hit for objects not already in the cache.
         """
         if not isinstance(ostring, basestring):
             if hasattr(ostring, "key"):
@@ -200,34 +227,35 @@ class ObjectManager(TypedObjectManager):
             # Exit early.
             return []
 
-        # build query objects
-        candidates_id = [_GA(obj, "id") for obj in make_iter(candidates) if obj]
-        cand_restriction = candidates != None and Q(pk__in=make_iter(candidates_id)) or Q()
-        type_restriction = typeclasses and Q(db_typeclass_path__in=make_iter(typeclasses)) or Q()
+        candidates_id = None
+        if candidates != None:
+            candidates_id = set(_GA(obj, "id") for obj in make_iter(candidates) if obj)
+        typeclasses = make_iter(typeclasses) if typeclasses else None
         if exact:
-            # exact match - do direct search
-            return self.filter(cand_restriction & type_restriction & (Q(db_key__iexact=ostring) |
-                               Q(db_tags__db_key__iexact=ostring) & Q(db_tags__db_tagtype__iexact="alias"))).distinct()
-        elif candidates:
-            # fuzzy with candidates
-            key_candidates = self.filter(cand_restriction & type_restriction)
-        else:
-            # fuzzy without supplied candidates - we select our own candidates
-            key_candidates = self.filter(type_restriction & (Q(db_key__istartswith=ostring) | Q(db_tags__db_key__istartswith=ostring))).distinct()
-            candidates_id = [_GA(obj, "id") for obj in key_candidates]
-        # fuzzy matching
-        key_strings = key_candidates.values_list("db_key", flat=True).order_by("id")
+            # exact match on key or alias
+            return self._get_objs_by_ids(SEARCH_INDEX.find_exact(ostring, candidates_id), typeclasses)
 
+        # fuzzy matching. All words must match the start of a word in
+        # the key/alias, so the first word is enough to find candidates.
+        inp_words = ostring.lower().split()
+        if not inp_words:
+            return []
+        key_candidates = self._get_objs_by_ids(SEARCH_INDEX.find_prefix(inp_words[0], candidates_id), typeclasses)
+        key_strings = [SEARCH_INDEX.get_key(_GA(obj, "id")) for obj in key_candidates]
         index_matches = string_partial_matching(key_strings, ostring, ret_index=True)
         if index_matches:
-            return [obj for ind, obj in enumerate(key_candidates) if ind in index_matches]
+            return [key_candidates[ind] for ind in index_matches]
         else:
-            alias_candidates = self.filter(id__in=candidates_id, db_tags__db_tagtype__iexact="alias")
-            alias_strings = alias_candidates.values_list("db_key", flat=True)
-            index_matches = string_partial_matching(alias_strings, ostring, ret_index=True)
-            if index_matches:
-                return [alias.db_obj for ind, alias in enumerate(alias_candidates) if ind in index_matches]
-            return []
+            alias_candidates = [(obj, alias) for obj in key_candidates
+                                for alias in SEARCH_INDEX.get_aliases(_GA(obj, "id"))]
+            index_matches = string_partial_matching([alias for obj, alias in alias_candidates],
+                                                    ostring, ret_index=True)
+            matches = []
+            for ind in index_matches:
+                obj = alias_candidates[ind][0]
+                if obj not in matches:
+                    matches.append(obj)
+            return matches
 
     # main search methods and helper functions
 
@@ -337,6 +365,141 @@ class ObjectManager(TypedObjectManager):
         # return a list (possibly empty)
         return matches
 
+    #
+    # ObjectManager Delete method
+    #
+
+    def bulk_delete(self, objs):
+        """
+        Delete many objects at once. This does the same as calling
+        delete() on each object, but with a fixed number of queries:
+
+        - at_object_delete() is called on each object; objects for which
+          it returns False are not deleted.
+        - exits in or leading to the deleted objects are deleted too.
+        - puppeting players are unset with one UPDATE.
+        - scripts on all objects are fetched with one query and stopped.
+        - contents are moved to their homes (or the default home) with
+          one UPDATE per destination. Only puppeted objects are moved
+          with move_to, so they get messages and a look.
+        - attributes, tags and the objects themselves are deleted with
+          set-based DELETEs in one transaction.
+
+        objs - an iterable of objects (typeclassed or database objects)
+        Returns the number of objects deleted.
+        """
+        global _ATTR, _ScriptDB, _TICKER_HANDLER
+        if not _ATTR:
+            from src.typeclasses.models import Attribute as _ATTR
+        if not _ScriptDB:
+            from src.scripts.models import ScriptDB as _ScriptDB
+        if not _TICKER_HANDLER:
+            from src.scripts.tickerhandler import TICKER_HANDLER as _TICKER_HANDLER
+
+        dbobjs = {}
+        for obj in make_iter(objs):
+            dbobj = obj.dbobj
+            if dbobj.id and not dbobj._is_deleted:
+                dbobjs[dbobj.id] = dbobj
+        if not dbobjs:
+            return 0
+        # exits are deleted along with their location or destination
+        for exi in self.filter(Q(db_location__in=dbobjs.keys(), db_destination__isnull=False) |
+                               Q(db_destination__in=dbobjs.keys())).exclude(id__in=dbobjs.keys()):
+            dbobjs[exi.id] = exi.dbobj
+
+        # run the pre-delete hook; this may abort individual deletes
+        to_delete = {}
+        for dbid, dbobj in dbobjs.items():
+            if _GA(dbobj, "delete_iter") > 0:
+                continue
+            if not dbobj.at_object_delete():
+                _SA(dbobj, "delete_iter", 0)
+                continue
+            dbobj.delete_iter += 1
+            to_delete[dbid] = dbobj
+        if not to_delete:
+            return 0
+        ids = to_delete.keys()
+
+        puppeted = []
+        for dbobj in to_delete.values():
+            # kick off any puppeting players
+            for session in dbobj.sessions:
+                session.msg("Your character %s has been destroyed." % dbobj.key)
+            if dbobj.player:
+                _SA(dbobj.player, "character", None)
+                # unset in memory only; stored for all at once below
+                _SA(dbobj, "db_player", None)
+                puppeted.append(dbobj.id)
+            _TICKER_HANDLER.remove(dbobj)
+        if puppeted:
+            self.filter(id__in=puppeted).update(db_player=None)
+
+        for script in _ScriptDB.objects.filter(db_obj__in=ids):
+            script.stop()
+
+        self._bulk_relocate_contents(ids)
+
+        attr_through = self.model.db_attributes.through
+        tag_through = self.model.db_tags.through
+        with transaction.atomic():
+            attr_ids = list(attr_through.objects.filter(
+                            objectdb_id__in=ids).values_list("attribute_id", flat=True))
+            attr_through.objects.filter(objectdb_id__in=ids).delete()
+            if attr_ids:
+                _ATTR.objects.filter(id__in=attr_ids).delete()
+            tag_through.objects.filter(objectdb_id__in=ids).delete()
+            self.filter(id__in=ids).delete()
+
+        for dbobj in to_delete.values():
+            # mimic what TypedObject.delete does on the instance
+            _SA(dbobj, "_cached_typeclass", None)
+            dbobj.flush_from_cache()
+            dbobj.delete = dbobj._deleted
+            dbobj._is_deleted = True
+        return len(ids)
+
+    def _bulk_relocate_contents(self, ids):
+        """
+        Move everything located in the objects with the given ids (and
+        not deleted with them) to its home, falling back to the default
+        home. Helper for bulk_delete.
+        """
+        contents = list(self.filter(db_location__in=ids).exclude(id__in=ids))
+        if not contents:
+            return
+        default_home_id = int(settings.DEFAULT_HOME.lstrip("#"))
+        if default_home_id in ids or not self.filter(id=default_home_id).exists():
+            default_home_id = None
+        new_homes = []
+        by_destination = {}
+        for obj in contents:
+            dbobj = obj.dbobj
+            home_id = _GA(dbobj, "db_home_id")
+            if not home_id or home_id in ids:
+                home_id = default_home_id
+                new_homes.append(dbobj)
+            if dbobj.has_player and home_id:
+                # puppeted objects are moved the normal way
+                dbobj.msg("Your current location has ceased to exist, moving you home.")
+                dbobj.move_to(self.get(id=home_id))
+                continue
+            by_destination.setdefault(home_id, []).append(dbobj)
+
+        if new_homes:
+            self.filter(id__in=[obj.id for obj in new_homes]).update(db_home=default_home_id)
+        for home_id, objs in by_destination.items():
+            self.filter(id__in=[obj.id for obj in objs]).update(db_location=home_id)
+        # update the in-memory (idmapper-cached) instances to match
+        for dbobj in new_homes:
+            _SA(dbobj, "db_home_id", default_home_id)
+            dbobj.__dict__.pop("_db_home_cache", None)
+        for home_id, objs in by_destination.items():
+            for dbobj in objs:
+                _SA(dbobj, "db_location_id", home_id)
+                dbobj.__dict__.pop("_db_location_cache", None)
+
     #
     # ObjectManager Copy method
     #
@@ -16,11 +16,13 @@ transparently through the decorating TypeClass.
 
 import traceback
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
 from src.typeclasses.models import TypedObject, NickHandler
 from src.objects.manager import ObjectManager
+from src.objects.searchindex import SEARCH_INDEX
 from src.players.models import PlayerDB
 from src.commands.cmdsethandler import CmdSetHandler
 from src.commands import cmdhandler
@@ -849,3 +851,8 @@ class ObjectDB(TypedObject):
         # Perform the deletion of the object
         super(ObjectDB, self).delete()
         return True
+
+# keep the key/alias search index up to date
+post_save.connect(SEARCH_INDEX.at_post_save, sender=ObjectDB, dispatch_uid="objsearchindex")
+post_delete.connect(SEARCH_INDEX.at_post_delete, sender=ObjectDB, dispatch_uid="objsearchindex")
+m2m_changed.connect(SEARCH_INDEX.at_tags_changed, sender=ObjectDB.db_tags.through, dispatch_uid="objsearchindex")
@@ -0,0 +1,237 @@
+"""
+Object search index
+
+This keeps an in-memory word-prefix index over the keys and aliases
+of all objects, used by ObjectDB.objects.get_objs_with_key_or_alias
+(and thereby object_search and obj.search) instead of querying the
+database with iexact/istartswith joins on every search.
+
+    from src.objects.searchindex import SEARCH_INDEX
+
+    ids = SEARCH_INDEX.find_exact("red button")
+    ids = SEARCH_INDEX.find_prefix("but", candidate_ids=[4, 5, 6])
+
+The index is built with two queries the first time it is needed. It
+is kept current through the post_save/post_delete signals of ObjectDB
+(key changes) and the m2m_changed signal of its tags (alias changes),
+connected in src.objects.models. Code storing objects without
+signals (like the bulk creation in src.utils.create) must call
+update() on the objects it changed.
+
+Searches limited to a set of candidates (such as the contents of a
+location) match the indexed keys and aliases of the candidates
+directly, so their cost depends on the number of candidates and not
+on the number of objects in the game.
+
+"""
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+__all__ = ("SEARCH_INDEX",)
+
+_GA = object.__getattribute__
+
+# delayed import
+_ObjectDB = None
+_ALIAS_TAGTYPE = "alias"
+
+
+def _init_models():
+    global _ObjectDB
+    if not _ObjectDB:
+        from src.objects.models import ObjectDB as _ObjectDB
+
+
+class ObjectSearchIndex(object):
+    """
+    Index of lower-case object keys and aliases. Full names are
+    indexed for exact matches and their individual words (kept in
+    sorted order) for word-prefix matches.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        "Forget everything; the index is rebuilt on next use"
+        self.built = False
+        self.keys = {}
+        self.aliases = {}
+        self.names = defaultdict(set)
+        self.words = defaultdict(set)
+        self.sorted_words = []
+        self.dirty = set()
+
+    # building and updating
+
+    def build(self):
+        "Build the index from the database"
+        _init_models()
+        self.clear()
+        aliases = defaultdict(list)
+        through = _ObjectDB.db_tags.through
+        for obj_id, alias in through.objects.filter(
+                tag__db_tagtype=_ALIAS_TAGTYPE).values_list("objectdb_id", "tag__db_key"):
+            aliases[obj_id].append(alias)
+        for obj_id, key in _ObjectDB.objects.values_list("id", "db_key"):
+            self._add(obj_id, key, aliases.get(obj_id, []), sort=False)
+        # sorting once is much faster than inserting each word in order
+        self.sorted_words = sorted(self.words)
+        self.built = True
+
+    def _add_name(self, obj_id, name, sort=True):
+        self.names[name].add(obj_id)
+        for word in name.split():
+            if sort and word not in self.words:
+                insort(self.sorted_words, word)
+            self.words[word].add(obj_id)
+
+    def _remove_name(self, obj_id, name):
+        ids = self.names.get(name)
+        if ids:
+            ids.discard(obj_id)
+            if not ids:
+                del self.names[name]
+        for word in name.split():
+            ids = self.words.get(word)
+            if ids is None:
+                continue
+            ids.discard(obj_id)
+            if not ids:
+                del self.words[word]
+                del self.sorted_words[bisect_left(self.sorted_words, word)]
+
+    def _add(self, obj_id, key, aliases, sort=True):
+        """
+        Index an object. Unless sort is set, new words are not put
+        in sorted_words (build sorts them all at the end).
+        """
+        key = (key or "").lower()
+        aliases = [alias.lower() for alias in aliases if alias]
+        self.keys[obj_id] = key
+        self.aliases[obj_id] = aliases
+        for name in set([key] + aliases):
+            self._add_name(obj_id, name, sort=sort)
+
+    def _remove(self, obj_id):
+        key = self.keys.pop(obj_id, None)
+        if key is None:
+            return
+        for name in set([key] + self.aliases.pop(obj_id, [])):
+            self._remove_name(obj_id, name)
+
+    def update(self, dbobj, aliases_changed=True):
+        """
+        Re-index the key of dbobj. If aliases_changed is set, its
+        aliases are reloaded from the database the next time the
+        index is searched.
+        """
+        if not self.built:
+            return
+        obj_id = _GA(dbobj, "id")
+        aliases = self.aliases.get(obj_id, [])
+        self._remove(obj_id)
+        self._add(obj_id, _GA(dbobj, "db_key"), aliases)
+        if aliases_changed:
+            self.dirty.add(obj_id)
+
+    def remove(self, obj_id):
+        "Remove a deleted object from the index"
+        if self.built:
+            self._remove(obj_id)
+            self.dirty.discard(obj_id)
+
+    def _check_index(self):
+        "Build the index or reload dirty aliases, if needed"
+        if not self.built:
+            self.build()
+        elif self.dirty:
+            dirty, self.dirty = self.dirty, set()
+            aliases = defaultdict(list)
+            through = _ObjectDB.db_tags.through
+            for obj_id, alias in through.objects.filter(objectdb_id__in=dirty,
+                    tag__db_tagtype=_ALIAS_TAGTYPE).values_list("objectdb_id", "tag__db_key"):
+                aliases[obj_id].append(alias)
+            for obj_id in dirty:
+                if obj_id in self.keys:
+                    key = self.keys[obj_id]
+                    self._remove(obj_id)
+                    self._add(obj_id, key, aliases.get(obj_id, []))
+
+    # searching
+
+    def find_exact(self, ostring, candidate_ids=None):
+        """
+        Return the ids of objects with a key or alias matching ostring
+        (case-insensitive), optionally limited to candidate_ids.
+        """
+        self._check_index()
+        name = ostring.lower()
+        if candidate_ids is not None:
+            return set(obj_id for obj_id in candidate_ids
+                       if name in self._get_names(obj_id))
+        return set(self.names.get(name, ()))
+
+    def find_prefix(self, prefix, candidate_ids=None):
+        """
+        Return the ids of objects with a word in their key or aliases
+        starting with prefix, optionally limited to candidate_ids.
+        """
+        self._check_index()
+        prefix = prefix.lower()
+        if candidate_ids is not None:
+            return set(obj_id for obj_id in candidate_ids
+                       if any(word.startswith(prefix) for name in self._get_names(obj_id)
+                              for word in name.split()))
+        sorted_words, words = self.sorted_words, self.words
+        ids = set()
+        for iword in xrange(bisect_left(sorted_words, prefix), len(sorted_words)):
+            word = sorted_words[iword]
+            if not word.startswith(prefix):
+                break
+            ids.update(words[word])
+        return ids
+
+    def _get_names(self, obj_id):
+        "Lower-case key and aliases of the object with obj_id"
+        if obj_id not in self.keys:
+            return []
+        return [self.keys[obj_id]] + self.aliases.get(obj_id, [])
+
+    def get_key(self, obj_id):
+        "Lower-case key of the object with obj_id"
+        return self.keys.get(obj_id, "")
+
+    def get_aliases(self, obj_id):
+        "Lower-case aliases of the object with obj_id"
+        return self.aliases.get(obj_id, [])
+
+    # signal handlers (connected in src.objects.models)
+
+    def at_post_save(self, sender, instance, created=False, update_fields=None, **kwargs):
+        "Re-index keys of saved objects"
+        if not self.built:
+            return
+        if created:
+            self._remove(instance.id)
+            self._add(instance.id, instance.db_key, [])
+        elif update_fields is None or "db_key" in update_fields:
+            self.update(instance, aliases_changed=False)
+
+    def at_post_delete(self, sender, instance, **kwargs):
+        "Remove deleted objects"
+        self.remove(instance.id)
+
+    def at_tags_changed(self, sender, instance, action, reverse, pk_set, **kwargs):
+        "Mark objects whose tags (and thereby maybe aliases) changed"
+        if not self.built or action not in ("post_add", "post_remove", "post_clear"):
+            return
+        if not reverse:
+            self.dirty.add(instance.id)
+        elif pk_set:
+            self.dirty.update(pk_set)
+        else:
+            # a tag was removed from an unknown set of objects
+            self.built = False
+
+
+SEARCH_INDEX = ObjectSearchIndex()
@@ -12,6 +12,7 @@ from django.utils.translation import ugettext as _
 from src.typeclasses.typeclass import TypeClass
 from src.scripts.models import ScriptDB
 from src.comms import channelhandler
+from src.server.snapshot import RELOAD_SNAPSHOT
 from src.utils import logger
 
 __all__ = ["Script", "DoNothing", "CheckSessions",
@@ -133,9 +134,13 @@ class ScriptBase(TypeClass):
         if self.db._paused_time:
             # the script was paused; restarting
             callcount = self.db._paused_callcount or 0
+            # if paused by a reload, keep the phase it had before it
+            start_delay = RELOAD_SNAPSHOT.script_delay(self.dbid)
+            if start_delay is None:
+                start_delay = self.db._paused_time
             self.ndb._task.start(self.dbobj.db_interval,
                                  now=False,
-                                 start_delay=self.db._paused_time,
+                                 start_delay=start_delay,
                                  count_start=callcount)
             del self.db._paused_time
             del self.db._paused_repeats
@@ -555,6 +560,26 @@ class ValidateIdmapperCache(Script):
             from src.utils.idmapper.base import conditional_flush as _FLUSH_CACHE
         _FLUSH_CACHE(_IDMAPPER_CACHE_MAX_MEMORY)
 
+_SERVER_STATS = None
+class ValidateServerStats(Script):
+    """
+    Reconcile the running server statistics with the database
+    """
+    def at_script_creation(self):
+        self.key = "sys_stats_validate"
+        self.desc = _("Reconciles the server statistics counters.")
+        self.interval = 60 * 10
+        self.persistent = True
+
+    def at_repeat(self):
+        "Called every 10 mins"
+        global _SERVER_STATS
+        if not _SERVER_STATS:
+            from src.server.stats import SERVER_STATS as _SERVER_STATS
+        drift = _SERVER_STATS.reconcile()
+        if drift:
+            logger.log_infomsg("Server statistics were off by: %s" % drift)
+
 class ValidateScripts(Script):
     "Check script validation regularly"
     def at_script_creation(self):
@@ -583,4 +608,7 @@ class ValidateChannelHandler(Script):
         "called every hour+"
         #print "ValidateChannelHandler run."
         channelhandler.CHANNELHANDLER.update()
+        # apply the channel log retention policy
+        from src.comms.channelhistory import CHANNEL_HISTORY
+        CHANNEL_HISTORY.prune()
 
@@ -245,18 +245,28 @@ class TickerHandler(object):
         else:
             ServerConfig.objects.conf(key=self.save_name, delete=True)
 
-    def restore(self):
+    def restore(self, start_delays=None):
         """
         Restore ticker_storage from database and re-initialize the handler from storage. This is triggered by the server at restart.
+
+        start_delays - optional {interval: delay} overriding the stored
+                       start delays (used to keep the tick phases over
+                       a reload).
         """
         # load stored command instructions and use them to re-initialize handler
         ticker_storage = ServerConfig.objects.conf(key=self.save_name)
         if ticker_storage:
-            self.ticker_storage = dbunserialize(ticker_storage)
-            #print "restore:", self.ticker_storage
-            for (obj, interval), (args, kwargs) in self.ticker_storage.items():
+            ticker_storage = dbunserialize(ticker_storage)
+            #print "restore:", ticker_storage
+            self.ticker_storage = {}
+            for (obj, interval), (args, kwargs) in ticker_storage.items():
+                if start_delays and interval in start_delays:
+                    kwargs["_start_delay"] = start_delays[interval]
                 obj = unpack_dbobj(obj)
-                _, store_key = self._store_key(obj, interval)
+                isdb, store_key = self._store_key(obj, interval)
+                if isdb:
+                    # re-keyed, in case it was stored on an older packed form
+                    self.ticker_storage[store_key] = (args, kwargs)
                 self.ticker_pool.add(store_key, obj, interval, *args, **kwargs)
 
     def add(self, obj, interval, *args, **kwargs):
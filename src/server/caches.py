@@ -104,6 +104,22 @@ def hashid(obj, suffix=""):
 #            handler()
 
 
+# {model class: {fieldname: name of its _at_<fieldname>_postsave handler}}
+_POSTSAVE_HANDLERS = {}
+
+
+def _get_postsave_handlers(sender):
+    "Map the fields of sender having post-save handlers to their handlers"
+    handlers = _POSTSAVE_HANDLERS.get(sender)
+    if handlers is None:
+        sdict = _GA(sender, '__dict__')
+        handlers = dict((field.name, "_at_%s_postsave" % field.name)
+                        for field in _GA(sender, "_meta").fields
+                        if "_at_%s_postsave" % field.name in sdict)
+        _POSTSAVE_HANDLERS[sender] = handlers
+    return handlers
+
+
 def field_post_save(sender, instance=None, update_fields=None, raw=False, **kwargs):
     """
     Called at the beginning of the field save operation. The save method
@@ -114,21 +130,15 @@ def field_post_save(sender, instance=None, update_fields=None, raw=False, **kwar
     """
     if raw:
         return
-    if update_fields:
-        # this is a list of strings at this point. We want field objects
-        update_fields = (_GA(_GA(instance, "_meta"), "get_field_by_name")(field)[0] for field in update_fields)
-    else:
-        # meta.fields are already field objects; get them all
-        update_fields = _GA(_GA(instance, "_meta"), "fields")
-    for field in update_fields:
-        fieldname = field.name
-        handlername = "_at_%s_postsave" % fieldname
-        handler = _GA(instance, handlername) if handlername in _GA(sender, '__dict__') else None
-        if callable(handler):
-            handler()
-        trackerhandler = _GA(instance, "_trackerhandler") if "_trackerhandler" in _GA(instance, '__dict__') else None
-        if trackerhandler:
-            trackerhandler.update(fieldname, _GA(instance, fieldname))
+    # only fields with handlers or trackers are looked at
+    for fieldname, handlername in _get_postsave_handlers(sender).items():
+        if update_fields is None or fieldname in update_fields:
+            handler = _GA(instance, handlername)
+            if callable(handler):
+                handler()
+    trackerhandler = _GA(instance, '__dict__').get("_trackerhandler")
+    if trackerhandler:
+        trackerhandler.update_fields(update_fields)
 
 #------------------------------------------------------------
 # Attribute lookup cache
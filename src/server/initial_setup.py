@@ -163,8 +163,10 @@ def create_system_scripts():
     script3 = create.create_script(scripts.ValidateChannelHandler)
     # flush the idmapper cache
     script4 = create.create_script(scripts.ValidateIdmapperCache)
+    # reconcile the server statistics counters
+    script5 = create.create_script(scripts.ValidateServerStats)
 
-    if not script1 or not script2 or not script3 or not script4:
+    if not script1 or not script2 or not script3 or not script4 or not script5:
         print " Error creating system scripts."
 
 
@@ -35,6 +35,8 @@ messages.
 """
 
 from inspect import isfunction
+from collections import defaultdict
+from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks
 from django.conf import settings
 from src.server.models import ServerConfig
@@ -50,6 +52,10 @@ _SA = object.__setattr__
 _GA = object.__getattribute__
 _DA = object.__delattr__
 
+# how often (in seconds) the reports of tracked values are sent
+_REPORT_INTERVAL = settings.OOB_REPORT_INTERVAL
+_NOVALUE = object()
+
 # load resources from plugin module
 _OOB_FUNCS = {}
 for mod in make_iter(settings.OOB_PLUGIN_MODULES):
@@ -89,17 +95,20 @@ class TrackerHandler(object):
             pass
         self.obj = obj
         self.ntrackers = 0
-        # initiate store only with valid on-object fieldnames
-        self.tracktargets = dict((key, {})
-                for key in _GA(_GA(self.obj, "_meta"), "get_all_field_names")())
+        self.fieldnames = set(_GA(_GA(self.obj, "_meta"), "get_all_field_names")())
+        # only fields with trackers are stored, so saves only
+        # have to look at these
+        self.tracktargets = {}
 
     def add(self, fieldname, tracker):
         """
         Add tracker to the handler. Raises KeyError if fieldname
         does not exist.
         """
+        if fieldname not in self.fieldnames:
+            raise KeyError(fieldname)
         trackerkey = tracker.__class__.__name__
-        self.tracktargets[fieldname][trackerkey] = tracker
+        self.tracktargets.setdefault(fieldname, {})[trackerkey] = tracker
         self.ntrackers += 1
 
     def remove(self, fieldname, trackerclass, *args, **kwargs):
@@ -114,24 +123,45 @@ class TrackerHandler(object):
         except Exception:
             logger.log_trace()
         del self.tracktargets[fieldname][trackerkey]
+        if not self.tracktargets[fieldname]:
+            del self.tracktargets[fieldname]
         self.ntrackers -= 1
         if self.ntrackers <= 0:
             # if there are no more trackers, clean this handler
-            del self
+            if _GA(self.obj, "__dict__").get("_trackerhandler") is self:
+                _DA(self.obj, "_trackerhandler")
 
     def update(self, fieldname, new_value):
         """
         Called by the field when it updates to a new value
         """
-        for tracker in self.tracktargets[fieldname].values():
+        for tracker in self.tracktargets.get(fieldname, {}).values():
             try:
                 tracker.update(new_value)
             except Exception:
                 logger.log_trace()
 
+    def update_fields(self, update_fields=None):
+        """
+        Called when the object was saved. Updates the trackers of the
+        saved fields (all tracked fields if update_fields is None).
+        """
+        for fieldname in self.tracktargets.keys():
+            if update_fields is None or fieldname in update_fields:
+                self.update(fieldname, _GA(self.obj, fieldname))
+
 
 # On-object Trackers to load with TrackerHandler
 
+def _report_value(value):
+    "Convert value to something that can be relayed to the Portal"
+    # we must never relay objects across the amp, only text data.
+    try:
+        return value.key
+    except AttributeError:
+        return to_str(value, force_string=True)
+
+
 class TrackerBase(object):
     """
     Base class for OOB Tracker objects. Inherit from this
@@ -166,15 +196,12 @@ class ReportFieldTracker(TrackerBase):
 
     def update(self, new_value, *args, **kwargs):
         "Called by cache when updating the tracked entitiy"
-        # use oobhandler to relay data
-        try:
-            # we must never relay objects across the amp, only text data.
-            new_value = new_value.key
-        except AttributeError:
-            new_value = to_str(new_value, force_string=True)
-        kwargs[self.fieldname] = new_value
-        # this is a wrapper call for sending oob data back to session
-        self.oobhandler.msg(self.sessid, "report", *args, **kwargs)
+        # the oobhandler coalesces the reports to the session
+        self.oobhandler.report(self.sessid, self.fieldname, _report_value(new_value))
+
+    def at_remove(self, *args, **kwargs):
+        "Forget what was last reported"
+        self.oobhandler.forget_report(self.sessid, self.fieldname)
 
 
 class ReportAttributeTracker(TrackerBase):
@@ -194,13 +221,12 @@ class ReportAttributeTracker(TrackerBase):
 
     def update(self, new_value, *args, **kwargs):
         "Called by cache when attribute's db_value field updates"
-        try:
-            new_value = new_value.dbobj
-        except AttributeError:
-            new_value = to_str(new_value, force_string=True)
-        kwargs[self.attrname] = new_value
-        # this is a wrapper call for sending oob data back to session
-        self.oobhandler.msg(self.sessid, "report", *args, **kwargs)
+        # the oobhandler coalesces the reports to the session
+        self.oobhandler.report(self.sessid, self.attrname, _report_value(new_value))
+
+    def at_remove(self, *args, **kwargs):
+        "Forget what was last reported"
+        self.oobhandler.forget_report(self.sessid, self.attrname)
 
 
 
@@ -245,6 +271,11 @@ class OOBHandler(object):
         self.sessionhandler = SESSIONS
         self.oob_tracker_storage = {}
         self.tickerhandler = OOBTickerHandler("oob_ticker_storage")
+        # reports waiting to be sent and the last values sent,
+        # both on the form {sessid: {name: value}}
+        self.outbox = defaultdict(dict)
+        self.last_reported = defaultdict(dict)
+        self.report_call = None
 
     def save(self):
         """
@@ -414,6 +445,41 @@ class OOBHandler(object):
             logger.log_trace(errmsg)
             raise Exception(errmsg)
 
+    def report(self, sessid, name, value):
+        """
+        Queue a report of a tracked value to a session. The reports
+        to each session are coalesced and sent together every
+        settings.OOB_REPORT_INTERVAL seconds; only the latest value
+        of each name is sent, and only if it changed since the last
+        time it was reported.
+        """
+        self.outbox[sessid][name] = value
+        if not self.report_call:
+            self.report_call = reactor.callLater(_REPORT_INTERVAL, self.send_reports)
+
+    def forget_report(self, sessid, name):
+        "Forget the last value reported, so it is always sent next time"
+        self.outbox.get(sessid, {}).pop(name, None)
+        self.last_reported.get(sessid, {}).pop(name, None)
+
+    def send_reports(self):
+        """
+        Send the queued reports, one message per session.
+        """
+        self.report_call = None
+        outbox, self.outbox = self.outbox, defaultdict(dict)
+        for sessid, reports in outbox.iteritems():
+            session = self.sessionhandler.session_from_sessid(sessid)
+            if not session:
+                self.last_reported.pop(sessid, None)
+                continue
+            last = self.last_reported[sessid]
+            changed = dict((name, value) for name, value in reports.iteritems()
+                           if last.get(name, _NOVALUE) != value)
+            if changed:
+                last.update(changed)
+                session.msg(oob=("report", (), changed))
+
     def msg(self, sessid, funcname, *args, **kwargs):
         "Shortcut to force-send an OOB message through the oobhandler to a session"
         session = self.sessionhandler.session_from_sessid(sessid)
@@ -0,0 +1,267 @@
+"""
+Process pool
+
+This service keeps a pool of warm worker processes. It is used by
+src.utils.utils.run_async to run cpu-heavy code (pathfinding, world
+generation, report building ...) outside of the game process:
+
+    from src.utils.utils import run_async
+    run_async(find_path, start_room, end_room, at_return=caller.msg)
+
+The workers are forked from the running server when the service
+starts, so Django and all game modules are already loaded in them;
+only their database connections are reset. Database objects given as
+arguments (or returned) are sent across as packed dbrefs and are
+loaded again on the other side. Jobs submitted during the same
+reactor iteration are grouped into batches, split evenly over the
+workers, so many small jobs don't each pay for a round-trip.
+
+Objects saved by a worker have their fields reloaded and their caches
+cleaned in the server when the batch returns. Callables must be
+importable by path (module-level functions); run_async runs anything
+else in a thread instead. Jobs are not timed out - a worker stuck on a
+job holds up the rest of its batch.
+
+The pool is activated with settings.PROCPOOL_ENABLED (it is not
+started under SQLite, which locks the whole database file). Its queue depth
+and latency are available from PROCPOOL.stats() (and shown by @server).
+
+"""
+import time
+import traceback
+import cPickle
+from collections import defaultdict, deque
+from multiprocessing import Pool, cpu_count
+from twisted.application import service
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from django.conf import settings
+from src.utils.dbserialize import to_pickle, from_pickle, flush_pending
+from src.utils.utils import clean_object_caches
+from src.utils import logger
+
+__all__ = ("PROCPOOL", "ProcessPoolError")
+
+_NPROC = settings.PROCPOOL_NPROC or max(1, cpu_count() - 1)
+_BATCH_SIZE = max(1, settings.PROCPOOL_BATCH_SIZE)
+# how many of the most recent jobs the latency statistics cover
+_LATENCY_SAMPLES = 500
+
+_SA = object.__setattr__
+
+# set in the worker processes
+_IN_WORKER = False
+
+
+class ProcessPoolError(RuntimeError):
+    """
+    An error raised by a job in a worker process. The message is the
+    traceback from the worker.
+    """
+    pass
+
+
+#
+# Worker side
+#
+
+def _init_worker():
+    "Prepare a freshly forked worker process"
+    global _IN_WORKER
+    _IN_WORKER = True
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the connections were inherited from the server and must not be
+    # used (or closed) from here; new ones are opened on demand
+    from django.db import connections
+    for conn in connections.all():
+        conn.connection = None
+    # have saved objects reported back to the server
+    from src.utils.idmapper import base
+    base._IS_SUBPROCESS = True
+
+
+def _run_job(func, source, args, kwargs):
+    """
+    Run one job. A source string is executed with kwargs as its
+    environment and returns its result by calling _return(retval);
+    multiple calls return a list.
+    """
+    if func:
+        return func(*args, **kwargs)
+    returns = []
+    def _return(*retvals):
+        returns.extend(retvals)
+    environment = dict(kwargs, _return=_return)
+    exec source in environment
+    return returns[0] if len(returns) == 1 else (returns or None)
+
+
+def _run_batch(jobs):
+    """
+    Run a batch of pickled jobs in a worker. Returns a list with
+    (success, result or traceback) for each job, plus the packed
+    objects saved while running them.
+    """
+    from src.utils.idmapper import base
+    # don't work on objects cached since the last batch
+    base.flush_cache()
+    results = []
+    for job in jobs:
+        try:
+            func, source, args, kwargs = cPickle.loads(job)
+            args, kwargs = from_pickle(args), from_pickle(kwargs)
+            results.append((True, to_pickle(_run_job(func, source, args, kwargs))))
+        except Exception:
+            results.append((False, traceback.format_exc()))
+    modified = base.PROC_MODIFIED_OBJS.values()
+    base.PROC_MODIFIED_OBJS.clear()
+    return results, to_pickle(modified)
+
+
+#
+# Server side
+#
+
+def _recache(objs):
+    """
+    Reload the fields of objects saved by a worker (one query per
+    model) and clean their caches and those of their locations.
+    """
+    bymodel = defaultdict(dict)
+    for obj in objs:
+        if obj:
+            dbobj = hasattr(obj, "dbobj") and obj.dbobj or obj
+            bymodel[dbobj.__class__][dbobj.id] = dbobj
+    locations = set()
+    for model, dbobjs in bymodel.items():
+        attnames = dict((field.name, field.attname) for field in model._meta.concrete_fields)
+        for values in model.objects.filter(id__in=dbobjs.keys()).values(*attnames):
+            dbobj = dbobjs[values["id"]]
+            old_location = getattr(dbobj, "db_location_id", None)
+            for name, value in values.items():
+                _SA(dbobj, attnames[name], value)
+            for location_id in (old_location, values.get("db_location")):
+                if location_id:
+                    locations.add(location_id)
+            clean_object_caches(dbobj)
+    if locations:
+        from src.objects.models import ObjectDB
+        for location in ObjectDB.objects.filter(id__in=locations):
+            clean_object_caches(location)
+
+
+class ProcessPoolService(service.Service):
+    """
+    Twisted service wrapping a multiprocessing pool of warm workers.
+    """
+    def __init__(self):
+        self.nproc = _NPROC
+        self.pool = None
+        self.pending = []
+        self.flush_call = None
+        # jobs sent to the workers and not yet returned
+        self.nqueued = 0
+        self.njobs = 0
+        self.nbatches = 0
+        self.nerrors = 0
+        self.latencies = deque(maxlen=_LATENCY_SAMPLES)
+
+    def startService(self):
+        "Fork the workers"
+        # don't let the workers inherit open database connections
+        from django.db import connections
+        for conn in connections.all():
+            conn.close()
+        self.pool = Pool(self.nproc, _init_worker)
+        service.Service.startService(self)
+
+    def stopService(self):
+        "Stop the workers, failing all jobs not yet sent"
+        service.Service.stopService(self)
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        pending, self.pending = self.pending, []
+        for job, deferred, t0 in pending:
+            deferred.errback(ProcessPoolError("The process pool was stopped."))
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def available(self):
+        "If jobs can be sent to the pool from here"
+        return bool(self.pool) and not _IN_WORKER
+
+    def submit(self, func, source, args, kwargs):
+        """
+        Queue a job for the workers. Either func (a callable, called
+        with args and kwargs) or source (a Python code string run with
+        kwargs as environment) should be given.
+
+        Returns a Deferred firing with the result, or None if the job
+        could not be pickled (and so can't be sent to a worker).
+        """
+        try:
+            job = cPickle.dumps((func, source, to_pickle(args), to_pickle(kwargs)),
+                                cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError):
+            return None
+        deferred = Deferred()
+        self.pending.append((job, deferred, time.time()))
+        if not self.flush_call:
+            self.flush_call = reactor.callLater(0, self._flush)
+        return deferred
+
+    def _flush(self):
+        "Send the pending jobs to the workers, batched"
+        self.flush_call = None
+        # the workers read Attributes from the database
+        flush_pending()
+        pending, self.pending = self.pending, []
+        # split evenly over the workers, up to the max batch size
+        size = min(_BATCH_SIZE, max(1, -(-len(pending) // self.nproc)))
+        for istart in xrange(0, len(pending), size):
+            batch = pending[istart:istart + size]
+            self.nqueued += len(batch)
+            self.nbatches += 1
+            self.pool.apply_async(_run_batch, ([job for job, deferred, t0 in batch],),
+                callback=lambda ret, batch=batch: reactor.callFromThread(self._batch_done, batch, ret))
+
+    def _batch_done(self, batch, ret):
+        "Called in the reactor thread when a batch returns"
+        results, modified = ret
+        now = time.time()
+        self.nqueued -= len(batch)
+        try:
+            _recache(from_pickle(modified))
+        except Exception:
+            logger.log_trace()
+        for (job, deferred, t0), (success, result) in zip(batch, results):
+            self.njobs += 1
+            self.latencies.append(now - t0)
+            if success:
+                deferred.callback(from_pickle(result))
+            else:
+                self.nerrors += 1
+                deferred.errback(ProcessPoolError(result))
+
+    def stats(self):
+        """
+        Return a dict with the number of workers, jobs waiting to be
+        batched (pending), jobs in the workers (queued), total jobs,
+        batches and errors, and the average and max latency (seconds
+        from submit to result) of the recent jobs.
+        """
+        latencies = list(self.latencies)
+        return {"workers": self.pool and self.nproc or 0,
+                "pending": len(self.pending),
+                "queued": self.nqueued,
+                "jobs": self.njobs,
+                "batches": self.nbatches,
+                "errors": self.nerrors,
+                "latency_avg": latencies and sum(latencies) / len(latencies) or 0.0,
+                "latency_max": latencies and max(latencies) or 0.0}
+
+
+PROCPOOL = ProcessPoolService()
@@ -0,0 +1,261 @@
+"""
+Command profiler
+
+This measures every command run through the cmdhandler, phase by
+phase: gathering and merging the cmdsets, matching the input,
+at_pre_cmd, parse, func and at_post_cmd. For each phase (and for the
+whole call) it records the wall time, the number of SQL queries and
+their time and the number of messages sent, as histograms per
+command key.
+
+    from src.server.profiler import CMD_PROFILER
+
+    CMD_PROFILER.enable()
+    ...
+    report = CMD_PROFILER.report()     # {cmdkey: {phase: histograms}}
+    CMD_PROFILER.export()              # the same, as a JSON file
+
+Profiling is off unless settings.COMMAND_PROFILING is set, and can be
+switched at run-time with the @profile command. While it is off, the
+cmdhandler only checks one flag per command. While it is on, queries
+on the default database connection are logged as with DEBUG.
+
+Commands waiting on Deferreds may overlap, so the queries and
+messages of one can be counted towards another.
+
+"""
+import os
+import json
+from bisect import bisect_left
+from time import time
+from django.conf import settings
+from django.db import connection, reset_queries
+
+__all__ = ("CMD_PROFILER",)
+
+# the phases of a command call, in order; total is the whole call
+PHASES = ("merge", "match", "pre_cmd", "parse", "func", "post_cmd", "total")
+
+# upper bounds of the histogram buckets; the last bucket holds the rest
+_TIME_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+_COUNT_BOUNDS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# clear the query log when no command is running, or when it grows
+# beyond this (a command whose Deferred never fires never finishes)
+_MAX_QUERY_LOG = 10000
+_EXPORT_FILE = os.path.join(settings.LOG_DIR, "cmdprofile.json")
+
+
+class _Histogram(object):
+    """
+    Counts of values in fixed buckets, plus their number, sum and
+    maximum.
+    """
+    __slots__ = ("bounds", "counts", "num", "total", "max")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.num = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        "Count a value"
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.num += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        "The mean of the values"
+        return float(self.total) / self.num if self.num else 0.0
+
+    def percentile(self, fraction):
+        """
+        An upper bound of the given fraction (0-1) of the values,
+        as exact as the buckets allow.
+        """
+        limit = fraction * self.num
+        running = 0
+        for ibucket, count in enumerate(self.counts):
+            running += count
+            if count and running >= limit:
+                if ibucket < len(self.bounds):
+                    return min(self.bounds[ibucket], self.max)
+                break
+        return self.max
+
+    def to_dict(self):
+        "The histogram as a dict, for exporting"
+        return {"bounds": list(self.bounds), "counts": list(self.counts), "num": self.num,
+                "total": self.total, "mean": self.mean(), "max": self.max,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95)}
+
+
+class _PhaseStats(object):
+    """
+    The histograms of one phase of one command.
+    """
+    __slots__ = ("time", "queries", "sqltime", "msgs")
+
+    def __init__(self):
+        self.time = _Histogram(_TIME_BOUNDS)
+        self.queries = _Histogram(_COUNT_BOUNDS)
+        self.sqltime = _Histogram(_TIME_BOUNDS)
+        self.msgs = _Histogram(_COUNT_BOUNDS)
+
+    def add(self, seconds, nqueries, sqltime, nmsgs):
+        "Record one call of the phase"
+        self.time.add(seconds)
+        self.queries.add(nqueries)
+        self.sqltime.add(sqltime)
+        self.msgs.add(nmsgs)
+
+    def to_dict(self):
+        "The histograms as a dict, for exporting"
+        return dict((name, getattr(self, name).to_dict()) for name in self.__slots__)
+
+
+class _CommandRun(object):
+    """
+    The measurements of one command call, taken phase by phase.
+    """
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.laps = []
+        self.start = self.last = time()
+        self.nqueries = len(connection.queries)
+        self.nmsgs = profiler.nmsgs
+
+    def lap(self, phase):
+        "End a phase of the command call"
+        now = time()
+        queries = connection.queries
+        if len(queries) < self.nqueries:
+            # the log was cleared meanwhile
+            self.nqueries = 0
+        sqltime = sum(float(query["time"]) for query in queries[self.nqueries:])
+        self.laps.append((phase, now - self.last, len(queries) - self.nqueries,
+                          sqltime, self.profiler.nmsgs - self.nmsgs))
+        self.last, self.nqueries, self.nmsgs = now, len(queries), self.profiler.nmsgs
+
+    def finish(self, key):
+        "End the command call, recording it under the command key"
+        laps = self.laps
+        total = (time() - self.start, sum(lap[2] for lap in laps),
+                 sum(lap[3] for lap in laps), sum(lap[4] for lap in laps))
+        self.profiler.record(key, laps, total)
+
+
+class CommandProfiler(object):
+    """
+    Per-command time, query and message statistics.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        # messages sent so far, counted by the sessionhandler
+        self.nmsgs = 0
+        # command calls begun but not finished
+        self.active = 0
+        # {command key: {phase: _PhaseStats}}
+        self.stats = {}
+        self._debug_cursor = None
+
+    def enable(self):
+        "Start profiling"
+        if not self.enabled:
+            self._debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            self.enabled = True
+            self.started = time()
+
+    def disable(self):
+        "Stop profiling, keeping the statistics so far"
+        if self.enabled:
+            connection.use_debug_cursor = self._debug_cursor
+            self.enabled = False
+            if not settings.DEBUG:
+                reset_queries()
+
+    def reset(self):
+        "Forget all statistics"
+        self.stats = {}
+        self.started = time() if self.enabled else None
+
+    def begin(self):
+        """
+        Start measuring a command call. Call lap(phase) on the
+        returned object at the end of each phase and finish(key)
+        when the call is done.
+        """
+        self.active += 1
+        return _CommandRun(self)
+
+    def record(self, key, laps, total):
+        "Add a finished command call to the statistics"
+        self.active -= 1
+        phases = self.stats.get(key)
+        if phases is None:
+            phases = self.stats[key] = {}
+        for phase, seconds, nqueries, sqltime, nmsgs in laps + [("total",) + total]:
+            pstats = phases.get(phase)
+            if pstats is None:
+                pstats = phases[phase] = _PhaseStats()
+            pstats.add(seconds, nqueries, sqltime, nmsgs)
+        if not settings.DEBUG and (self.active <= 0 or len(connection.queries) > _MAX_QUERY_LOG):
+            reset_queries()
+
+    def summary(self):
+        """
+        One row per command, the most costly first:
+         (key, calls, total time, mean time, 95th percentile time,
+          max time, mean queries, mean sql time, mean messages)
+        """
+        rows = []
+        for key, phases in self.stats.items():
+            total = phases["total"]
+            rows.append((key, total.time.num, total.time.total, total.time.mean(),
+                         total.time.percentile(0.95), total.time.max, total.queries.mean(),
+                         total.sqltime.mean(), total.msgs.mean()))
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def phase_summary(self, key):
+        """
+        One row per phase of the command, in order, or None if the
+        command was not profiled:
+         (phase, calls, mean time, 95th percentile time, max time,
+          mean queries, mean sql time, mean messages)
+        """
+        phases = self.stats.get(key)
+        if phases is None:
+            return None
+        return [(phase, pstats.time.num, pstats.time.mean(), pstats.time.percentile(0.95),
+                 pstats.time.max, pstats.queries.mean(), pstats.sqltime.mean(), pstats.msgs.mean())
+                for phase, pstats in ((phase, phases.get(phase)) for phase in PHASES) if pstats]
+
+    def report(self, key=None):
+        """
+        The statistics as {command key: {phase: {histogram name:
+        histogram dict}}}, optionally only for the given command key.
+        """
+        keys = [key] if key is not None else self.stats.keys()
+        return dict((key, dict((phase, pstats.to_dict()) for phase, pstats in self.stats[key].items()))
+                    for key in keys if key in self.stats)
+
+    def export(self, filename=None):
+        """
+        Write the report as JSON to filename (by default to
+        cmdprofile.json in the log directory). Returns the
+        name of the file written.
+        """
+        filename = filename or _EXPORT_FILE
+        data = {"started": self.started, "exported": time(), "enabled": self.enabled,
+                "phases": PHASES, "commands": self.report()}
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        return filename
+
+
+CMD_PROFILER = CommandProfiler()
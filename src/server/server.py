@@ -27,9 +27,13 @@ from src.players.models import PlayerDB
 from src.scripts.models import ScriptDB
 from src.server.models import ServerConfig
 from src.server import initial_setup
+from src.server import warmup
+from src.server.snapshot import RELOAD_SNAPSHOT
+from src.server.profiler import CMD_PROFILER
 
-from src.utils.utils import get_evennia_version, mod_import, make_iter
+from src.utils.utils import get_evennia_version, mod_import, make_iter, uses_database
 from src.comms import channelhandler
+from src.typeclasses.registry import TYPECLASS_REGISTRY
 from src.server.sessionhandler import SESSIONS
 
 # setting up server-side field cache
@@ -39,6 +43,9 @@ from src.server.caches import field_post_save
 #pre_save.connect(field_pre_save, dispatch_uid="fieldcache")
 post_save.connect(field_post_save, dispatch_uid="fieldcache")
 
+# setting up the server statistics counters (connects their signals)
+from src.server import stats
+
 #from src.server.caches import post_attr_update
 #from django.db.models.signals import m2m_changed
 
@@ -83,6 +90,10 @@ IMC2_ENABLED = settings.IMC2_ENABLED
 IRC_ENABLED = settings.IRC_ENABLED
 RSS_ENABLED = settings.RSS_ENABLED
 WEBCLIENT_ENABLED = settings.WEBCLIENT_ENABLED
+PROCPOOL_ENABLED = settings.PROCPOOL_ENABLED
+WARMUP_ENABLED = settings.WARMUP_ENABLED
+WARMUP_RELOAD_SNAPSHOT = settings.WARMUP_RELOAD_SNAPSHOT
+COMMAND_PROFILING = settings.COMMAND_PROFILING
 
 
 #------------------------------------------------------------
@@ -119,6 +130,16 @@ class Evennia(object):
 
         self.start_time = time.time()
 
+        # resolve all typeclasses in use, so objects loaded later
+        # don't have to import them
+        TYPECLASS_REGISTRY.preload()
+
+        # pick up the state kept over a reload, if any
+        if WARMUP_RELOAD_SNAPSHOT and self.set_restart_mode() in ('True', 'reload'):
+            RELOAD_SNAPSHOT.load()
+        else:
+            RELOAD_SNAPSHOT.remove()
+
         # initialize channelhandler
         channelhandler.CHANNELHANDLER.update()
 
@@ -131,6 +152,15 @@ class Evennia(object):
 
         self.run_init_hooks()
 
+        # load the world in batches once the server runs, before
+        # players need it
+        if WARMUP_ENABLED:
+            warmup.warm_up_later(RELOAD_SNAPSHOT)
+
+        # profile commands from the start (see @profile)
+        if COMMAND_PROFILING:
+            CMD_PROFILER.enable()
+
     # Server startup methods
 
     def sqlite3_prep(self):
@@ -242,7 +272,10 @@ class Evennia(object):
             OOB_HANDLER.restore()
 
         from src.scripts.tickerhandler import TICKER_HANDLER
-        TICKER_HANDLER.restore()
+        TICKER_HANDLER.restore(start_delays=RELOAD_SNAPSHOT.tick_delays())
+
+        # games set up before the statistics were added lack their script
+        self.validate_stats_script()
 
         # call correct server hook based on start file value
         if mode in ('True', 'reload'):
@@ -255,6 +288,18 @@ class Evennia(object):
         # always call this regardless of start type
         self.at_server_start()
 
+    def validate_stats_script(self):
+        """
+        Make sure the global script reconciling the server statistics
+        exists; it is otherwise only created by the initial setup.
+        """
+        from src.scripts.scripts import ValidateServerStats
+        from src.utils.create import create_script
+        if not ScriptDB.objects.filter(db_key="sys_stats_validate", db_obj__isnull=True,
+                                       db_player__isnull=True).exists():
+            print " Creating the server statistics script ..."
+            create_script(ValidateServerStats)
+
     def set_restart_mode(self, mode=None):
         """
         This manages the flag file that tells the runner if the server is
@@ -304,6 +349,10 @@ class Evennia(object):
         from src.server.models import ServerConfig
 
         if mode == 'reload':
+            if WARMUP_RELOAD_SNAPSHOT:
+                # remember the hot state for the next process (this
+                # must happen before scripts are paused)
+                RELOAD_SNAPSHOT.save(self.sessions)
             # call restart hooks
             yield [(o.typeclass, o.at_server_reload())
                                    for o in ObjectDB.get_all_cached_instances()]
@@ -346,6 +395,12 @@ class Evennia(object):
         # stopping time
         from src.utils import gametime
         gametime.save()
+        # store the last channel messages
+        from src.comms.channelhistory import CHANNEL_HISTORY
+        CHANNEL_HISTORY.flush()
+        # save Attributes updated in-situ this tick
+        from src.utils.dbserialize import flush_pending
+        flush_pending()
 
         self.at_server_stop()
         # if _reactor_stopping is true, reactor does not need to
@@ -479,6 +534,20 @@ if WEBSERVER_ENABLED:
 
         print "  webserver: %s" % serverport
 
+if PROCPOOL_ENABLED and uses_database("sqlite3"):
+    print "  process pool: disabled (not supported under SQLite3)"
+
+elif PROCPOOL_ENABLED:
+
+    # Warm worker processes for utils.run_async.
+
+    from src.server.procpool import PROCPOOL
+
+    PROCPOOL.setName("EvenniaProcessPool")
+    EVENNIA.services.addService(PROCPOOL)
+
+    print "  process pool: %i workers" % PROCPOOL.nproc
+
 ENABLED = []
 if IRC_ENABLED:
     # IRC channel connections
@@ -15,6 +15,8 @@ There are two similar but separate stores of sessions:
 import time
 from django.conf import settings
 from src.commands.cmdhandler import CMD_LOGINSTART
+from src.comms.channelhandler import CHANNELHANDLER
+from src.server.profiler import CMD_PROFILER
 from src.utils.utils import variable_from_module, is_iter, \
                             to_str, to_unicode, strip_control_sequences
 try:
@@ -238,6 +240,8 @@ class ServerSessionHandler(SessionHandler):
         session.at_disconnect()
         session.disconnect()
         del self.sessions[session.sessid]
+        if player and not self.sessions_from_player(player):
+            CHANNELHANDLER.player_offline(player)
 
     def portal_sessions_sync(self, portalsessions):
         """
@@ -264,6 +268,8 @@ class ServerSessionHandler(SessionHandler):
                 sess.player = _PlayerDB.objects.get_player_from_uid(sess.uid)
             self.sessions[sessid] = sess
             sess.at_sync()
+        # the online channel subscribers are rebuilt from the new sessions
+        CHANNELHANDLER.reset_online()
 
         # after sync is complete we force-validate all scripts
         # (this also starts them)
@@ -313,11 +319,15 @@ class ServerSessionHandler(SessionHandler):
         # we have to check this first before uid has been assigned
         # this session.
 
-        if not self.sessions_from_player(player):
+        first_session = not self.sessions_from_player(player)
+        if first_session:
             player.is_connected = True
 
         # sets up and assigns all properties on the session
         session.at_login(player)
+        if first_session:
+            # the player now receives channel messages
+            CHANNELHANDLER.player_online(player)
 
         # player init
         player.at_init()
@@ -361,9 +371,12 @@ class ServerSessionHandler(SessionHandler):
             remaintext = nsess and "%i session%s remaining" % (nsess, nsess > 1 and "s" or "") or "no more sessions"
             session.log(_('Logged out: %s %s (%s)' % (session.player, session.address, remaintext)))
 
+        player = session.logged_in and session.player
         session.at_disconnect()
         sessid = session.sessid
         del self.sessions[sessid]
+        if player and not self.sessions_from_player(player):
+            CHANNELHANDLER.player_offline(player)
         # inform portal that session should be closed.
         self.server.amp_protocol.call_remote_PortalAdmin(sessid,
                                                          operation=SDISCONN,
@@ -470,6 +483,8 @@ class ServerSessionHandler(SessionHandler):
         """
         Sending data Server -> Portal
         """
+        if CMD_PROFILER.enabled:
+            CMD_PROFILER.nmsgs += 1
         text = text and to_str(to_unicode(text), encoding=session.encoding)
         self.server.amp_protocol.call_remote_MsgServer2Portal(sessid=session.sessid,
                                                               msg=text,
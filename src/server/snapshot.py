@@ -0,0 +1,198 @@
+"""
+Reload snapshot
+
+When the server reloads, the new Server process starts out with
+empty caches and has to find out from the database what was in use.
+Before the old process goes down, it writes a small snapshot of its
+hot state to a file:
+
+ - the ids of the objects, players and scripts in the idmapper
+   (puppets and their locations first),
+ - the time of the next tick of each TickerHandler interval,
+ - the time of the next step of each running script,
+ - the puppet map of the sessions ({sessid: (player id, puppet id)}).
+
+The new process memory-maps the file at start, removes it and replays
+it: the warm-up loads exactly the objects that were in memory, and
+tickers and scripts resume at the same wall-clock phase rather than
+a reload's worth of seconds late.
+
+    from src.server.snapshot import RELOAD_SNAPSHOT
+
+    RELOAD_SNAPSHOT.save(SESSIONS)    # old process, at reload
+    if RELOAD_SNAPSHOT.load():        # new process, at start
+        delays = RELOAD_SNAPSHOT.tick_delays()
+
+The snapshot is only a shortcut - everything it holds is also kept
+(or can be rebuilt) the normal way, so a missing, stale or unreadable
+snapshot file just means a slower start.
+
+"""
+import os
+import mmap
+import time
+import struct
+import marshal
+from array import array
+from django.conf import settings
+from src.utils import logger
+
+__all__ = ("RELOAD_SNAPSHOT",)
+
+_SNAPSHOT_FILE = os.path.join(settings.GAME_DIR, 'server.snapshot')
+_MAGIC = "EVSNAP"
+_VERSION = 1
+# a snapshot older than this (in seconds) is from a failed start
+_MAX_AGE = 600
+_HEADER = struct.Struct("<6sHd")
+_SECTION = struct.Struct("<4sI")
+# unsigned 32-bit ids
+_IDTYPE = "I" if array("I").itemsize == 4 else "L"
+
+
+class ReloadSnapshot(object):
+    """
+    The hot state kept over a reload.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        "Forget the loaded snapshot"
+        self.object_ids = []
+        self.player_ids = []
+        self.script_ids = []
+        # {interval: time of next tick}
+        self.tick_times = {}
+        # {script id: time of next step}
+        self.script_times = {}
+        # {sessid: (player id, puppet id)}
+        self.puppets = {}
+        self.saved_time = None
+
+    def save(self, sessions):
+        """
+        Write the snapshot file. This must be called before scripts are
+        paused and sessions synced to the portal.
+        """
+        from src.objects.models import ObjectDB
+        from src.players.models import PlayerDB
+        from src.scripts.models import ScriptDB
+        from src.scripts.tickerhandler import TICKER_HANDLER
+        now = time.time()
+        puppets = dict((sess.sessid, (sess.uid or 0, sess.puid or 0))
+                       for sess in sessions.sessions.values() if sess.uid)
+        # puppets first, then where they are, then the rest
+        first = [puid for uid, puid in puppets.values() if puid]
+        seen = set(first)
+        first.extend(obj.db_location_id for obj in ObjectDB.get_all_cached_instances()
+                     if obj.id in seen and obj.db_location_id)
+        seen.update(first)
+        object_ids = first + [obj.id for obj in ObjectDB.get_all_cached_instances() if obj.id not in seen]
+        tick_times = {}
+        for interval, ticker in TICKER_HANDLER.ticker_pool.tickers.items():
+            delay = ticker.task.next_call_time()
+            if delay is not None:
+                tick_times[interval] = now + delay
+        script_times = {}
+        for script in ScriptDB.get_all_cached_instances():
+            task = script.ndb._task
+            delay = task.next_call_time() if task else None
+            if delay is not None:
+                script_times[script.id] = now + delay
+
+        sections = (("OBJS", array(_IDTYPE, object_ids).tostring()),
+                    ("PLRS", array(_IDTYPE, [ply.id for ply in PlayerDB.get_all_cached_instances()]).tostring()),
+                    ("SCRS", array(_IDTYPE, [scr.id for scr in ScriptDB.get_all_cached_instances()]).tostring()),
+                    ("TICK", marshal.dumps(tick_times)),
+                    ("SCRT", marshal.dumps(script_times)),
+                    ("SESS", marshal.dumps(puppets)))
+        try:
+            with open(_SNAPSHOT_FILE, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, now))
+                for name, data in sections:
+                    f.write(_SECTION.pack(name, len(data)))
+                    f.write(data)
+        except (IOError, OSError):
+            logger.log_trace("Could not write the reload snapshot.")
+
+    def load(self):
+        """
+        Read and remove the snapshot file, if there is one. Returns
+        True if a usable snapshot was loaded.
+        """
+        self.clear()
+        if not os.path.exists(_SNAPSHOT_FILE):
+            return False
+        try:
+            with open(_SNAPSHOT_FILE, 'rb') as f:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._read(buf)
+                finally:
+                    buf.close()
+        except Exception:
+            logger.log_trace("Could not read the reload snapshot; ignoring it.")
+            self.clear()
+        self.remove()
+        if self.saved_time is None or time.time() - self.saved_time > _MAX_AGE:
+            self.clear()
+            return False
+        return True
+
+    def _read(self, buf):
+        "Parse the sections of a mapped snapshot file"
+        magic, version, saved_time = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            return
+        offset = _HEADER.size
+        while offset + _SECTION.size <= len(buf):
+            name, size = _SECTION.unpack_from(buf, offset)
+            offset += _SECTION.size
+            data = buf[offset:offset + size]
+            offset += size
+            if name in ("OBJS", "PLRS", "SCRS"):
+                ids = array(_IDTYPE)
+                ids.fromstring(data)
+                ids = ids.tolist()
+                if name == "OBJS":
+                    self.object_ids = ids
+                elif name == "PLRS":
+                    self.player_ids = ids
+                else:
+                    self.script_ids = ids
+            elif name == "TICK":
+                self.tick_times = marshal.loads(data)
+            elif name == "SCRT":
+                self.script_times = marshal.loads(data)
+            elif name == "SESS":
+                self.puppets = marshal.loads(data)
+            # unknown sections are skipped
+        self.saved_time = saved_time
+
+    def remove(self):
+        "Remove the snapshot file (it is only valid for one start)"
+        try:
+            os.remove(_SNAPSHOT_FILE)
+        except OSError:
+            pass
+
+    def tick_delays(self):
+        "The start delay of each ticker interval, keeping its phase"
+        now = time.time()
+        return dict((interval, max(0, tick_time - now))
+                    for interval, tick_time in self.tick_times.items())
+
+    def script_delay(self, script_id):
+        """
+        The start delay of a script paused at the reload, keeping its
+        phase, or None if the snapshot does not know it. Only given
+        once per script.
+        """
+        script_time = self.script_times.pop(script_id, None)
+        if script_time is not None:
+            return max(0, script_time - time.time())
+        return None
+
+
+RELOAD_SNAPSHOT = ReloadSnapshot()
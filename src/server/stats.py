@@ -0,0 +1,212 @@
+"""
+Server statistics
+
+This keeps running counts of the objects in the database, split by
+typeclass and by kind (room, exit or other object), plus the total
+number of players. It is used by the web front page and by the
+@objects/@server commands so they don't have to run COUNT queries
+on every view.
+
+    from src.server.stats import SERVER_STATS
+
+    totals = SERVER_STATS.object_totals()   # rooms, exits, characters ...
+    per_typeclass = SERVER_STATS.typeclass_totals()
+
+The counters are built with a few GROUP BY queries when first needed
+and are then updated incrementally from the post_save/pre_delete
+signals of ObjectDB and PlayerDB. Writes that bypass signals (like
+QuerySet.update) can make them drift, so they are reconciled against
+the database regularly by the ValidateServerStats script.
+
+Less central statistics (recently created/connected players) are
+cached for a short while instead.
+
+"""
+import datetime
+from collections import defaultdict
+from time import time
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_init, post_save, pre_delete
+from src.objects.models import ObjectDB
+from src.players.models import PlayerDB
+
+__all__ = ("SERVER_STATS",)
+
+_BASE_CHAR_TYPECLASS = settings.BASE_CHARACTER_TYPECLASS
+# how long (in seconds) to cache the recent-players statistics
+_RECENT_CACHE_TIME = 300
+_RECENT_DAYS = 7
+
+
+def _kind(location_id, destination_id):
+    "Get the kind of an object as used by the counters"
+    if location_id is None:
+        return "room"
+    if destination_id is not None:
+        return "exit"
+    return "other"
+
+
+def _object_key(dbobj):
+    "The counter key an object belongs under"
+    return (dbobj.db_typeclass_path, _kind(dbobj.db_location_id, dbobj.db_destination_id))
+
+
+class ServerStats(object):
+    """
+    Running database statistics.
+    """
+    def __init__(self):
+        self.built = False
+        self.objects = defaultdict(int)
+        self.nplayers = 0
+        self.recent = {}
+        self.last_reconcile = None
+
+    def reconcile(self):
+        """
+        Recount everything from the database. Returns a dict of the
+        counters that had drifted and by how much.
+        """
+        counts = defaultdict(int)
+        for path, num in ObjectDB.objects.filter(db_location__isnull=True).values_list(
+                "db_typeclass_path").annotate(num=Count("id")):
+            counts[(path, "room")] = num
+        for path, num in ObjectDB.objects.filter(db_location__isnull=False,
+                db_destination__isnull=False).values_list("db_typeclass_path").annotate(num=Count("id")):
+            counts[(path, "exit")] = num
+        for path, num in ObjectDB.objects.values_list("db_typeclass_path").annotate(num=Count("id")):
+            num -= counts.get((path, "room"), 0) + counts.get((path, "exit"), 0)
+            if num:
+                counts[(path, "other")] = num
+        nplayers = PlayerDB.objects.count()
+
+        drift = {}
+        if self.built:
+            for key in set(counts.keys() + self.objects.keys()):
+                diff = counts.get(key, 0) - self.objects.get(key, 0)
+                if diff:
+                    drift[key] = diff
+            if nplayers != self.nplayers:
+                drift["players"] = nplayers - self.nplayers
+        self.objects = counts
+        self.nplayers = nplayers
+        self.recent = {}
+        self.built = True
+        self.last_reconcile = time()
+        return drift
+
+    def _check_built(self):
+        if not self.built:
+            self.reconcile()
+
+    # updating
+
+    def _move(self, old_key, new_key):
+        "Move one object from one counter to another"
+        if old_key == new_key:
+            return
+        if old_key:
+            self.objects[old_key] -= 1
+            if self.objects[old_key] <= 0:
+                del self.objects[old_key]
+        if new_key:
+            self.objects[new_key] += 1
+
+    def update_object(self, dbobj):
+        """
+        Count dbobj under its current values. Call this after storing
+        objects in ways that do not send post_save.
+        """
+        new_key = _object_key(dbobj)
+        if self.built:
+            self._move(dbobj.__dict__.get("_stats_key"), new_key)
+        dbobj.__dict__["_stats_key"] = new_key
+
+    def at_object_init(self, sender, instance, **kwargs):
+        "Remember what an object loaded from the database is counted as"
+        if instance.pk is not None:
+            instance.__dict__["_stats_key"] = _object_key(instance)
+
+    def at_object_save(self, sender, instance, created=False, update_fields=None, **kwargs):
+        "Count new objects and objects changing kind or typeclass"
+        if update_fields is None or not update_fields.isdisjoint(
+                ("db_location", "db_destination", "db_typeclass_path")):
+            self.update_object(instance)
+
+    def at_object_delete(self, sender, instance, **kwargs):
+        "Stop counting a deleted object"
+        if self.built:
+            self._move(instance.__dict__.get("_stats_key"), None)
+        instance.__dict__["_stats_key"] = None
+
+    def at_player_save(self, sender, instance, created=False, **kwargs):
+        if created and self.built:
+            self.nplayers += 1
+
+    def at_player_delete(self, sender, instance, **kwargs):
+        if self.built:
+            self.nplayers -= 1
+
+    # access
+
+    def typeclass_totals(self):
+        "Return a dict {typeclass_path: number of objects}"
+        self._check_built()
+        totals = defaultdict(int)
+        for (path, kind), num in self.objects.items():
+            totals[path] += num
+        return dict(totals)
+
+    def object_totals(self):
+        """
+        Return a dict with the number of objects, rooms, exits,
+        characters and others, counted the same way as @objects does.
+        """
+        self._check_built()
+        nobjs = nrooms = nexits = nchars = 0
+        for (path, kind), num in self.objects.items():
+            nobjs += num
+            if path == _BASE_CHAR_TYPECLASS:
+                nchars += num
+            elif kind == "room":
+                nrooms += num
+            if kind == "exit":
+                nexits += num
+        return {"objects": nobjs, "rooms": nrooms, "exits": nexits,
+                "characters": nchars, "others": nobjs - nrooms - nexits - nchars}
+
+    def num_players(self):
+        "Total number of registered players"
+        self._check_built()
+        return self.nplayers
+
+    def _recent(self, name, func):
+        "Cache the result of func for a while"
+        cached = self.recent.get(name)
+        if cached and time() - cached[0] < _RECENT_CACHE_TIME:
+            return cached[1]
+        result = func()
+        self.recent[name] = (time(), result)
+        return result
+
+    def recently_connected_players(self, limit=None):
+        "Players connected within the last week, most recent first"
+        players = self._recent("connected", lambda: list(
+                        PlayerDB.objects.get_recently_connected_players(days=_RECENT_DAYS)))
+        return players[:limit] if limit else players
+
+    def num_recently_created_players(self):
+        "Number of players created within the last week"
+        start = datetime.datetime.now() - datetime.timedelta(_RECENT_DAYS)
+        return self._recent("created", lambda: PlayerDB.objects.filter(date_joined__gte=start).count())
+
+
+SERVER_STATS = ServerStats()
+
+post_init.connect(SERVER_STATS.at_object_init, sender=ObjectDB, dispatch_uid="serverstats")
+post_save.connect(SERVER_STATS.at_object_save, sender=ObjectDB, dispatch_uid="serverstats")
+pre_delete.connect(SERVER_STATS.at_object_delete, sender=ObjectDB, dispatch_uid="serverstats")
+post_save.connect(SERVER_STATS.at_player_save, sender=PlayerDB, dispatch_uid="serverstats")
+pre_delete.connect(SERVER_STATS.at_player_delete, sender=PlayerDB, dispatch_uid="serverstats")
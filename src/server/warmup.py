@@ -0,0 +1,283 @@
+"""
+World warm-up
+
+Without this, objects are loaded into the idmapper one by one as the
+first players walk about after a start or @reload: each object costs
+one query for its row, one per Attribute/Tag handler it uses, one for
+its scripts plus the typeclass and cmdset initialization. With
+settings.WARMUP_ENABLED set, this module instead loads the world right
+after the start, in batches (one batch per reactor iteration, so
+commands are served meanwhile):
+
+ 1. the rooms of characters that have sessions (kept over a reload),
+ 2. the rooms in settings.WARMUP_AREAS,
+ 3. everything inside those rooms (and inside their contents),
+ 4. the remaining objects, ordered by id,
+
+stopping at settings.WARMUP_MAX_OBJECTS. After a @reload, the objects,
+players and scripts that were in memory before (as remembered by the
+reload snapshot, see src.server.snapshot) are loaded first of all, and
+only those and the rooms of steps 1-3 are loaded (step 4 is skipped).
+For each batch of objects,
+the rows, all their Attributes and Tags and the rows of the scripts
+on them are fetched with one query each and handed to the handler
+caches; only then are the typeclasses, cmdsets and locks initialized,
+so their hooks find everything already in memory.
+
+    from src.server.warmup import warm_up, warm_up_later
+
+    nobjs, nscripts = warm_up(RELOAD_SNAPSHOT)
+    warm_up_later(RELOAD_SNAPSHOT)    # the same, without blocking
+
+"""
+import time
+from collections import defaultdict
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from django.conf import settings
+from django.db.models import Q
+from src.utils import logger
+from src.utils.utils import to_str, dbref
+
+__all__ = ("warm_up", "warm_up_later")
+
+_GA = object.__getattribute__
+_SA = object.__setattr__
+
+_AREAS = settings.WARMUP_AREAS
+_MAX_OBJECTS = settings.WARMUP_MAX_OBJECTS
+# must stay below the variable limit of the database (999 for SQLite)
+_BATCH_SIZE = min(settings.WARMUP_BATCH_SIZE, 900)
+
+# handlers filled from the db_attributes and db_tags relations
+_ATTRIBUTE_HANDLERS = ("attributes", "nicks")
+_TAG_HANDLERS = ("tags", "aliases", "permissions")
+# foreign keys between objects, in the order they are resolved
+_OBJECT_FKS = ("db_location", "db_home", "db_destination")
+
+
+def _chunks(ids, size):
+    "Split a list of ids into lists of at most size ids"
+    for ichunk in xrange(0, len(ids), size):
+        yield ids[ichunk:ichunk + size]
+
+
+def _cachekey(entry):
+    "The handler cache key of an Attribute or Tag"
+    return "%s-%s" % (to_str(entry.db_key).lower(),
+                      entry.db_category.lower() if entry.db_category else None)
+
+
+def _handlertype(handler):
+    "The attrtype or tagtype of a handler"
+    return getattr(handler, "_attrtype", getattr(handler, "_tagtype", None))
+
+
+def _fill_handlers(model, dbobjs):
+    """
+    Fill the Attribute and Tag handler caches of the given instances
+    of model with two queries. Handlers that already hold a cache are
+    left alone, as are lazy AttributeHandlers (which load their own
+    index when first used).
+    """
+    if not dbobjs:
+        return
+    modelname = model.__name__.lower()
+    ids = [dbobj.id for dbobj in dbobjs]
+    for fieldname, related, typefield, handlernames in (
+            ("db_attributes", "attribute", "db_attrtype", _ATTRIBUTE_HANDLERS),
+            ("db_tags", "tag", "db_tagtype", _TAG_HANDLERS)):
+        handlernames = [name for name in handlernames if hasattr(model, name)
+                        and not getattr(getattr(dbobjs[0], name), "_lazy", False)]
+        if not handlernames:
+            continue
+        handlertypes = [_handlertype(getattr(dbobjs[0], name)) for name in handlernames]
+        typequery = Q(**{"%s__%s__in" % (related, typefield): [htype for htype in handlertypes if htype]})
+        if None in handlertypes:
+            typequery |= Q(**{"%s__%s__isnull" % (related, typefield): True})
+        # {(object id, attrtype/tagtype): {cachekey: Attribute/Tag}}
+        caches = defaultdict(dict)
+        through = getattr(model, fieldname).through
+        for conn in through.objects.filter(typequery, **{"%s__in" % modelname: ids}).select_related(related):
+            entry = getattr(conn, related)
+            caches[(getattr(conn, "%s_id" % modelname), getattr(entry, typefield))][_cachekey(entry)] = entry
+        for dbobj in dbobjs:
+            for name in handlernames:
+                handler = getattr(dbobj, name)
+                if handler._cache is None:
+                    handler._cache = caches.get((dbobj.id, _handlertype(handler)), {})
+
+
+def _link_objects(dbobjs, loaded):
+    """
+    Point the location, home and destination of the given objects to
+    the already loaded instances, so following them needs no query.
+    """
+    from src.objects.models import ObjectDB
+    cachenames = [(ObjectDB._meta.get_field(fk).attname, ObjectDB._meta.get_field(fk).get_cache_name())
+                  for fk in _OBJECT_FKS]
+    for dbobj in dbobjs:
+        for attname, cachename in cachenames:
+            target = loaded.get(_GA(dbobj, attname))
+            if target is not None:
+                _SA(dbobj, cachename, target)
+
+
+def _init_objects(dbobjs):
+    "Initialize typeclasses, cmdsets and locks, in that order"
+    for dbobj in dbobjs:
+        try:
+            dbobj.typeclass
+            if hasattr(dbobj, "cmdset"):
+                dbobj.cmdset
+            dbobj.locks
+        except Exception:
+            logger.log_trace("Warm-up: could not initialize %s." % dbobj.dbref)
+
+
+def _init_scripts(scripts):
+    "Initialize script typeclasses"
+    for script in scripts:
+        try:
+            script.typeclass
+        except Exception:
+            logger.log_trace("Warm-up: could not initialize script %s." % script.dbref)
+
+
+def _priority_ids():
+    """
+    The ids of the objects to load first, most important first:
+    rooms with characters in them, the rooms of the WARMUP_AREAS and
+    the contents of all of those, two levels deep.
+    """
+    from src.objects.models import ObjectDB
+    objs = ObjectDB.objects.order_by()
+    rooms = list(objs.exclude(db_sessid__isnull=True).exclude(db_sessid="").exclude(
+                 db_location__isnull=True).values_list("db_location", flat=True).distinct())
+    # areas are given as #dbrefs or as Tags (without category)
+    areas = [area for area in _AREAS if dbref(area)]
+    tags = [area for area in _AREAS if not dbref(area)]
+    rooms.extend(dbref(area) for area in areas)
+    if tags:
+        rooms.extend(objs.filter(db_tags__db_key__in=tags, db_tags__db_tagtype__isnull=True).values_list(
+                     "id", flat=True).distinct())
+    ids, seen = [], set()
+    level = rooms
+    for _ in range(3):
+        level = [obj_id for obj_id in level if obj_id not in seen]
+        seen.update(level)
+        ids.extend(level)
+        if not level or len(ids) >= _MAX_OBJECTS:
+            break
+        level = [obj_id for chunk in _chunks(level, _BATCH_SIZE)
+                 for obj_id in objs.filter(db_location__in=chunk).values_list("id", flat=True)]
+    return ids
+
+
+def _warm_up_players(player_ids):
+    "Load players with their handler caches and typeclasses"
+    from src.players.models import PlayerDB
+    nplayers = 0
+    for chunk in _chunks(player_ids, _BATCH_SIZE):
+        players = list(PlayerDB.objects.filter(id__in=chunk))
+        _fill_handlers(PlayerDB, players)
+        _init_objects(players)
+        nplayers += len(players)
+    return nplayers
+
+
+def _warm_up_steps(snapshot, result):
+    """
+    Generator doing the warm-up one batch per step. The number of
+    objects and scripts loaded is put in result when done.
+    """
+    from src.objects.models import ObjectDB
+    from src.scripts.models import ScriptDB
+    t0 = time.time()
+    ids = []
+    nplayers = 0
+    from_snapshot = bool(snapshot and snapshot.saved_time)
+    if from_snapshot:
+        uids = list(set(uid for uid, puid in snapshot.puppets.values()))
+        seen = set(uids)
+        nplayers = _warm_up_players(uids + [uid for uid in snapshot.player_ids if uid not in seen])
+        ids = snapshot.object_ids[:_MAX_OBJECTS]
+        yield
+    seen = set(ids)
+    ids.extend(obj_id for obj_id in _priority_ids() if obj_id not in seen)
+    npriority = len(ids)
+    if len(ids) < _MAX_OBJECTS and not from_snapshot:
+        # without a snapshot we can't tell what will be used; fill up
+        seen = set(ids)
+        ids.extend(obj_id for obj_id in ObjectDB.objects.order_by("id").values_list(
+                   "id", flat=True)[:_MAX_OBJECTS] if obj_id not in seen)
+    ids = ids[:_MAX_OBJECTS]
+
+    loaded = {}
+    nscripts = 0
+    for chunk in _chunks(ids, _BATCH_SIZE):
+        # already cached objects are returned as they are by the idmapper
+        dbobjs = list(ObjectDB.objects.filter(id__in=chunk))
+        loaded.update((dbobj.id, dbobj) for dbobj in dbobjs)
+        _fill_handlers(ObjectDB, dbobjs)
+        _link_objects(dbobjs, loaded)
+        scripts = list(ScriptDB.objects.filter(db_obj__in=chunk))
+        _fill_handlers(ScriptDB, scripts)
+        nscripts += len(scripts)
+        _init_objects(dbobjs)
+        _init_scripts(scripts)
+        yield
+    # objects loaded in an earlier batch than their location
+    _link_objects(loaded.values(), loaded)
+    if snapshot and snapshot.script_ids:
+        # global scripts and scripts on players
+        for chunk in _chunks(snapshot.script_ids, _BATCH_SIZE):
+            scripts = [script for script in ScriptDB.objects.filter(id__in=chunk)
+                       if script.db_obj_id not in loaded]
+            _fill_handlers(ScriptDB, scripts)
+            nscripts += len(scripts)
+            _init_scripts(scripts)
+            yield
+    logger.log_infomsg("Warm-up: loaded %i objects (%i prioritized), %i scripts and %i players in %.2fs." % (
+                       len(loaded), min(npriority, len(ids)), nscripts, nplayers, time.time() - t0))
+    result.extend((len(loaded), nscripts))
+
+
+def warm_up(snapshot=None):
+    """
+    Load the world into the idmapper and handler caches, logging a
+    summary when done. Returns the number of objects and scripts
+    loaded.
+
+    snapshot - a loaded ReloadSnapshot; what it lists is loaded first.
+    """
+    result = []
+    for _ in _warm_up_steps(snapshot, result):
+        pass
+    return tuple(result)
+
+
+def warm_up_later(snapshot=None):
+    """
+    As warm_up, but done one batch per reactor iteration, starting
+    once the reactor runs, so the server answers commands meanwhile.
+    Returns a Deferred firing with the number of objects and scripts
+    loaded.
+    """
+    result = []
+    steps = _warm_up_steps(snapshot, result)
+    deferred = Deferred()
+
+    def _step():
+        try:
+            steps.next()
+        except StopIteration:
+            deferred.callback(tuple(result))
+        except Exception:
+            logger.log_trace("Warm-up failed.")
+            deferred.callback((0, 0))
+        else:
+            reactor.callLater(0, _step)
+
+    reactor.callWhenRunning(_step)
+    return deferred
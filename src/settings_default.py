@@ -167,6 +167,43 @@ AMP_INTERFACE = '127.0.0.1'
 # be necessary (use @server to see how many objects are in the idmapper
 # cache at any time). Setting this to None disables the cache cap.
 IDMAPPER_CACHE_MAXSIZE = 200      # (MB)
+# The process pool keeps warm worker processes (forked from the
+# server, so with everything already loaded) that utils.run_async
+# uses to run cpu-heavy code outside of the game process. Without
+# it, run_async falls back to threads. The workers are forked from
+# the server process, so only enable this on a server with cores to
+# spare. It is never started under SQLite3, which locks the whole
+# database file on writes.
+PROCPOOL_ENABLED = False
+# Number of worker processes. None means one less than the number
+# of cpu cores (but at least one).
+PROCPOOL_NPROC = None
+# Jobs submitted at the same time are sent to the workers in batches
+# of at most this many jobs.
+PROCPOOL_BATCH_SIZE = 20
+# If set, the server loads the world into memory in large batches at
+# every start and reload, so the first players to walk about don't
+# load it one object at a time. This runs one batch at a time once the
+# server is up, so commands are served meanwhile, but it does use the
+# memory for objects that may never be needed. Objects are loaded from
+# the rooms with characters in them outwards.
+WARMUP_ENABLED = False
+# Rooms to warm up right after those with characters in them (and
+# before the rest of the world), given as #dbrefs or as tags.
+WARMUP_AREAS = []
+# Stop warming up after this many objects (also bounds the memory used).
+WARMUP_MAX_OBJECTS = 20000
+# Number of objects fetched per query.
+WARMUP_BATCH_SIZE = 500
+# On @reload, write a snapshot of what is in memory (and of the phases
+# of tickers and script timers) for the new server process to replay.
+WARMUP_RELOAD_SNAPSHOT = True
+# Record the time, database queries and messages of each phase of
+# every command (viewed and exported with @profile, which can also
+# switch this on and off while the server runs). This logs all
+# database queries while on, so leave it off unless looking for
+# slow commands.
+COMMAND_PROFILING = False
 
 ######################################################################
 # Evennia Database config
@@ -243,6 +280,10 @@ LOCK_FUNC_MODULES = ("src.locks.lockfuncs",)
 # and expansion of which hooks OOB protocols are allowed to call on the server
 # protocols for attaching tracker hooks for when various object field change
 OOB_PLUGIN_MODULES = ["src.server.oob_cmds"]
+# Changes to tracked fields and Attributes are reported to OOB clients
+# together every this many seconds, sending only the values that
+# changed. Set to 0 to send them at the end of each reactor iteration.
+OOB_REPORT_INTERVAL = 0.2
 
 ######################################################################
 # Default command sets
@@ -318,6 +359,18 @@ START_LOCATION = "#2"
 # out of sync between the processes. Keep on unless you face such
 # issues.
 TYPECLASS_AGGRESSIVE_CACHE = True
+# Objects with many (or big) Attributes can be set to load them lazily.
+# Their AttributeHandler then first only loads the keys of the
+# Attributes, fetching each Attribute (with its value) when it is first
+# used and keeping at most ATTRIBUTE_LAZY_CACHE_SIZE of them cached per
+# object. Objects with fewer Attributes than that load them all at once.
+ATTRIBUTE_LAZY_LOADING = False
+ATTRIBUTE_LAZY_CACHE_SIZE = 20
+# Dicts stored in Attributes are normally pickled and saved as a whole
+# whenever any part of them changes. Dicts with at least this many keys
+# can instead be stored with one database row per key, so changing a
+# key only writes that row. None stores all dicts as a whole.
+ATTRIBUTE_KEYED_DICT_SIZE = None
 
 ######################################################################
 # Batch processors
@@ -411,6 +464,15 @@ GUEST_LIST = ["Guest" + str(s+1) for s in range(9)]
 # In-game Channels created from server start
 ######################################################################
 
+# Channels with the keep_log Attribute set (the default) keep their
+# most recent messages in memory; this many per channel. Older
+# messages are read from the channel log table.
+CHANNEL_LOG_BUFFER_SIZE = 200
+# Days to keep channel log messages for (None keeps them forever).
+# Individual channels can override this with a log_retention_days
+# Attribute.
+CHANNEL_LOG_RETENTION_DAYS = None
+
 # Each default channel is defined by a tuple containing
 # (name, aliases, description, locks)
 # where aliases may be a tuple too, and locks is
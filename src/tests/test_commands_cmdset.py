@@ -1,4 +1,6 @@
 import unittest
+from src.commands.cmdset import CmdSet
+from src.commands.command import Command
 
 class test__CmdSetMeta(unittest.TestCase):
     def test___init__(self):
@@ -70,5 +72,97 @@ class TestCmdSet(unittest.TestCase):
         # self.assertEqual(expected, cmd_set.remove(cmd))
         assert True # TODO: implement your test here
 
+def _cmd(key, aliases=None):
+    "A command instance with the given key and aliases"
+    return Command(key=key, aliases=aliases or [])
+
+def _cmdset(key, cmds, **kwargs):
+    "A cmdset holding cmds, with kwargs (mergetype, priority etc) set on it"
+    cmdset = CmdSet(key=key)
+    for name, value in kwargs.items():
+        setattr(cmdset, name, value)
+    cmdset.add(cmds)
+    return cmdset
+
+def _keys(cmdset):
+    return sorted(cmd.key for cmd in cmdset.commands)
+
+class TestCmdSetMerge(unittest.TestCase):
+    """
+    Merges as described in the CmdSet docstring: A1,A3 + B1,B2,B4,B5
+    with A of higher priority.
+    """
+    def setUp(self):
+        self.a1, self.a3 = _cmd("1"), _cmd("3")
+        self.b1, self.b2, self.b4, self.b5 = _cmd("1"), _cmd("2"), _cmd("4"), _cmd("5")
+
+    def _merge(self, mergetype, **kwargs):
+        kwargs.setdefault("priority", 1)
+        cmdset_a = _cmdset("A", [self.a1, self.a3], mergetype=mergetype, **kwargs)
+        cmdset_b = _cmdset("B", [self.b1, self.b2, self.b4, self.b5])
+        return cmdset_a + cmdset_b
+
+    def test_union(self):
+        cmdset_c = self._merge("Union")
+        self.assertEqual(["1", "2", "3", "4", "5"], _keys(cmdset_c))
+        self.assertTrue(cmdset_c.get("1") is self.a1)
+
+    def test_intersect(self):
+        cmdset_c = self._merge("Intersect")
+        self.assertEqual(["1"], _keys(cmdset_c))
+        self.assertTrue(cmdset_c.get("1") is self.a1)
+
+    def test_replace(self):
+        self.assertEqual(["1", "3"], _keys(self._merge("Replace")))
+
+    def test_remove(self):
+        self.assertEqual(["2", "4", "5"], _keys(self._merge("Remove")))
+
+    def test_lower_priority_onto_higher(self):
+        # the mergetype of the higher-priority set (B) is used
+        cmdset_a = _cmdset("A", [self.a1, self.a3], priority=0)
+        cmdset_b = _cmdset("B", [self.b1, self.b2], mergetype="Replace", priority=1)
+        cmdset_c = cmdset_a + cmdset_b
+        self.assertEqual(["1", "2"], _keys(cmdset_c))
+        self.assertTrue(cmdset_c.get("1") is self.b1)
+
+    def test_key_mergetypes(self):
+        cmdset_c = self._merge("Union", key_mergetypes={"B": "Replace"})
+        self.assertEqual(["1", "3"], _keys(cmdset_c))
+        self.assertEqual("Replace", cmdset_c.actual_mergetype)
+
+    def test_aliases(self):
+        # B's command is called with A's key, so A's replaces it
+        cmdset_a = _cmdset("A", [_cmd("get")], priority=1)
+        cmdset_b = _cmdset("B", [_cmd("take", aliases=["get"]), _cmd("drop")])
+        self.assertEqual(["drop", "get"], _keys(cmdset_a + cmdset_b))
+
+    def test_union_duplicates(self):
+        cmdset_c = self._merge("Union", priority=0, duplicates=True)
+        self.assertEqual(["1", "1", "2", "3", "4", "5"], _keys(cmdset_c))
+        # no duplicates unless the priorities are the same
+        self.assertEqual(["1", "2", "3", "4", "5"], _keys(self._merge("Union", duplicates=True)))
+
+    def test_union_duplicates_identical_command(self):
+        # a command instance in both sets is kept from each of them
+        shared = _cmd("shared")
+        cmdset_a = _cmdset("A", [shared, self.a1], duplicates=True)
+        cmdset_b = _cmdset("B", [shared, self.b2])
+        cmdset_c = cmdset_a + cmdset_b
+        self.assertEqual(["1", "2", "shared", "shared"], _keys(cmdset_c))
+        self.assertEqual(2, len([cmd for cmd in cmdset_c.commands if cmd is shared]))
+        # adding it again keeps it once
+        cmdset_c.add(shared)
+        self.assertEqual(["1", "2", "shared"], _keys(cmdset_c))
+
+    def test_no_exits_no_objs(self):
+        # these are taken from the higher-priority set
+        cmdset_c = self._merge("Union", no_exits=True, no_objs=True)
+        self.assertTrue(cmdset_c.no_exits and cmdset_c.no_objs)
+        cmdset_a = _cmdset("A", [self.a1], no_exits=True, no_objs=True)
+        cmdset_b = _cmdset("B", [self.b2], priority=1)
+        cmdset_c = cmdset_a + cmdset_b
+        self.assertFalse(cmdset_c.no_exits or cmdset_c.no_objs)
+
 if __name__ == '__main__':
     unittest.main()
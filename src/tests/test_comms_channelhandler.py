@@ -1,4 +1,9 @@
 import unittest
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+from src.utils import create
 
 class TestChannelCommand(unittest.TestCase):
     def test_func(self):
@@ -41,5 +46,38 @@ class TestChannelHandler(unittest.TestCase):
         # self.assertEqual(expected, channel_handler.update())
         assert True # TODO: implement your test here
 
+class TestChannelCmdSetCache(TestCase):
+    "The merged cmdset of a player follows channel changes"
+    def setUp(self):
+        self.player = create.create_player("chancacher", "chancacher@test.com", "testpassword")
+        self.channel = create.create_channel("cachechan", locks="send:all();listen:all()")
+        self.channels = [self.channel]
+
+    def tearDown(self):
+        for channel in self.channels:
+            channel.delete()
+        self.player.delete()
+
+    def _merged_keys(self):
+        "Merge the player's cmdsets like the cmdhandler does"
+        from src.commands.cmdhandler import get_and_merge_cmdsets
+        result = []
+        get_and_merge_cmdsets(self.player, None, self.player, None, "player").addCallback(result.append)
+        return [cmd.key for cmd in result[0]]
+
+    def test_create_and_delete_channel(self):
+        self.assertTrue("cachechan" in self._merged_keys())
+        # the player's channel cmdset and the merge are now cached
+        newchannel = create.create_channel("newcachechan", locks="send:all();listen:all()")
+        self.channels.append(newchannel)
+        keys = self._merged_keys()
+        self.assertTrue("cachechan" in keys)
+        self.assertTrue("newcachechan" in keys)
+        self.channels.remove(self.channel)
+        self.channel.delete()
+        keys = self._merged_keys()
+        self.assertFalse("cachechan" in keys)
+        self.assertTrue("newcachechan" in keys)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,10 @@
 import unittest
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+from django.conf import settings
+from src.utils import create
 
 class TestAttribute(unittest.TestCase):
     def test___init__(self):
@@ -262,5 +268,126 @@ class TestTypedObject(unittest.TestCase):
         # self.assertEqual(expected, typed_object.swap_typeclass(new_typeclass, clean_attributes, no_default))
         assert True # TODO: implement your test here
 
+class TestLazyAttributeHandler(TestCase):
+    "AttributeHandler holding only an index of the Attributes"
+    def setUp(self):
+        from src.typeclasses import models
+        self.models = models
+        self.cache_size = models._ATTRIBUTE_LAZY_CACHE_SIZE
+        models._ATTRIBUTE_LAZY_CACHE_SIZE = 2
+        self.obj = create.create_object(settings.BASE_OBJECT_TYPECLASS, key="lazyobj")
+        handler = self.obj.attributes
+        handler._lazy = True
+        for inum in range(5):
+            handler.add("k%i" % inum, inum)
+        # reload, getting the index only
+        handler._cache = None
+        handler._recache()
+
+    def tearDown(self):
+        self.models._ATTRIBUTE_LAZY_CACHE_SIZE = self.cache_size
+
+    def test_has(self):
+        handler = self.obj.attributes
+        self.assertTrue(handler.has("k0"))
+        self.assertFalse(handler.has("nothere"))
+        self.assertEqual([True, False], handler.has(["k1", "nothere"]))
+        # nothing was fetched
+        self.assertFalse(isinstance(handler._cache["k0-None"], self.models.Attribute))
+
+    def test_remove(self):
+        handler = self.obj.attributes
+        self.assertEqual(3, handler.get("k3"))
+        handler.remove("k3")
+        self.assertFalse(handler.has("k3"))
+        self.assertEqual(None, handler.get("k3"))
+        self.assertEqual(["k0", "k1", "k2", "k4"], sorted(attr.key for attr in handler.all() if attr.key in ("k0", "k1", "k2", "k3", "k4")))
+
+    def test_clear(self):
+        handler = self.obj.attributes
+        self.assertEqual(2, handler.get("k2"))
+        handler.remove("k2")
+        handler.clear()
+        self.assertEqual([], handler.all())
+        self.assertFalse(self.models.Attribute.objects.filter(db_key__in=["k%i" % inum for inum in range(5)],
+                                                              objectdb=self.obj.dbobj).exists())
+
+class TestAttributeSaveQueue(TestCase):
+    "Attributes updated in-situ are saved at the end of the reactor iteration"
+    def setUp(self):
+        from twisted.internet.task import Clock
+        from src.typeclasses import models
+        from src.utils import dbserialize
+        self.models, self.dbserialize = models, dbserialize
+        self.reactor, self.isInIOThread = dbserialize.reactor, dbserialize.isInIOThread
+        self.keyed_size = models._ATTRIBUTE_KEYED_DICT_SIZE
+        # a reactor that is running, but only iterates when told to
+        self.clock = Clock()
+        self.clock.running = True
+        dbserialize.reactor = self.clock
+        dbserialize.isInIOThread = lambda: True
+        models._ATTRIBUTE_KEYED_DICT_SIZE = 3
+        self.obj = create.create_object(settings.BASE_OBJECT_TYPECLASS, key="queueobj")
+        self.obj.db.qlist = [1, 2]
+        # a new Attribute is stored as a whole, an existing one by key
+        self.obj.db.qdict = {}
+        self.obj.db.qdict = {"a": 1, "b": 2, "c": 3}
+
+    def tearDown(self):
+        self.dbserialize.flush_pending()
+        self.dbserialize.reactor = self.reactor
+        self.dbserialize.isInIOThread = self.isInIOThread
+        self.models._ATTRIBUTE_KEYED_DICT_SIZE = self.keyed_size
+
+    def _attr(self, key):
+        return self.obj.attributes.get(key, return_obj=True)
+
+    def test_write_behind(self):
+        qlist = self.obj.db.qlist
+        qlist.append(3)
+        qlist.append(4)
+        # nothing written yet, one flush waiting for the next iteration
+        self.assertEqual([1, 2], self._attr("qlist").db_value)
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0)
+        self.assertEqual([1, 2, 3, 4], self._attr("qlist").db_value)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_read_pending(self):
+        qlist = self.obj.db.qlist
+        qlist.append(3)
+        self.assertTrue(self.obj.db.qlist is qlist)
+        self.assertEqual([1, 2, 3], list(self.obj.db.qlist))
+        # assigning a new value drops the pending update
+        self.obj.db.qlist = [5]
+        self.clock.advance(0)
+        self.assertEqual([5], self._attr("qlist").db_value)
+        self.assertEqual([5], list(self.obj.db.qlist))
+
+    def test_flush_pending(self):
+        # as done by the server when shutting down
+        self.obj.db.qlist.append(3)
+        self.dbserialize.flush_pending()
+        self.assertEqual([1, 2, 3], self._attr("qlist").db_value)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_keyed_storage(self):
+        attr = self._attr("qdict")
+        self.assertEqual(self.models._KEYED_DICT, attr.db_value)
+        self.assertEqual(3, self.models.AttributeItem.objects.filter(db_attribute=attr).count())
+        qdict = self.obj.db.qdict
+        qdict["b"] = 20
+        qdict["d"] = 4
+        del qdict["c"]
+        self.clock.advance(0)
+        self.assertEqual(3, self.models.AttributeItem.objects.filter(db_attribute=attr).count())
+        # read back from the rows
+        attr._items = None
+        self.assertEqual({"a": 1, "b": 20, "d": 4}, dict(self.obj.db.qdict))
+        # a dict below the size is stored on the Attribute again
+        self.obj.db.qdict = {"a": 1}
+        self.assertEqual(0, self.models.AttributeItem.objects.filter(db_attribute=attr).count())
+        self.assertEqual({"a": 1}, dict(self.obj.db.qdict))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,10 @@
 import unittest
+try:
+    from django.utils.unittest import TestCase
+except ImportError:
+    from django.test import TestCase
+from django.conf import settings
+from src.utils import create, dbserialize
 
 class test__SaverMutable(unittest.TestCase):
     def test___delitem__(self):
@@ -120,5 +126,65 @@ class TestDbunserialize(unittest.TestCase):
         # self.assertEqual(expected, dbunserialize(data, db_obj))
         assert True # TODO: implement your test here
 
+class TestPackedDbobj(TestCase):
+    "Database objects in serialized data, on both packed forms"
+    def setUp(self):
+        self.obj = create.create_object(settings.BASE_OBJECT_TYPECLASS, key="packobj")
+        self.dbobj = self.obj.dbobj
+
+    def _roundtrip(self, data):
+        "Serialize data to a string and back"
+        return dbserialize.from_pickle(dbserialize.do_unpickle(
+                    dbserialize.do_pickle(dbserialize.to_pickle(data))))
+
+    def test_pack_v2(self):
+        packed = dbserialize.pack_dbobj(self.obj)
+        self.assertEqual("__dbobj__", packed[0])
+        self.assertEqual(self.dbobj.id, packed[3])
+        self.assertTrue(isinstance(packed[2], (int, long)))
+        self.assertEqual(self.dbobj, dbserialize.unpack_dbobj(packed).dbobj)
+
+    def test_roundtrip(self):
+        data = self._roundtrip([self.obj, (1, self.obj), {"obj": self.obj}, set([2])])
+        self.assertEqual(self.dbobj, data[0].dbobj)
+        self.assertEqual(self.dbobj, data[1][1].dbobj)
+        self.assertEqual(self.dbobj, data[2]["obj"].dbobj)
+        self.assertEqual(set([2]), data[3])
+
+    def test_unpack_v1(self):
+        # as written before the packed form had a version
+        packed = ("__packed_dbobj__", dbserialize.pack_dbobj(self.obj)[1],
+                  self.dbobj.db_date_created.strftime(dbserialize._DATESTRING), self.dbobj.id)
+        self.assertEqual(packed, dbserialize.pack_dbobj(self.obj, version=1))
+        self.assertEqual(self.dbobj, dbserialize.unpack_dbobj(packed).dbobj)
+        data = dbserialize.from_pickle(dbserialize.do_unpickle(dbserialize.do_pickle({"objs": [packed]})))
+        self.assertEqual(self.dbobj, data["objs"][0].dbobj)
+
+    def test_reused_id(self):
+        # a different creation time means the id was re-used
+        packed = dbserialize.pack_dbobj(self.obj)
+        self.assertEqual(None, dbserialize.unpack_dbobj(packed[:2] + (packed[2] - 1000000, packed[3])))
+
+    def test_lazy_items(self):
+        packed = dbserialize.to_pickle({"objs": [1, self.obj], "num": 1})
+        saver = dbserialize.from_pickle(packed, db_obj=self.dbobj)
+        self.assertTrue(type(saver._data["objs"]) is dbserialize._LazyItem)
+        self.assertEqual(1, saver["num"])
+        # unaccessed parts are written back as they are
+        self.assertEqual(packed, dbserialize.to_pickle(saver))
+        objs = saver["objs"]
+        self.assertTrue(isinstance(objs, dbserialize._SaverList))
+        self.assertTrue(type(objs._data[1]) is dbserialize._LazyItem)
+        self.assertEqual(self.dbobj, objs[1].dbobj)
+        self.assertEqual(packed, dbserialize.to_pickle(saver))
+
+    def test_attribute(self):
+        self.obj.db.packtest = {"nested": [self.obj, {"deeper": self.obj}]}
+        self.obj.attributes._cache = None
+        self.obj.attributes._recache()
+        value = self.obj.db.packtest
+        self.assertEqual(self.dbobj, value["nested"][0].dbobj)
+        self.assertEqual(self.dbobj, value["nested"][1]["deeper"].dbobj)
+
 if __name__ == '__main__':
     unittest.main()
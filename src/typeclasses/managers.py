@@ -59,8 +59,17 @@ def _attr_pickled(method):
     def wrapper(self, *args, **kwargs):
         "wrap all queries searching the db_value field in some way"
         self.__doc__ = method.__doc__
-        for key in (key for key in kwargs if key.startswith('db_value')):
-            kwargs[key] = to_pickle(kwargs[key])
+        for key in [key for key in kwargs if key.startswith('db_value')]:
+            value = to_pickle(kwargs[key])
+            if key in ("db_value", "db_value__exact"):
+                # values stored before the current packed form of
+                # database objects must match too
+                oldvalue = to_pickle(kwargs[key], version=1)
+                if oldvalue != value:
+                    del kwargs[key]
+                    kwargs["db_value__in"] = [value, oldvalue]
+                    continue
+            kwargs[key] = value
         return method(self, *args, **kwargs)
     return update_wrapper(wrapper, method)
 
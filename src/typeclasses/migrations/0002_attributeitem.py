@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import src.utils.picklefield
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('typeclasses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttributeItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('db_key', models.CharField(max_length=255, verbose_name=b'key')),
+                ('db_value', src.utils.picklefield.PickledObjectField(null=True, verbose_name=b'value')),
+                ('db_attribute', models.ForeignKey(related_name='db_items', verbose_name=b'attribute', to='typeclasses.Attribute')),
+            ],
+            options={
+                'verbose_name': 'Attribute item',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='attributeitem',
+            unique_together=set([('db_attribute', 'db_key')]),
+        ),
+    ]
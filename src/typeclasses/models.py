@@ -26,12 +26,12 @@ these to create custom managers.
 
 """
 
-import sys
 import re
-import traceback
 import weakref
+from collections import OrderedDict
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
 from django.utils.encoding import smart_str
@@ -43,12 +43,14 @@ from src.server.caches import get_prop_cache, set_prop_cache
 #from src.server.caches import call_ndb_hooks
 from src.server.models import ServerConfig
 from src.typeclasses import managers
+from src.typeclasses.registry import TYPECLASS_REGISTRY
 from src.locks.lockhandler import LockHandler
 from src.utils import logger
 from src.utils.utils import (
     make_iter, is_iter, to_str, inherits_from, lazy_property)
-from src.utils.dbserialize import to_pickle, from_pickle
-from src.utils.picklefield import PickledObjectField
+from src.utils.dbserialize import (to_pickle, from_pickle, get_pending,
+                                   discard_pending, _SaverDict)
+from src.utils.picklefield import PickledObjectField, dbsafe_encode, dbsafe_decode
 
 __all__ = ("Attribute", "TypeNick", "TypedObject")
 
@@ -56,6 +58,16 @@ TICKER_HANDLER = None
 
 _PERMISSION_HIERARCHY = [p.lower() for p in settings.PERMISSION_HIERARCHY]
 _TYPECLASS_AGGRESSIVE_CACHE = settings.TYPECLASS_AGGRESSIVE_CACHE
+_ATTRIBUTE_LAZY_LOADING = settings.ATTRIBUTE_LAZY_LOADING
+_ATTRIBUTE_LAZY_CACHE_SIZE = settings.ATTRIBUTE_LAZY_CACHE_SIZE
+# Attributes dropped from the cache of a lazy AttributeHandler. They
+# are kept here for as long as something else still uses them (like
+# a _SaverDict from their value), so a new fetch gets the same instance.
+_EVICTED_ATTRIBUTES = weakref.WeakValueDictionary()
+_ATTRIBUTE_KEYED_DICT_SIZE = settings.ATTRIBUTE_KEYED_DICT_SIZE
+# db_value of Attributes storing a dict as AttributeItem rows
+_KEYED_DICT = ('__keyed_dict__',)
+_IS_KEYED_DICT = lambda o: type(o) == tuple and len(o) == 1 and o[0] == '__keyed_dict__'
 
 _GA = object.__getattribute__
 _SA = object.__setattr__
@@ -172,6 +184,14 @@ class Attribute(SharedMemoryModel):
         as storing a dbobj which is then deleted elsewhere) out-of-sync.
         The overhead of unpickling seems hard to avoid.
         """
+        pending = get_pending(self)
+        if pending is not None:
+            # updated in-situ but not yet saved
+            return pending
+        if _IS_KEYED_DICT(self.db_value):
+            value = from_pickle(dict(self._get_items().values()), db_obj=self)
+            value._keyed = True
+            return value
         return from_pickle(self.db_value, db_obj=self)
 
     #@value.setter
@@ -180,6 +200,13 @@ class Attribute(SharedMemoryModel):
         Setter. Allows for self.value = value. We cannot cache here,
         see self.__value_get.
         """
+        discard_pending(self)
+        if (_ATTRIBUTE_KEYED_DICT_SIZE and type(new_value) in (dict, _SaverDict)
+                and len(new_value) >= _ATTRIBUTE_KEYED_DICT_SIZE and self._set_items(new_value)):
+            return
+        if _IS_KEYED_DICT(self.db_value):
+            self.db_items.all().delete()
+            self._items = None
         self.db_value = to_pickle(new_value)
         self.save(update_fields=["db_value"])
 
@@ -189,6 +216,66 @@ class Attribute(SharedMemoryModel):
         self.delete()
     value = property(__value_get, __value_set, __value_del)
 
+    # Keyed storage. Dicts with at least settings.ATTRIBUTE_KEYED_DICT_SIZE
+    # keys are stored as one AttributeItem row per key (db_value then
+    # holds a marker), so updating a key only writes its own row.
+
+    _items = None
+
+    def _get_items(self):
+        "The rows of a keyed dict as {encoded key: (key, value)}, cached"
+        if self._items is None:
+            self._items = dict((item.db_key, (dbsafe_decode(item.db_key), item.db_value))
+                               for item in self.db_items.all())
+        return self._items
+
+    def _set_items(self, new_value):
+        """
+        Store all of a dict as keyed rows. Returns False if this
+        cannot be done.
+        """
+        if self.id is None or _GA(self, "_deferred_fields") is not None:
+            return False
+        items = dict((dbsafe_encode(key), (key, val)) for key, val in to_pickle(new_value).items())
+        if any(len(ekey) > 255 for ekey in items):
+            return False
+        with transaction.atomic():
+            self.db_items.all().delete()
+            AttributeItem.objects.bulk_create([AttributeItem(db_attribute=self, db_key=ekey, db_value=val)
+                                               for ekey, (key, val) in items.items()])
+            self.db_value = _KEYED_DICT
+            self.save(update_fields=["db_value"])
+        self._items = items
+        return True
+
+    def save_items(self, value, keys):
+        """
+        Save the given keys of value, the updated dict of a keyed
+        Attribute, only writing the rows of those keys.
+        """
+        items = self._get_items()
+        with transaction.atomic():
+            for key in keys:
+                pkey = to_pickle(key)
+                ekey = dbsafe_encode(pkey)
+                if key in value._data:
+                    val = to_pickle(value._data[key])
+                    if ekey in items:
+                        AttributeItem.objects.filter(db_attribute=self, db_key=ekey).update(db_value=val)
+                    elif len(ekey) <= 255:
+                        AttributeItem.objects.create(db_attribute=self, db_key=ekey, db_value=val)
+                    else:
+                        # too long a key for a row; store the whole dict
+                        self.value = value
+                        return
+                    items[ekey] = (pkey, val)
+                elif ekey in items:
+                    AttributeItem.objects.filter(db_attribute=self, db_key=ekey).delete()
+                    del items[ekey]
+        # let OOB trackers and the like know, as a save would have
+        post_save.send(sender=self.__class__, instance=self, created=False,
+                       update_fields=frozenset(["db_value"]), raw=False, using=self._state.db)
+
     #
     #
     # Attribute methods
@@ -214,19 +301,65 @@ class Attribute(SharedMemoryModel):
         return result
 
 
+class AttributeItem(models.Model):
+    """
+    One key of a dict stored in an Attribute, for Attributes whose
+    dict is stored with one row per key (see Attribute.value).
+    """
+    db_attribute = models.ForeignKey(Attribute, related_name="db_items", verbose_name="attribute")
+    # the pickled and encoded key
+    db_key = models.CharField('key', max_length=255)
+    db_value = PickledObjectField('value', null=True)
+
+    class Meta:
+        "Define Django meta options"
+        verbose_name = "Attribute item"
+        unique_together = (('db_attribute', 'db_key'),)
+
+
 #
 # Handlers making use of the Attribute model
 #
 
+def _fetch_attributes(attr_ids):
+    """
+    Get Attributes by id for a lazy AttributeHandler, as {id: Attribute}.
+    The Attributes are not left in the idmapper cache; the handler
+    decides which ones to keep.
+    """
+    attrs = {}
+    missing = []
+    for attr_id in attr_ids:
+        attr = _EVICTED_ATTRIBUTES.get(attr_id) or Attribute.get_cached_instance(attr_id)
+        if attr is None:
+            missing.append(attr_id)
+        else:
+            attrs[attr_id] = attr
+    # in chunks, to stay below the query variable limit of SQLite
+    for ichunk in xrange(0, len(missing), 500):
+        for attr in Attribute.objects.filter(id__in=missing[ichunk:ichunk + 500]):
+            attrs[attr.id] = attr
+            _EVICTED_ATTRIBUTES[attr.id] = attr
+            Attribute.flush_cached_instance(attr)
+    return attrs
+
+
 class AttributeHandler(object):
     """
     Handler for adding Attributes to the object.
+
+    With settings.ATTRIBUTE_LAZY_LOADING, objects with more Attributes
+    than ATTRIBUTE_LAZY_CACHE_SIZE only get an index of their Attributes
+    cached ({cachekey: Attribute id}); each Attribute (and so its value)
+    is fetched when it is used and the handler keeps the most recently
+    used ones.
     """
     _m2m_fieldname = "db_attributes"
     _attrcreate = "attrcreate"
     _attredit = "attredit"
     _attrread = "attrread"
     _attrtype = None
+    _lazy = _ATTRIBUTE_LAZY_LOADING
 
     def __init__(self, obj):
         "Initialize handler"
@@ -234,15 +367,102 @@ class AttributeHandler(object):
         self._objid = obj.id
         self._model = to_str(obj.__class__.__name__.lower())
         self._cache = None
+        # in lazy mode, the cachekeys of the fetched Attributes,
+        # least recently used first. None if all are fetched.
+        self._loaded = None
 
     def _recache(self):
         "Cache all attributes of this object"
+        if _GA(self.obj, "_deferred_m2m") is not None:
+            # the object is being batch-created, so the database
+            # holds nothing new yet - the cache is all we have.
+            if self._cache is None:
+                self._cache = {}
+            return
         query = {"%s__id" % self._model : self._objid,
                  "attribute__db_attrtype" : self._attrtype}
-        attrs = [conn.attribute for conn in getattr(self.obj, self._m2m_fieldname).through.objects.filter(**query)]
+        through = getattr(self.obj, self._m2m_fieldname).through
+        if self._lazy:
+            index = list(through.objects.filter(**query).values_list(
+                            "attribute__id", "attribute__db_key", "attribute__db_category"))
+            if len(index) > _ATTRIBUTE_LAZY_CACHE_SIZE:
+                self._recache_index(index)
+                return
+            query = {"id__in" : [attr_id for attr_id, key, category in index]}
+            attrs = list(Attribute.objects.filter(**query))
+        else:
+            attrs = [conn.attribute for conn in through.objects.filter(**query)]
         self._cache = dict(("%s-%s" % (to_str(attr.db_key).lower(),
-                                       attr.db_category.lower() if conn.attribute.db_category else None),
+                                       attr.db_category.lower() if attr.db_category else None),
                             attr) for attr in attrs)
+        self._loaded = None
+
+    def _recache_index(self, index):
+        """
+        Cache the index of the Attributes only, keeping the Attributes
+        that were already fetched.
+        """
+        old_cache = self._cache or {}
+        loaded = self._loaded if self._loaded is not None else OrderedDict.fromkeys(old_cache)
+        self._cache = dict(("%s-%s" % (to_str(key).lower(), category.lower() if category else None), attr_id)
+                           for attr_id, key, category in index)
+        self._loaded = OrderedDict()
+        for cachekey in loaded:
+            attr = old_cache.get(cachekey)
+            # a deleted Attribute has no id (and is not in the index)
+            if (isinstance(attr, Attribute) and attr.id is not None
+                    and cachekey in self._cache and self._cache[cachekey] == attr.id):
+                self._cache[cachekey] = attr
+                self._loaded[cachekey] = True
+        self._evict()
+
+    def _evict(self):
+        "Drop the least recently used Attributes beyond the cache size"
+        while len(self._loaded) > _ATTRIBUTE_LAZY_CACHE_SIZE:
+            cachekey, _ = self._loaded.popitem(last=False)
+            attr = self._cache.get(cachekey)
+            if isinstance(attr, Attribute) and attr.id:
+                _EVICTED_ATTRIBUTES[attr.id] = attr
+                Attribute.flush_cached_instance(attr)
+                self._cache[cachekey] = attr.id
+
+    def _touch(self, cachekey):
+        "Mark a cached Attribute as the most recently used (lazy mode)"
+        if self._loaded is not None:
+            self._loaded.pop(cachekey, None)
+            self._loaded[cachekey] = True
+            self._evict()
+
+    def _get_attr(self, cachekey):
+        "Get a cached Attribute, fetching it if only its id is cached"
+        attr = self._cache.get(cachekey)
+        if attr is None or self._loaded is None:
+            return attr
+        if not isinstance(attr, Attribute):
+            attr = _fetch_attributes([attr]).get(attr)
+            if attr is None:
+                # deleted by someone else
+                del self._cache[cachekey]
+                return None
+            Attribute.cache_instance(attr)
+            self._cache[cachekey] = attr
+        self._touch(cachekey)
+        return attr
+
+    def _all_attrs(self, cachekeys=None):
+        """
+        Get the Attributes with the given cachekeys (default all),
+        fetching the missing ones in one go. These are not added to
+        the cache.
+        """
+        if cachekeys is None:
+            cachekeys = self._cache.keys()
+        attrs = [self._cache[cachekey] for cachekey in cachekeys]
+        if self._loaded is None:
+            return attrs
+        fetched = _fetch_attributes([attr for attr in attrs if not isinstance(attr, Attribute)])
+        return [attr if isinstance(attr, Attribute) else fetched[attr]
+                for attr in attrs if isinstance(attr, Attribute) or attr in fetched]
 
     def has(self, key, category=None):
         """
@@ -256,7 +476,8 @@ class AttributeHandler(object):
         key = [k.strip().lower() for k in make_iter(key) if k]
         category = category.strip().lower() if category is not None else None
         searchkeys = ["%s-%s" % (k, category) for k in make_iter(key)]
-        ret = [self._cache.get(skey) for skey in searchkeys if skey in self._cache]
+        # answered from the cache (or index) alone, nothing is fetched
+        ret = [skey in self._cache for skey in searchkeys]
         return ret[0] if len(ret) == 1 else ret
 
     def get(self, key=None, category=None, default=None, return_obj=False,
@@ -292,10 +513,10 @@ class AttributeHandler(object):
         if not key:
             # return all with matching category (or no category)
             catkey = "-%s" % category if category is not None else None
-            ret = [attr for key, attr in self._cache.items() if key and key.endswith(catkey)]
+            ret = self._all_attrs([key for key in self._cache if key and key.endswith(catkey)])
         else:
             for searchkey in ("%s-%s" % (k, category) for k in key):
-                attr_obj = self._cache.get(searchkey)
+                attr_obj = self._get_attr(searchkey)
                 if attr_obj:
                     ret.append(attr_obj)
                 else:
@@ -339,7 +560,7 @@ class AttributeHandler(object):
         category = category.strip().lower() if category is not None else None
         keystr = key.strip().lower()
         cachekey = "%s-%s" % (keystr, category)
-        attr_obj = self._cache.get(cachekey)
+        attr_obj = self._get_attr(cachekey)
 
         if attr_obj:
             # update an existing attribute object
@@ -357,9 +578,44 @@ class AttributeHandler(object):
                       "db_value" : None if strattr else to_pickle(value),
                       "db_strvalue" : value if strattr else None}
             new_attr = Attribute(**kwargs)
-            new_attr.save()
-            getattr(self.obj, self._m2m_fieldname).add(new_attr)
+            self._store_new(new_attr)
             self._cache[cachekey] = new_attr
+            self._touch(cachekey)
+
+    def _store_new(self, *new_attrs):
+        """
+        Save new Attributes and connect them to the object. If the object
+        is being batch-created, this is queued until the batch is stored.
+        """
+        deferred_m2m = _GA(self.obj, "_deferred_m2m")
+        if deferred_m2m is not None:
+            for new_attr in new_attrs:
+                # updates to the pending Attribute must not reach the db
+                _SA(new_attr, "_deferred_fields", set())
+            deferred_m2m.setdefault(self._m2m_fieldname, []).extend(new_attrs)
+            return
+        for new_attr in new_attrs:
+            new_attr.save()
+        getattr(self.obj, self._m2m_fieldname).add(*new_attrs)
+
+    def _delete_attrs(self, *attr_objs):
+        "Delete Attributes, also handling Attributes not yet stored."
+        deferred_m2m = _GA(self.obj, "_deferred_m2m")
+        if deferred_m2m is None:
+            for attr_obj in attr_objs:
+                attr_obj.delete()
+            return
+        # batch mode - pending Attributes are just dropped (we compare
+        # by identity since unsaved models all have pk=None)
+        pending = deferred_m2m.get(self._m2m_fieldname, [])
+        for attr_obj in attr_objs:
+            if attr_obj.id is None:
+                pending[:] = [attr for attr in pending if attr is not attr_obj]
+            else:
+                attr_obj.delete()
+            for cachekey, cached in self._cache.items():
+                if cached is attr_obj:
+                    del self._cache[cachekey]
 
 
     def batch_add(self, key, value, category=None, lockstring="",
@@ -391,7 +647,7 @@ class AttributeHandler(object):
             keystr = keystr.strip().lower()
             new_value = values[ikey]
             cachekey = "%s-%s" % (keystr, category)
-            attr_obj = self._cache.get(cachekey)
+            attr_obj = self._get_attr(cachekey)
 
             if attr_obj:
                 # update an existing attribute object
@@ -405,15 +661,15 @@ class AttributeHandler(object):
             else:
                 # create a new Attribute (no OOB handlers can be notified)
                 kwargs = {"db_key" : keystr, "db_category" : category,
-                          "db_attrtype" : self._attrtype,
+                          "db_model" : self._model, "db_attrtype" : self._attrtype,
                           "db_value" : None if strattr else to_pickle(new_value),
-                          "db_strvalue" : value if strattr else None}
+                          "db_strvalue" : new_value if strattr else None}
                 new_attr = Attribute(**kwargs)
-                new_attr.save()
                 new_attrobjs.append(new_attr)
+                self._cache[cachekey] = new_attr
         if new_attrobjs:
             # Add new objects to m2m field all at once
-            getattr(self.obj, self._m2m_fieldname).add(*new_attrobjs)
+            self._store_new(*new_attrobjs)
             self._recache()
 
 
@@ -429,11 +685,11 @@ class AttributeHandler(object):
         key = [k.strip().lower() for k in make_iter(key) if k]
         category = category.strip().lower() if category is not None else None
         for searchstr in ("%s-%s" % (k, category) for k in key):
-            attr_obj = self._cache.get(searchstr)
+            attr_obj = self._get_attr(searchstr)
             if attr_obj:
                 if not (accessing_obj and not attr_obj.access(accessing_obj,
                         self._attredit, default=default_access)):
-                    attr_obj.delete()
+                    self._delete_attrs(attr_obj)
             elif not attr_obj and raise_exception:
                 raise AttributeError
         self._recache()
@@ -447,10 +703,10 @@ class AttributeHandler(object):
         if self._cache is None or not _TYPECLASS_AGGRESSIVE_CACHE:
             self._recache()
         if accessing_obj:
-            [attr.delete() for attr in self._cache.values()
-             if attr.access(accessing_obj, self._attredit, default=default_access)]
+            self._delete_attrs(*[attr for attr in self._all_attrs()
+                     if attr.access(accessing_obj, self._attredit, default=default_access)])
         else:
-            [attr.delete() for attr in self._cache.values()]
+            self._delete_attrs(*self._all_attrs())
         self._recache()
 
     def all(self, accessing_obj=None, default_access=True):
@@ -463,7 +719,7 @@ class AttributeHandler(object):
         """
         if self._cache is None or not _TYPECLASS_AGGRESSIVE_CACHE:
             self._recache()
-        attrs = sorted(self._cache.values(), key=lambda o: o.id)
+        attrs = sorted(self._all_attrs(), key=lambda o: o.id)
         if accessing_obj:
             return [attr for attr in attrs
                     if attr.access(accessing_obj, self._attredit, default=default_access)]
@@ -480,6 +736,22 @@ class NickHandler(AttributeHandler):
     with categories nick_<nicktype>
     """
     _attrtype = "nick"
+    # nicks are small and all needed at once for matching
+    _lazy = False
+
+    def __init__(self, obj):
+        "Initialize handler"
+        super(NickHandler, self).__init__(obj)
+        # compiled nick matchers, keyed by (categories, include_player).
+        # They are rebuilt whenever _version (or the version of the
+        # player's NickHandler) changed since they were compiled.
+        self._version = 0
+        self._matchers = {}
+
+    def _recache(self):
+        "Cache all nicks of this object"
+        super(NickHandler, self)._recache()
+        self._version += 1
 
     def has(self, key, category="inputline"):
         return super(NickHandler, self).has(key, category=category)
@@ -491,26 +763,52 @@ class NickHandler(AttributeHandler):
     def add(self, key, replacement, category="inputline", **kwargs):
         "Add a new nick"
         super(NickHandler, self).add(key, replacement, category=category, strattr=True, **kwargs)
+        self._version += 1
 
     def remove(self, key, category="inputline", **kwargs):
         "Remove Nick with matching category"
         super(NickHandler, self).remove(key, category=category, **kwargs)
 
+    def _nicks(self, categories):
+        "All (key, replacement) in the given categories, longest keys first"
+        nicks = []
+        for category in categories:
+            nicks.extend((nick.db_key, nick.db_strvalue)
+                         for nick in make_iter(self.get(category=category, return_obj=True)) if nick)
+        return sorted(nicks, key=lambda nick: -len(nick[0]))
+
+    def _get_matcher(self, categories, include_player):
+        """
+        Get the compiled regex matching any nick in categories (object
+        nicks before player nicks) and a dict mapping the lower-case
+        nick keys to their replacements.
+        """
+        player_nicks = self.obj.player.nicks if include_player and self.obj.has_player else None
+        signature = (self._version, player_nicks and (id(player_nicks), player_nicks._version))
+        cachekey = (categories, include_player)
+        matcher = self._matchers.get(cachekey)
+        if matcher and matcher[0] == signature and _TYPECLASS_AGGRESSIVE_CACHE:
+            return matcher[1:]
+        nicks = self._nicks(categories)
+        if player_nicks:
+            nicks.extend(player_nicks._nicks(categories))
+        replacements = {}
+        for key, replacement in nicks:
+            replacements.setdefault(key.lower(), replacement)
+        regex = re.compile("|".join(re.escape(key) for key, _ in nicks), re.IGNORECASE) if nicks else None
+        # building may have updated the versions; store the current ones
+        signature = (self._version, player_nicks and (id(player_nicks), player_nicks._version))
+        self._matchers[cachekey] = (signature, regex, replacements)
+        return regex, replacements
+
     def nickreplace(self, raw_string, categories=("inputline", "channel"), include_player=True):
         "Replace entries in raw_string with nick replacement"
-        raw_string
-        obj_nicks, player_nicks = [], []
-        for category in make_iter(categories):
-            obj_nicks.extend([n for n in make_iter(self.get(category=category, return_obj=True)) if n])
-        if include_player and self.obj.has_player:
-            for category in make_iter(categories):
-                player_nicks.extend([n for n in make_iter(self.obj.player.nicks.get(category=category, return_obj=True)) if n])
-        for nick in obj_nicks + player_nicks:
+        regex, replacements = self._get_matcher(tuple(make_iter(categories)), include_player)
+        if regex:
             # make a case-insensitive match here
-            match = re.match(re.escape(nick.db_key), raw_string, re.IGNORECASE)
+            match = regex.match(raw_string)
             if match:
-                raw_string = raw_string.replace(match.group(), nick.db_strvalue, 1)
-                break
+                raw_string = replacements[match.group().lower()] + raw_string[match.end():]
         return raw_string
 
 
@@ -632,6 +930,11 @@ class TagHandler(object):
 
     def _recache(self):
         "Cache all tags of this object"
+        if _GA(self.obj, "_deferred_m2m") is not None:
+            # batch-created object, nothing stored in database yet
+            if self._cache is None:
+                self._cache = {}
+            return
         query = {"%s__id" % self._model : self._objid,
                  "tag__db_tagtype" : self._tagtype}
         tagobjs = [conn.tag for conn in getattr(self.obj, self._m2m_fieldname).through.objects.filter(**query)]
@@ -649,12 +952,20 @@ class TagHandler(object):
             tagstr = tagstr.strip().lower()
             category = category.strip().lower() if category is not None else None
             data = str(data) if data is not None else None
-            # this will only create tag if no matches existed beforehand (it
-            # will overload data on an existing tag since that is not
-            # considered part of making the tag unique)
-            tagobj = Tag.objects.create_tag(key=tagstr, category=category, data=data,
-                                            tagtype=self._tagtype)
-            getattr(self.obj, self._m2m_fieldname).add(tagobj)
+            deferred_m2m = _GA(self.obj, "_deferred_m2m")
+            if deferred_m2m is not None:
+                # batch creation - the tag is looked up/created together
+                # with the tags of all other objects in the batch
+                tagobj = Tag(db_key=tagstr, db_category=category, db_data=data,
+                             db_tagtype=self._tagtype)
+                deferred_m2m.setdefault(self._m2m_fieldname, []).append(tagobj)
+            else:
+                # this will only create tag if no matches existed beforehand (it
+                # will overload data on an existing tag since that is not
+                # considered part of making the tag unique)
+                tagobj = Tag.objects.create_tag(key=tagstr, category=category, data=data,
+                                                tagtype=self._tagtype)
+                getattr(self.obj, self._m2m_fieldname).add(tagobj)
             if self._cache is None:
                 self._recache()
             cachestring = "%s-%s" % (tagstr, category)
@@ -683,6 +994,13 @@ class TagHandler(object):
             tagstr = key.strip().lower()
             category = category.strip().lower() if category is not None else None
 
+            deferred_m2m = _GA(self.obj, "_deferred_m2m")
+            if deferred_m2m is not None:
+                # batch creation - just drop the pending tag
+                tagobj = (self._cache or {}).pop("%s-%s" % (tagstr, category), None)
+                pending = deferred_m2m.get(self._m2m_fieldname, [])
+                pending[:] = [tag for tag in pending if tag is not tagobj]
+                continue
             # This does not delete the tag object itself. Maybe it should do
             # that when no objects reference the tag anymore (how to check)?
             tagobj = self.obj.db_tags.filter(db_key=tagstr, db_category=category)
@@ -692,6 +1010,14 @@ class TagHandler(object):
 
     def clear(self):
         "Remove all tags from the handler"
+        deferred_m2m = _GA(self.obj, "_deferred_m2m")
+        if deferred_m2m is not None:
+            # batch creation - drop pending tags of our tagtype
+            cached = self._cache.values() if self._cache else []
+            pending = deferred_m2m.get(self._m2m_fieldname, [])
+            pending[:] = [tag for tag in pending if not any(tag is ctag for ctag in cached)]
+            self._cache = {}
+            return
         getattr(self.obj, self._m2m_fieldname).clear()
         self._recache()
 
@@ -873,25 +1199,21 @@ class TypedObject(SharedMemoryModel):
     def __unicode__(self):
         return u"%s" % _GA(self, "db_key")
 
-    def __getattribute__(self, propname):
+    def __getattr__(self, propname):
         """
-        Will predominantly look for an attribute
-        on this object, but if not found we will
+        Called when propname is not found on this object; we then
         check if it might exist on the typeclass instead. Since
         the typeclass refers back to the databaseobject as well, we
         have to be very careful to avoid loops.
         """
-        try:
-            return _GA(self, propname)
-        except AttributeError:
-            if propname.startswith('_'):
-                # don't relay private/special varname lookups to the typeclass
-                raise AttributeError("private property %s not found on db model (typeclass not searched)." % propname)
-            # check if the attribute exists on the typeclass instead
-            # (we make sure to not incur a loop by not triggering the
-            # typeclass' __getattribute__, since that one would
-            # try to look back to this very database object.)
-            return _GA(_GA(self, 'typeclass'), propname)
+        if propname.startswith('_'):
+            # don't relay private/special varname lookups to the typeclass
+            raise AttributeError("private property %s not found on db model (typeclass not searched)." % propname)
+        # check if the attribute exists on the typeclass instead
+        # (we make sure to not incur a loop by not triggering the
+        # typeclass' __getattr__, since that one would
+        # try to look back to this very database object.)
+        return _GA(_GA(self, 'typeclass'), propname)
 
     def _hasattr(self, obj, attrname):
         """
@@ -969,38 +1291,28 @@ class TypedObject(SharedMemoryModel):
             # this means we should get the default obj without giving errors.
             return _GA(self, "_get_default_typeclass")(cache=True, silent=True, save=True)
         else:
-            # handle loading/importing of typeclasses, searching all paths.
-            # (self._typeclass_paths is a shortcut to settings.TYPECLASS_*_PATHS
-            # where '*' is either OBJECT, SCRIPT or PLAYER depending on the
-            # typed entities).
-            typeclass_paths = [path] + ["%s.%s" % (prefix, path)
-                                    for prefix in _GA(self, '_typeclass_paths')]
-
-            for tpath in typeclass_paths:
-
-                # try to import and analyze the result
-                typeclass = _GA(self, "_path_import")(tpath)
-                if callable(typeclass):
-                    # we succeeded to import. Cache and return.
+            # find the typeclass class, searching all paths. This is
+            # only imported once per process (self._typeclass_paths is a
+            # shortcut to settings.TYPECLASS_*_PATHS where '*' is either
+            # OBJECT, SCRIPT or PLAYER depending on the typed entities).
+            tpath, typeclass = TYPECLASS_REGISTRY.get(path, _GA(self, '_typeclass_paths'))
+            if tpath:
+                if tpath != path:
+                    # found through a prefix; store the full path
                     _SA(self, "typeclass_path", tpath)
-                    typeclass = typeclass(self)
-                    _SA(self, "_cached_typeclass", typeclass)
-                    try:
-                        typeclass.at_init()
-                    except AttributeError:
-                        logger.log_trace("\n%s: Error initializing typeclass %s. Using default." % (self, tpath))
-                        break
-                    except Exception:
-                        logger.log_trace()
+                typeclass = typeclass(self)
+                _SA(self, "_cached_typeclass", typeclass)
+                try:
+                    typeclass.at_init()
                     return typeclass
-                elif hasattr(typeclass, '__file__'):
-                    errstring += "\n%s seems to be just the path to a module. You need" % tpath
-                    errstring +=  " to specify the actual typeclass name inside the module too."
-                elif typeclass:
-                    errstring += "\n%s" % typeclass.strip()    # this will hold a growing error message.
-            if not errstring:
-                errstring = "\nMake sure the path is set correctly. Paths tested:\n"
-                errstring += ", ".join(typeclass_paths)
+                except AttributeError:
+                    logger.log_trace("\n%s: Error initializing typeclass %s. Using default." % (self, tpath))
+                    errstring = "\nMake sure the path is set correctly. Paths tested:\n%s" % tpath
+                except Exception:
+                    logger.log_trace()
+                    return typeclass
+            else:
+                errstring = typeclass
             errstring += "\nTypeclass code was not found or failed to load."
         # If we reach this point we couldn't import any typeclasses. Return
         # default. It's up to the calling method to use e.g. self.is_typeclass()
@@ -1020,38 +1332,10 @@ class TypedObject(SharedMemoryModel):
     def _path_import(self, path):
         """
         Import a class from a python path of the
-        form src.objects.object.Object
+        form src.objects.object.Object. Returns the class
+        or an error string.
         """
-        errstring = ""
-        if not path:
-            # this needs not be bad, it just means
-            # we should use defaults.
-            return None
-        try:
-            modpath, class_name = path.rsplit('.', 1)
-            module = __import__(modpath, fromlist=["none"])
-            return module.__dict__[class_name]
-        except ImportError:
-            trc = sys.exc_traceback
-            if not trc.tb_next:
-                # we separate between not finding the module, and finding
-                # a buggy one.
-                pass
-                #errstring = "Typeclass not found trying path '%s'." % path
-            else:
-                # a bug in the module is reported normally.
-                trc = traceback.format_exc().strip()
-                errstring = "\n%sError importing '%s'." % (trc, path)
-        except (ValueError, TypeError):
-            errstring = "Malformed typeclass path '%s'." % path
-        except KeyError:
-            errstring = "No class '%s' was found in module '%s'."
-            errstring = errstring % (class_name, modpath)
-        except Exception:
-            trc = traceback.format_exc().strip()
-            errstring = "\n%sException importing '%s'." % (trc, path)
-        # return the error.
-        return errstring
+        return TYPECLASS_REGISTRY.path_import(path)
 
     def _display_errmsg(self, message):
         """
@@ -0,0 +1,129 @@
+"""
+Typeclass registry
+
+This resolves the typeclass paths stored on typed objects to their
+typeclass classes, once per process. Each db_typeclass_path is tried
+as given and with the *_TYPECLASS_PATHS prefixes of its model (as
+TypedObject.typeclass always did); the successful result is then
+remembered, so loading the typeclass of an object never goes through
+the import machinery again.
+
+    from src.typeclasses.registry import TYPECLASS_REGISTRY
+
+    tpath, typeclass = TYPECLASS_REGISTRY.get(path, prefixes)
+
+At server start, all typeclasses in use are resolved with one
+DISTINCT db_typeclass_path query per typed model (preload). Failed
+imports are not remembered, so they are reported (and retried) every
+time, as before.
+
+"""
+import sys
+import traceback
+
+__all__ = ("TYPECLASS_REGISTRY",)
+
+
+class TypeclassRegistry(object):
+    """
+    Process-wide cache of typeclass classes.
+    """
+    def __init__(self):
+        # {python path: class}
+        self.imported = {}
+        # {(db_typeclass_path, prefixes): (python path, class)}
+        self.resolved = {}
+
+    def clear(self):
+        "Forget all typeclasses"
+        self.imported = {}
+        self.resolved = {}
+
+    def path_import(self, path):
+        """
+        Import a class from a python path of the form
+        src.objects.object.Object. Returns the class, or an error
+        string (or None) if it could not be imported.
+        """
+        cls = self.imported.get(path)
+        if cls:
+            return cls
+        errstring = ""
+        if not path:
+            # this needs not be bad, it just means
+            # we should use defaults.
+            return None
+        try:
+            modpath, class_name = path.rsplit('.', 1)
+            module = __import__(modpath, fromlist=["none"])
+            cls = module.__dict__[class_name]
+            if callable(cls):
+                self.imported[path] = cls
+            return cls
+        except ImportError:
+            trc = sys.exc_traceback
+            if trc.tb_next:
+                # we separate between not finding the module, and finding
+                # a buggy one. A bug in the module is reported normally.
+                trc = traceback.format_exc().strip()
+                errstring = "\n%sError importing '%s'." % (trc, path)
+        except (ValueError, TypeError):
+            errstring = "Malformed typeclass path '%s'." % path
+        except KeyError:
+            errstring = "No class '%s' was found in module '%s'."
+            errstring = errstring % (class_name, modpath)
+        except Exception:
+            trc = traceback.format_exc().strip()
+            errstring = "\n%sException importing '%s'." % (trc, path)
+        # return the error.
+        return errstring
+
+    def get(self, path, prefixes=()):
+        """
+        Resolve the typeclass path, trying it as given and then with
+        each of prefixes prepended. Returns (python path, class), or
+        (None, error string) if no class was found.
+        """
+        key = (path, tuple(prefixes))
+        found = self.resolved.get(key)
+        if found:
+            return found
+        errstring = ""
+        typeclass_paths = [path] + ["%s.%s" % (prefix, path) for prefix in prefixes]
+        for tpath in typeclass_paths:
+            typeclass = self.path_import(tpath)
+            if callable(typeclass):
+                self.resolved[key] = (tpath, typeclass)
+                return tpath, typeclass
+            elif hasattr(typeclass, '__file__'):
+                errstring += "\n%s seems to be just the path to a module. You need" % tpath
+                errstring += " to specify the actual typeclass name inside the module too."
+            elif typeclass:
+                errstring += "\n%s" % typeclass.strip()    # this will hold a growing error message.
+        if not errstring:
+            errstring = "\nMake sure the path is set correctly. Paths tested:\n"
+            errstring += ", ".join(typeclass_paths)
+        return None, errstring
+
+    def preload(self):
+        """
+        Resolve all typeclasses in use, plus the defaults. Returns
+        the number of typeclass paths resolved.
+        """
+        from src.objects.models import ObjectDB
+        from src.players.models import PlayerDB
+        from src.scripts.models import ScriptDB
+        from src.comms.models import ChannelDB
+        nresolved = 0
+        for model in (ObjectDB, PlayerDB, ScriptDB, ChannelDB):
+            # order_by() clears the default ordering, which would
+            # otherwise become part of the DISTINCT
+            for path in model.objects.order_by().values_list(
+                    "db_typeclass_path", flat=True).distinct():
+                if path and self.get(path, model._typeclass_paths)[0]:
+                    nresolved += 1
+            self.path_import(model._default_typeclass_path)
+        return nresolved
+
+
+TYPECLASS_REGISTRY = TypeclassRegistry()
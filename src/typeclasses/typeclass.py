@@ -8,6 +8,14 @@ the typeclass must inherit from TypeClass and not reimplement
 the get/setters defined below. There are also a few properties
 that are protected, so as to not overwrite property names
 used by the typesystem or django itself.
+
+Properties and methods of the database model are reached from the
+typeclass through forwarding descriptors, which the metaclass adds to
+a typeclass the first time it is instantiated with a given model
+(see MetaTypeClass.forward_model). Only names not defined by the
+typeclass itself are forwarded, so the typeclass still takes
+priority. Anything else (such as non-field attributes stored on the
+database object) is found through __getattr__.
 """
 
 from src.utils.logger import log_trace, log_errmsg
@@ -30,14 +38,30 @@ PROTECTED = ('id', 'dbobj', 'db', 'ndb', 'objects', 'typeclass', 'db_player',
              'typeclass_paths')
 
 
-# If this is true, all non-protected property assignments
-# are directly stored to a database attribute
+class _DbForward(object):
+    """
+    Descriptor forwarding a typeclass attribute to the same-named
+    attribute on its database object. It is a non-data descriptor, so
+    assignments still go through TypeClass.__setattr__.
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            # not available on the class, just as before
+            raise AttributeError(self.name)
+        return _GA(_GA(instance, "dbobj"), self.name)
+
 
 class MetaTypeClass(type):
     """
     This metaclass just makes sure the class object gets
     printed in a nicer way (it might end up having no name at all
     otherwise due to the magics being done with get/setattribute).
+    It also adds the descriptors forwarding to the database model.
     """
     def __init__(mcs, *args, **kwargs):
         """
@@ -46,6 +70,24 @@ class MetaTypeClass(type):
         super(MetaTypeClass, mcs).__init__(*args, **kwargs)
         mcs.typename = mcs.__name__
         mcs.path = "%s.%s" % (mcs.__module__, mcs.__name__)
+        # the database models forwarded to by this very class
+        mcs._forwarded_models = ()
+
+    def forward_model(cls, model):
+        """
+        Add descriptors forwarding the fields, properties and methods
+        of the database model to this typeclass, for all names the
+        typeclass does not define itself.
+        """
+        defined = set()
+        for base in cls.__mro__:
+            defined.update(name for name, value in base.__dict__.items()
+                           if not isinstance(value, _DbForward))
+        names = set(name for name in dir(model) if not name.startswith("__"))
+        names.update(field.attname for field in model._meta.fields)
+        for name in names.difference(defined):
+            setattr(cls, name, _DbForward(name))
+        cls._forwarded_models = cls._forwarded_models + (model,)
 
     def __str__(cls):
         return "%s" % cls.__name__
@@ -84,38 +126,35 @@ class TypeClass(object):
         dbobj_mro = _GA(dbobj_cls, '__mro__')
         if not any('src.typeclasses.models.TypedObject' in str(mro) for mro in dbobj_mro):
             raise Exception("dbobj is not a TypedObject: %s: %s" % (dbobj_cls, dbobj_mro))
+        cls = _GA(self, '__class__')
+        if dbobj_cls not in _GA(cls, '__dict__')['_forwarded_models']:
+            cls.forward_model(dbobj_cls)
 
         # we should always be able to use dbobj/typeclass to get back an object of the desired type
         _SA(self, 'dbobj', dbobj)
         _SA(self, 'typeclass', self)
 
-    def __getattribute__(self, propname):
+    def __getattr__(self, propname):
         """
-        Change the normal property access to
-        transparently include the properties on
-        self.dbobj. Note that dbobj properties have
-        priority, so if you define a same-named
-        property on the class, it will NOT be
-        accessible through getattr.
+        Called when propname was not found on the typeclass, nor
+        through the descriptors forwarding to the database model.
+        Looks for it on self.dbobj (e.g. non-field attributes
+        stored there).
         """
         if propname.startswith('__') and propname.endswith('__'):
             # python specials are parsed as-is (otherwise things like
             # isinstance() fail to identify the typeclass)
-            return _GA(self, propname)
-        #print "get %s (dbobj:%s)" % (propname, type(dbobj))
+            raise AttributeError(propname)
         try:
-            return _GA(self, propname)
+            dbobj = _GA(self, 'dbobj')
         except AttributeError:
-            try:
-                dbobj = _GA(self, 'dbobj')
-            except AttributeError:
-                log_trace("Typeclass CRITICAL ERROR! dbobj not found for Typeclass %s!" % self)
-                raise
-            try:
-                return _GA(dbobj, propname)
-            except AttributeError:
-                string = "Object: '%s' not found on %s(#%s), nor on its typeclass %s."
-                raise AttributeError(string % (propname, dbobj, _GA(dbobj, "dbid"), _GA(dbobj, "typeclass_path")))
+            log_trace("Typeclass CRITICAL ERROR! dbobj not found for Typeclass %s!" % self)
+            raise
+        try:
+            return _GA(dbobj, propname)
+        except AttributeError:
+            string = "Object: '%s' not found on %s(#%s), nor on its typeclass %s."
+            raise AttributeError(string % (propname, dbobj, _GA(dbobj, "dbid"), _GA(dbobj, "typeclass_path")))
 
     def __setattr__(self, propname, value):
         """
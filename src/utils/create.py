@@ -22,7 +22,8 @@ Models covered:
  Players
 """
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Max
 from src.utils.idmapper.models import SharedMemoryModel
 from src.utils import utils, logger
 from src.utils.utils import make_iter
@@ -41,6 +42,9 @@ _to_object = None
 _ChannelDB = None
 _channelhandler = None
 _Tag = None
+_Attribute = None
+_SEARCH_INDEX = None
+_SERVER_STATS = None
 
 
 # limit symbol import from API
@@ -48,6 +52,7 @@ __all__ = ("create_object", "create_script", "create_help_entry",
            "create_message", "create_channel", "create_player")
 
 _GA = object.__getattribute__
+_SA = object.__setattr__
 
 # Helper function
 
@@ -72,6 +77,11 @@ def handle_dbref(inp, objclass, raise_errors=True):
     except ValueError:
         return None
 
+    # avoid a query if the object is already in the idmapper cache
+    cached = objclass.get_cached_instance(int(inp))
+    if cached is not None:
+        return cached
+
     # if we get to this point, inp is an integer dbref; get the matching object
     try:
         return objclass.objects.get(id=inp)
@@ -80,6 +90,116 @@ def handle_dbref(inp, objclass, raise_errors=True):
             raise
         return inp
 
+
+# Helpers for creating with deferred saves. While an object has
+# _deferred_fields/_deferred_m2m set, its saves and new Attributes/Tags
+# are only recorded; _store_deferred then writes them in bulk.
+
+def _bulk_insert(model, instances):
+    """
+    Store new model instances, assigning them their ids. A single
+    instance is saved normally. Many instances are stored with one
+    multi-row INSERT; since bulk_create does not report back the
+    primary keys, the new rows are then read back as the ids above
+    the highest one before the insert, in order. Must be called
+    inside a transaction.
+    """
+    if not instances:
+        return
+    if len(instances) == 1:
+        instances[0].save()
+        return
+    manager = model.objects
+    last_id = manager.aggregate(Max("id"))["id__max"] or 0
+    manager.bulk_create(instances)
+    ids = list(manager.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:len(instances) + 1])
+    if len(ids) != len(instances):
+        # something else inserted rows meanwhile; we can't tell them apart
+        raise IntegrityError("Could not read back the ids of %i new %s rows." % (len(instances), model.__name__))
+    for inst, dbid in zip(instances, ids):
+        inst.id = dbid
+        inst._state.adding = False
+        inst._state.db = manager.db
+
+
+def _field_values(dbobj):
+    """
+    Get the current database values of all concrete fields on dbobj,
+    keyed by field name (foreign keys are given as ids).
+    """
+    return dict((field.name, _GA(dbobj, field.attname))
+                for field in dbobj._meta.concrete_fields if not field.primary_key)
+
+
+def _store_deferred(dbobjs, initial_values):
+    """
+    Store everything the creation hooks did to the dbobjs while their
+    saves were deferred: changed fields are written with one UPDATE
+    per distinct set of changes and all new Attributes and Tags are
+    inserted with multi-row INSERTs. initial_values holds the field
+    values of each dbobj as they were first inserted.
+    """
+    global _ObjectDB, _Attribute, _Tag, _SEARCH_INDEX, _SERVER_STATS
+    if not _ObjectDB:
+        from src.objects.models import ObjectDB as _ObjectDB
+    if not _SEARCH_INDEX:
+        from src.objects.searchindex import SEARCH_INDEX as _SEARCH_INDEX
+    if not _SERVER_STATS:
+        from src.server.stats import SERVER_STATS as _SERVER_STATS
+    if not _Attribute:
+        from src.typeclasses.models import Attribute as _Attribute
+    if not _Tag:
+        from src.typeclasses.models import Tag as _Tag
+
+    updates = {}
+    attrs, attrlinks, tags, taglinks = [], [], {}, []
+    for iobj, dbobj in enumerate(dbobjs):
+        pending = _GA(dbobj, "_deferred_m2m")
+        _SA(dbobj, "_deferred_fields", None)
+        _SA(dbobj, "_deferred_m2m", None)
+        changes = tuple(sorted((fieldname, value) for fieldname, value in _field_values(dbobj).items()
+                               if value != initial_values[iobj][fieldname]))
+        if changes:
+            updates.setdefault(changes, []).append(dbobj.id)
+        for attr in pending.get("db_attributes", []):
+            _SA(attr, "_deferred_fields", None)
+            attrs.append(attr)
+            attrlinks.append((dbobj, attr))
+        for tag in pending.get("db_tags", []):
+            tagkey = (tag.db_key, tag.db_category, tag.db_tagtype)
+            tags[tagkey] = tag.db_data if tag.db_data is not None else tags.get(tagkey)
+            taglinks.append((dbobj, tagkey))
+    # update changed fields
+    for changes, ids in updates.items():
+        _ObjectDB.objects.filter(id__in=ids).update(**dict(changes))
+    # attributes
+    if attrs:
+        _bulk_insert(_Attribute, attrs)
+        for attr in attrs:
+            _Attribute.cache_instance(attr)
+        through = _ObjectDB.db_attributes.through
+        through.objects.bulk_create([through(objectdb_id=dbobj.id, attribute_id=attr.id)
+                                     for dbobj, attr in attrlinks])
+    # tags - these are shared, so we only create each one once
+    if tags:
+        tags = dict((tagkey, _Tag.objects.create_tag(key=tagkey[0], category=tagkey[1],
+                                                     data=data, tagtype=tagkey[2]))
+                    for tagkey, data in tags.items())
+        for dbobj in set(dbobj for dbobj, tagkey in taglinks):
+            # replace the placeholders in the handler caches
+            for handler in (dbobj.tags, dbobj.aliases, dbobj.permissions):
+                if handler._cache:
+                    for cachekey, tag in handler._cache.items():
+                        handler._cache[cachekey] = tags[(tag.db_key, tag.db_category, tag.db_tagtype)]
+        through = _ObjectDB.db_tags.through
+        through.objects.bulk_create([through(objectdb_id=dbobj.id, tag_id=tags[tagkey].id)
+                                     for dbobj, tagkey in set(taglinks)])
+    # these writes bypass the signals keeping the search index and
+    # the server statistics current
+    for dbobj in dbobjs:
+        _SEARCH_INDEX.update(dbobj)
+        _SERVER_STATS.update_object(dbobj)
+
 #
 # Game Object creation
 #
@@ -104,6 +224,11 @@ def create_object(typeclass=None, key=None, location=None,
               None upon errors.
     nohome - this allows the creation of objects without a default home location;
              this only used when creating the default location itself or during unittests
+
+    The object row is INSERTed once; whatever the creation hooks and
+    the permissions/locks/aliases change is then written with one
+    UPDATE plus bulk inserts of new Attributes and Tags, all in one
+    transaction (see src/utils/dummyrunner/create_queries.py).
     """
     global _Object, _ObjectDB
     if not _Object:
@@ -136,62 +261,83 @@ def create_object(typeclass=None, key=None, location=None,
                                          settings.DEFAULT_HOME)
 
     # create new database object all in one go
-    new_db_object = _ObjectDB(db_key=key, db_location=location,
+    new_db_object = _ObjectDB(db_key=key or "", db_location=location,
                               db_destination=destination, db_home=home,
                               db_typeclass_path=typeclass)
-
-    if not key:
-        # the object should always have a key, so if not set we give a default
-        new_db_object.key = "#%i" % new_db_object.dbid
-
-    # this will either load the typeclass or the default one (will also save object)
-    new_object = new_db_object.typeclass
-
-    if not _GA(new_object, "is_typeclass")(typeclass, exact=True):
-        # this will fail if we gave a typeclass as input and it still
-        # gave us a default
-        try:
-            SharedMemoryModel.delete(new_db_object)
-        except AssertionError:
-            # this happens if object was never created
-            pass
-        if report_to:
-            report_to = handle_dbref(report_to, _ObjectDB)
-            _GA(report_to, "msg")("Error creating %s (%s).\n%s" % (new_db_object.key, typeclass,
-                                                                 _GA(new_db_object, "typeclass_last_errmsg")))
-            return None
-        else:
-            raise Exception(_GA(new_db_object, "typeclass_last_errmsg"))
-
-    # from now on we can use the typeclass object
-    # as if it was the database object.
-
-    # call the hook methods. This is where all at_creation
-    # customization happens as the typeclass stores custom
-    # things on its database object.
-
-    # note - this may override input keys, locations etc!
-    new_object.basetype_setup()  # setup the basics of Exits, Characters etc.
-    new_object.at_object_creation()
-
-    # we want the input to override that set in the hooks, so
-    # we re-apply those if needed
-    if new_object.key != key:
-        new_object.key = key
-    if new_object.location != location:
-        new_object.location = location
-    if new_object.home != home:
-        new_object.home = home
-    if new_object.destination != destination:
-        new_object.destination = destination
-
-    # custom-given perms/locks do overwrite hooks
-    if permissions:
-        new_object.permissions.add(permissions)
-    if locks:
-        new_object.locks.add(locks)
-    if aliases:
-        new_object.aliases.add(aliases)
+    try:
+        with transaction.atomic():
+            # this is the only INSERT; from here on everything the
+            # hooks save is deferred and stored in bulk at the end
+            new_db_object.save()
+            initial_values = _field_values(new_db_object)
+            _SA(new_db_object, "_deferred_fields", set())
+            _SA(new_db_object, "_deferred_m2m", {})
+
+            if not key:
+                # the object should always have a key, so if not set we give a default
+                key = "#%i" % new_db_object.dbid
+                new_db_object.key = key
+
+            # this will either load the typeclass or the default one
+            new_object = new_db_object.typeclass
+
+            if not _GA(new_object, "is_typeclass")(typeclass, exact=True):
+                # this will fail if we gave a typeclass as input and it still
+                # gave us a default
+                _SA(new_db_object, "_deferred_fields", None)
+                _SA(new_db_object, "_deferred_m2m", None)
+                try:
+                    SharedMemoryModel.delete(new_db_object)
+                except AssertionError:
+                    # this happens if object was never created
+                    pass
+                if report_to:
+                    report_to = handle_dbref(report_to, _ObjectDB)
+                    _GA(report_to, "msg")("Error creating %s (%s).\n%s" % (new_db_object.key, typeclass,
+                                                                         _GA(new_db_object, "typeclass_last_errmsg")))
+                    return None
+                else:
+                    raise Exception(_GA(new_db_object, "typeclass_last_errmsg"))
+
+            # from now on we can use the typeclass object
+            # as if it was the database object.
+
+            # call the hook methods. This is where all at_creation
+            # customization happens as the typeclass stores custom
+            # things on its database object.
+
+            # note - this may override input keys, locations etc!
+            new_object.basetype_setup()  # setup the basics of Exits, Characters etc.
+            new_object.at_object_creation()
+
+            # we want the input to override that set in the hooks, so
+            # we re-apply those if needed
+            if new_object.key != key:
+                new_object.key = key
+            if new_object.location != location:
+                new_object.location = location
+            if new_object.home != home:
+                new_object.home = home
+            if new_object.destination != destination:
+                new_object.destination = destination
+
+            # custom-given perms/locks do overwrite hooks
+            if permissions:
+                new_object.permissions.add(permissions)
+            if locks:
+                new_object.locks.add(locks)
+            if aliases:
+                new_object.aliases.add(aliases)
+
+            # write all changes made above in as few queries as possible
+            _store_deferred([new_db_object], [initial_values])
+    except Exception:
+        # the transaction was rolled back; don't leave a ghost in the cache
+        _SA(new_db_object, "_deferred_fields", None)
+        _SA(new_db_object, "_deferred_m2m", None)
+        if new_db_object.id is not None:
+            _ObjectDB.flush_cached_instance(new_db_object)
+        raise
 
     # trigger relevant move_to hooks in order to display messages.
     if location:
@@ -17,24 +17,49 @@ used by Attributes - without it, one would not be able to update mutables
 in-situ, e.g obj.db.mynestedlist[3][5] = 3 would never be saved and
 be out of sync with the database.
 
+Updates are not saved right away but at the end of the current reactor
+iteration, so many changes to the same Attribute during one command
+(or tick) only save it once. Until then, reading the Attribute returns
+the changed (pending) structure. Outside of the reactor thread (and in
+process pool workers) updates are saved immediately.
+
+Reading an Attribute does not convert all of its value up front: the
+Saver* structure returned only wraps the top level of the unpickled
+data, and nested lists, dicts and database objects are unpacked the
+first time they are accessed. Writing it back only re-packs the parts
+that were accessed. Database objects are packed as
+
+  ('__dbobj__', natural key, creation time in microseconds, id)
+
+(version 2 of the packed form; in one pickle the tag and natural key
+are only stored once). Data packed as version 1, with the creation
+time as a string, is read as before.
+
 """
 
+from calendar import timegm
 from functools import update_wrapper
 from collections import defaultdict, MutableSequence, MutableSet, MutableMapping
+from twisted.internet import reactor
+from twisted.python.threadable import isInIOThread
 try:
-    from cPickle import dumps, loads
+    from cPickle import dumps, loads, HIGHEST_PROTOCOL
 except ImportError:
-    from pickle import dumps, loads
+    from pickle import dumps, loads, HIGHEST_PROTOCOL
 from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.contenttypes.models import ContentType
 from src.server.models import ServerConfig
+from src.utils.idmapper import base as _idmapper_base
 from src.utils.utils import to_str, uses_database
 from src.utils import logger
 
-__all__ = ("to_pickle", "from_pickle", "do_pickle", "do_unpickle")
+__all__ = ("to_pickle", "from_pickle", "do_pickle", "do_unpickle",
+           "get_pending", "discard_pending", "flush_pending")
 
-PICKLE_PROTOCOL = 2
+PICKLE_PROTOCOL = HIGHEST_PROTOCOL
+# the version of the packed form written by to_pickle
+SERIALIZE_VERSION = 2
 
 # initialization and helpers
 
@@ -43,12 +68,20 @@ _SA = object.__setattr__
 _FROM_MODEL_MAP = None
 _TO_MODEL_MAP = None
 _TO_TYPECLASS = lambda o: hasattr(o, 'typeclass') and o.typeclass or o
-_IS_PACKED_DBOBJ = lambda o: type(o) == tuple and len(o) == 4 and o[0] == '__packed_dbobj__'
+# {tag of packed dbobj: version of the packed form}
+_DBOBJ_TAGS = {'__packed_dbobj__': 1, '__dbobj__': 2}
+_IS_PACKED_DBOBJ = lambda o: type(o) == tuple and len(o) == 4 and o[0] in _DBOBJ_TAGS
+# types that never need packing or unpacking
+_SCALARS = (str, unicode, int, long, float, bool, type(None))
+# marks _save_tree calls not about one key or child of the root
+_WHOLE = object()
 if uses_database("mysql") and ServerConfig.objects.get_mysql_db_version() < '5.6.4':
     # mysql <5.6.4 don't support millisecond precision
     _DATESTRING = "%Y:%m:%d-%H:%M:%S:000000"
+    _TIMESTAMP_PRECISION = 1000000
 else:
     _DATESTRING = "%Y:%m:%d-%H:%M:%S:%f"
+    _TIMESTAMP_PRECISION = 1
 
 
 def _TO_DATESTRING(obj):
@@ -64,6 +97,20 @@ def _TO_DATESTRING(obj):
         return _GA(obj, "db_date_created").strftime(_DATESTRING)
 
 
+def _TO_TIMESTAMP(obj):
+    """
+    The creation time of a valid database object in microseconds
+    since the epoch, as stored by the database.
+    """
+    date = _GA(obj, "db_date_created")
+    if date is None:
+        # object is not yet saved
+        obj.save()
+        date = _GA(obj, "db_date_created")
+    stamp = timegm(date.utctimetuple()) * 1000000 + date.microsecond
+    return stamp - stamp % _TIMESTAMP_PRECISION
+
+
 def _init_globals():
     "Lazy importing to avoid circular import issues"
     global _FROM_MODEL_MAP, _TO_MODEL_MAP
@@ -74,6 +121,112 @@ def _init_globals():
         _TO_MODEL_MAP = defaultdict(str)
         _TO_MODEL_MAP.update(dict((c.natural_key(), c.model_class()) for c in ContentType.objects.all()))
 
+#
+# Batched saving of updated Saver* structures
+#
+
+def _pending_key(db_obj):
+    "Key of db_obj in the save queue, the same for all instances of a row"
+    return (db_obj.__class__.__name__, getattr(db_obj, "id", None))
+
+
+class _SaveQueue(object):
+    """
+    The updated Saver* roots waiting to be saved to their Attributes.
+    For roots with keyed storage (see Attribute), the changed keys are
+    tracked so only those are written.
+    """
+    def __init__(self):
+        # {pending key: root}
+        self.pending = {}
+        # {pending key: set of changed keys, or None if all changed}
+        self.keys = {}
+        # {pending key: direct children of root changed deeper down}
+        self.children = {}
+        self.flush_call = None
+
+    def add(self, root, child=None, key=_WHOLE):
+        "Register an update of root"
+        db_obj = root._db_obj
+        if (not (reactor.running and isInIOThread()) or _idmapper_base._IS_SUBPROCESS
+                or getattr(db_obj, "id", None) is None):
+            # nobody would flush the queue for us (or db_obj is not
+            # stored yet, as when batch-creating)
+            db_obj.value = root
+            return
+        dbid = _pending_key(db_obj)
+        pending = self.pending.get(dbid)
+        if pending is not root:
+            # another root of the same Attribute replaces the whole
+            # value, as its save would have
+            self.keys[dbid] = set() if pending is None else None
+            self.pending[dbid] = root
+            self.children[dbid] = []
+        if self.keys[dbid] is not None:
+            if child is not None:
+                self.children[dbid].append(child)
+            elif key is not _WHOLE:
+                self.keys[dbid].add(key)
+            else:
+                self.keys[dbid] = None
+        if not self.flush_call:
+            self.flush_call = reactor.callLater(0, self.flush)
+
+    def get(self, db_obj):
+        "Get the pending root of db_obj, if any"
+        return self.pending.get(_pending_key(db_obj))
+
+    def discard(self, db_obj):
+        "Forget the pending updates to db_obj (it got a new value)"
+        dbid = _pending_key(db_obj)
+        self.pending.pop(dbid, None)
+        self.keys.pop(dbid, None)
+        self.children.pop(dbid, None)
+
+    def flush(self):
+        "Save all pending roots"
+        if self.flush_call and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        pending, keys, children = self.pending, self.keys, self.children
+        self.pending, self.keys, self.children = {}, {}, {}
+        for dbid, root in pending.items():
+            db_obj = root._db_obj
+            if db_obj.id is None:
+                # deleted meanwhile
+                continue
+            try:
+                changed = keys[dbid]
+                if getattr(root, "_keyed", False) and changed is not None:
+                    if children[dbid]:
+                        childids = set(id(child) for child in children[dbid])
+                        changed.update(key for key, val in root._data.items() if id(val) in childids)
+                    db_obj.save_items(root, changed)
+                else:
+                    db_obj.value = root
+            except Exception:
+                logger.log_trace("Could not save the updated value of %s." % db_obj)
+
+_SAVE_QUEUE = _SaveQueue()
+
+
+def get_pending(db_obj):
+    """
+    Get the updated (not yet saved) Saver* structure of db_obj,
+    or None.
+    """
+    return _SAVE_QUEUE.get(db_obj)
+
+
+def discard_pending(db_obj):
+    "Drop the unsaved updates of db_obj"
+    _SAVE_QUEUE.discard(db_obj)
+
+
+def flush_pending():
+    "Save all updated Saver* structures now"
+    _SAVE_QUEUE.flush()
+
 #
 # SaverList, SaverDict, SaverSet - Attribute-specific helper classes and functions
 #
@@ -89,6 +242,45 @@ def _save(method):
     return update_wrapper(save_wrapper, method)
 
 
+class _LazyItem(object):
+    """
+    An item of a Saver* structure still on the packed form it was
+    unpickled as. It is unpacked when first accessed.
+    """
+    __slots__ = ("packed",)
+
+    def __init__(self, packed):
+        self.packed = packed
+
+
+def _lazy(item):
+    "Wrap a packed item in a _LazyItem, unless it needs no unpacking"
+    return item if type(item) in _SCALARS else _LazyItem(item)
+
+
+def _saver_tree(item, parent=None, db_obj=None):
+    """
+    Wrap packed data (a list, dict or set) in its Saver* counterpart.
+    Only the top level is processed; the items below it are unpacked
+    when they are first accessed.
+    """
+    dtype = type(item)
+    if dtype == list:
+        dat = _SaverList(parent=parent, db_obj=db_obj)
+        dat._data = [_lazy(val) for val in item]
+    elif dtype == dict:
+        dat = _SaverDict(parent=parent, db_obj=db_obj)
+        dat._data = dict((key if type(key) in _SCALARS else _unpack(key), _lazy(val))
+                         for key, val in item.iteritems())
+    else:
+        # set items are immutable, there is nothing to track below them
+        dat = _SaverSet(parent=parent, db_obj=db_obj)
+        dat._data = set(_unpack(val) for val in item)
+        return dat
+    dat._packed = True
+    return dat
+
+
 class _SaverMutable(object):
     """
     Parent class for properly handling  of nested mutables in
@@ -96,18 +288,27 @@ class _SaverMutable(object):
      obj.db.mylist[1][2] = "test" (allocation to a nested list)
     will not save the updated value to the database.
     """
+    # set on roots stored one row per key (see Attribute)
+    _keyed = False
+    # set while _data may hold _LazyItems
+    _packed = False
+
     def __init__(self, *args, **kwargs):
         "store all properties for tracking the tree"
         self._parent = kwargs.pop("parent", None)
         self._db_obj = kwargs.pop("db_obj", None)
         self._data = None
 
-    def _save_tree(self):
-        "recursively traverse back up the tree, save when we reach the root"
+    def _save_tree(self, child=None, key=_WHOLE):
+        """
+        recursively traverse back up the tree, queue a save when we
+        reach the root. child is the item of self that changed, key
+        the key of self that was set or deleted.
+        """
         if self._parent:
-            self._parent._save_tree()
+            self._parent._save_tree(child=self)
         elif self._db_obj:
-            self._db_obj.value = self
+            _SAVE_QUEUE.add(self, child=child, key=key)
         else:
             logger.log_errmsg("_SaverMutable %s has no root Attribute to save to." % self)
 
@@ -116,7 +317,7 @@ class _SaverMutable(object):
         def process_tree(item, parent):
             "recursively populate the tree, storing parents"
             dtype = type(item)
-            if dtype in (basestring, int, long, float, bool, tuple):
+            if dtype in _SCALARS or dtype == tuple:
                 return item
             elif dtype == list:
                 dat = _SaverList(parent=parent)
@@ -133,17 +334,38 @@ class _SaverMutable(object):
             return item
         return process_tree(data, self)
 
+    def _unpack_lazy(self, item):
+        "Unpack a _LazyItem of self"
+        packed = item.packed
+        if type(packed) in (list, dict, set):
+            return _saver_tree(packed, parent=self)
+        return _unpack(packed)
+
+    def _unpack_all(self):
+        "Unpack all lazy items of self (but not those of its children)"
+        if self._packed:
+            data = self._data
+            for key, item in (data.items() if type(data) == dict else enumerate(data)):
+                if type(item) is _LazyItem:
+                    data[key] = self._unpack_lazy(item)
+            self._packed = False
+
     def __repr__(self):
+        self._unpack_all()
         return self._data.__repr__()
 
     def __len__(self):
         return self._data.__len__()
 
     def __iter__(self):
+        self._unpack_all()
         return self._data.__iter__()
 
     def __getitem__(self, key):
-        return self._data.__getitem__(key)
+        item = self._data.__getitem__(key)
+        if type(item) is _LazyItem:
+            item = self._data[key] = self._unpack_lazy(item)
+        return item
 
     @_save
     def __setitem__(self, key, value):
@@ -162,8 +384,15 @@ class _SaverList(_SaverMutable, MutableSequence):
         super(_SaverList, self).__init__(*args, **kwargs)
         self._data = list(*args)
 
+    def __getitem__(self, index):
+        if type(index) == slice:
+            self._unpack_all()
+            return self._data[index]
+        return super(_SaverList, self).__getitem__(index)
+
     @_save
     def __add__(self, otherlist):
+        self._unpack_all()
         self._data = self._data.__add__(otherlist)
         return self._data
 
@@ -180,6 +409,21 @@ class _SaverDict(_SaverMutable, MutableMapping):
         super(_SaverDict, self).__init__(*args, **kwargs)
         self._data = dict(*args)
 
+    def __iter__(self):
+        # the keys are never lazy
+        return self._data.__iter__()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        self._data.__setitem__(key, self._convert_mutables(value))
+        self._save_tree(key=key)
+
+    def __delitem__(self, key):
+        self._data.__delitem__(key)
+        self._save_tree(key=key)
+
     def has_key(self, key):
         return key in self._data
 
@@ -207,20 +451,24 @@ class _SaverSet(_SaverMutable, MutableSet):
 # serialization helpers
 #
 
-def pack_dbobj(item):
+def pack_dbobj(item, version=SERIALIZE_VERSION):
     """
     Check and convert django database objects to an internal representation.
     This either returns the original input item or a tuple
-      ("__packed_dbobj__", key, creation_time, id)
+      ("__dbobj__", key, creation_time, id)
+    with the creation time in microseconds. With version=1, the tuple
+    is ("__packed_dbobj__", key, creation_datestring, id) instead.
     """
     _init_globals()
     obj = hasattr(item, 'dbobj') and item.dbobj or item
     natural_key = _FROM_MODEL_MAP[hasattr(obj, "id") and hasattr(obj, "db_date_created") and
                                   hasattr(obj, '__class__') and obj.__class__.__name__.lower()]
-    # build the internal representation as a tuple
-    #  ("__packed_dbobj__", key, creation_time, id)
-    return natural_key and ('__packed_dbobj__', natural_key,
-                             _TO_DATESTRING(obj), _GA(obj, "id")) or item
+    if not natural_key:
+        return item
+    # the creation time must be found first, it saves obj if needed
+    if version == 1:
+        return ('__packed_dbobj__', natural_key, _TO_DATESTRING(obj), _GA(obj, "id"))
+    return ('__dbobj__', natural_key, _TO_TIMESTAMP(obj), _GA(obj, "id"))
 
 
 def unpack_dbobj(item):
@@ -229,6 +477,7 @@ def unpack_dbobj(item):
     The fact that item is a packed dbobj should be checked before this call.
     This either returns the original input or converts the internal store back
     to a database representation (its typeclass is returned if applicable).
+    Both versions of the packed form are understood.
     """
     _init_globals()
     try:
@@ -241,40 +490,75 @@ def unpack_dbobj(item):
         dbobj = obj.dbobj
     except AttributeError:
         dbobj = obj
-    return _TO_DATESTRING(dbobj) == item[2] and obj or None
+    if _DBOBJ_TAGS[item[0]] == 1:
+        return _TO_DATESTRING(dbobj) == item[2] and obj or None
+    return _TO_TIMESTAMP(dbobj) == item[2] and obj or None
+
+
+def _unpack(item):
+    "Recursively unpack packed data, without building Saver* structures"
+    dtype = type(item)
+    if dtype in _SCALARS:
+        return item
+    elif _IS_PACKED_DBOBJ(item):
+        # this must be checked before tuple
+        return unpack_dbobj(item)
+    elif dtype == tuple:
+        return tuple(_unpack(val) for val in item)
+    elif dtype == dict:
+        return dict((_unpack(key), _unpack(val)) for key, val in item.iteritems())
+    elif dtype == set:
+        return set(_unpack(val) for val in item)
+    elif hasattr(item, '__iter__'):
+        try:
+            # we try to conserve the iterable class if
+            # it accepts an iterator
+            return item.__class__(_unpack(val) for val in item)
+        except (AttributeError, TypeError):
+            return [_unpack(val) for val in item]
+    return item
 
 #
 # Access methods
 #
 
-def to_pickle(data):
+def to_pickle(data, version=SERIALIZE_VERSION):
     """
     This prepares data on arbitrary form to be pickled. It handles any nested
     structure and returns data on a form that is safe to pickle (including
     having converted any database models to their internal representation).
     We also convert any Saver*-type objects back to their normal
-    representations, they are not pickle-safe.
+    representations, they are not pickle-safe. Parts of a Saver* structure
+    that were never accessed are still packed and are used as they are.
+
+    version - the version of the packed form to use for database
+              objects. Only needed to match data stored on an older form.
     """
     def process_item(item):
         "Recursive processor and identification of data"
         dtype = type(item)
-        if dtype in (basestring, int, long, float, bool):
+        if dtype in _SCALARS:
             return item
+        elif dtype == _LazyItem:
+            return item.packed
         elif dtype == tuple:
             return tuple(process_item(val) for val in item)
-        elif dtype in (list, _SaverList):
+        elif dtype == list:
             return [process_item(val) for val in item]
-        elif dtype in (dict, _SaverDict):
-            return dict((process_item(key), process_item(val)) for key, val in item.items())
-        elif dtype in (set, _SaverSet):
+        elif dtype == dict:
+            return dict((process_item(key), process_item(val)) for key, val in item.iteritems())
+        elif dtype == set:
             return set(process_item(val) for val in item)
+        elif dtype in (_SaverList, _SaverDict, _SaverSet):
+            # go by the stored data, so lazy items are not unpacked
+            return process_item(item._data)
         elif hasattr(item, '__item__'):
             # we try to conserve the iterable class, if not convert to list
             try:
                 return item.__class__([process_item(val) for val in item])
             except (AttributeError, TypeError):
                 return [process_item(val) for val in item]
-        return pack_dbobj(item)
+        return pack_dbobj(item, version=version)
     return process_item(data)
 
 
@@ -292,84 +576,15 @@ def from_pickle(data, db_obj=None):
              to the database. Skip if not serializing onto a given object.
 
     If db_obj is given, this function will convert lists, dicts and sets
-    to their _SaverList, _SaverDict and _SaverSet counterparts.
+    to their _SaverList, _SaverDict and _SaverSet counterparts. Their
+    nested items are only unpacked when first accessed.
 
     """
-    def process_item(item):
-        "Recursive processor and identification of data"
-        dtype = type(item)
-        if dtype in (basestring, int, long, float, bool):
-            return item
-        elif _IS_PACKED_DBOBJ(item):
-            # this must be checked before tuple
-            return unpack_dbobj(item)
-        elif dtype == tuple:
-            return tuple(process_item(val) for val in item)
-        elif dtype == dict:
-            return dict((process_item(key), process_item(val)) for key, val in item.items())
-        elif dtype == set:
-            return set(process_item(val) for val in item)
-        elif hasattr(item, '__iter__'):
-            try:
-                # we try to conserve the iterable class if
-                # it accepts an iterator
-                return item.__class__(process_item(val) for val in item)
-            except (AttributeError, TypeError):
-                return [process_item(val) for val in item]
-        return item
-
-    def process_tree(item, parent):
-        "Recursive processor, building a parent-tree from iterable data"
-        dtype = type(item)
-        if dtype in (basestring, int, long, float, bool):
-            return item
-        elif _IS_PACKED_DBOBJ(item):
-            # this must be checked before tuple
-            return unpack_dbobj(item)
-        elif dtype == tuple:
-            return tuple(process_tree(val, item) for val in item)
-        elif dtype == list:
-            dat = _SaverList(parent=parent)
-            dat._data.extend(process_tree(val, dat) for val in item)
-            return dat
-        elif dtype == dict:
-            dat = _SaverDict(parent=parent)
-            dat._data.update(dict((process_item(key), process_tree(val, dat))
-                                   for key, val in item.items()))
-            return dat
-        elif dtype == set:
-            dat = _SaverSet(parent=parent)
-            dat._data.update(set(process_tree(val, dat) for val in item))
-            return dat
-        elif hasattr(item, '__iter__'):
-            try:
-                # we try to conserve the iterable class if it
-                # accepts an iterator
-                return item.__class__(process_tree(val, parent) for val in item)
-            except (AttributeError, TypeError):
-                dat = _SaverList(parent=parent)
-                dat._data.extend(process_tree(val, dat) for val in item)
-                return dat
-        return item
-
-    if db_obj:
+    if db_obj and type(data) in (list, dict, set):
         # convert lists, dicts and sets to their Saved* counterparts. It
         # is only relevant if the "root" is an iterable of the right type.
-        dtype = type(data)
-        if dtype == list:
-            dat = _SaverList(db_obj=db_obj)
-            dat._data.extend(process_tree(val, parent=dat) for val in data)
-            return dat
-        elif dtype == dict:
-            dat = _SaverDict(db_obj=db_obj)
-            dat._data.update((process_item(key), process_tree(val, parent=dat))
-                              for key, val in data.items())
-            return dat
-        elif dtype == set:
-            dat = _SaverSet(db_obj=db_obj)
-            dat._data.update(process_tree(val, parent=dat) for val in data)
-            return dat
-    return process_item(data)
+        return _saver_tree(data, db_obj=db_obj)
+    return _unpack(data)
 
 
 def do_pickle(data):
@@ -0,0 +1,137 @@
+"""
+Benchmark for Attribute value serialization.
+
+This times storing and reading a stat block like the ones kept in
+obj.db - nested dicts and lists of numbers and strings with some
+objects in them - the way an Attribute does: packing, pickling and
+encoding the value on write, decoding and unpacking it into a
+_SaverDict on read. The current serializer (lazily unpacked, compact
+database objects) is compared to the eager one it replaced,
+reproduced below. Run from the game directory of an initialized game
+(some of its objects are put in the payload) with
+
+    python ../src/utils/dummyrunner/attribute_serialize.py
+
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
+import django
+django.setup()
+import timeit
+from src.objects.models import ObjectDB
+from src.typeclasses.models import Attribute
+from src.utils.picklefield import dbsafe_encode, dbsafe_decode
+from src.utils import dbserialize
+from src.utils.dbserialize import (to_pickle, from_pickle, pack_dbobj, unpack_dbobj,
+                                   _IS_PACKED_DBOBJ, _SaverList, _SaverDict, _SaverSet)
+
+NUM_SKILLS = 40
+NUM_ITEMS = 20
+
+
+def make_payload(objs):
+    "A character stat block"
+    return {"stats": dict(("stat%i" % istat, 10 + istat) for istat in xrange(12)),
+            "skills": dict(("skill%i" % iskill, {"level": iskill % 10, "xp": iskill * 150,
+                                                 "trainer": objs[iskill % len(objs)] if objs else None,
+                                                 "history": [iskill, iskill * 2, iskill * 3]})
+                           for iskill in xrange(NUM_SKILLS)),
+            "inventory": [objs[iitem % len(objs)] for iitem in xrange(NUM_ITEMS)] if objs else [],
+            "effects": [{"name": "effect%i" % ieff, "duration": 30.5, "stacks": ieff}
+                        for ieff in xrange(10)],
+            "flags": set(["flag%i" % iflag for iflag in xrange(8)]),
+            "title": "the Benchmarked"}
+
+
+# the eager serializer used before
+
+def old_to_pickle(data):
+    "Old to_pickle, packing database objects on the version 1 form"
+    def process_item(item):
+        dtype = type(item)
+        if dtype in (basestring, int, long, float, bool):
+            return item
+        elif dtype == tuple:
+            return tuple(process_item(val) for val in item)
+        elif dtype in (list, _SaverList):
+            return [process_item(val) for val in item]
+        elif dtype in (dict, _SaverDict):
+            return dict((process_item(key), process_item(val)) for key, val in item.items())
+        elif dtype in (set, _SaverSet):
+            return set(process_item(val) for val in item)
+        return pack_dbobj(item, version=1)
+    return process_item(data)
+
+
+def old_from_pickle(data, db_obj):
+    "Old from_pickle, building the whole Saver* tree at once"
+    def process_tree(item, parent):
+        dtype = type(item)
+        if dtype in (basestring, int, long, float, bool):
+            return item
+        elif _IS_PACKED_DBOBJ(item):
+            return unpack_dbobj(item)
+        elif dtype == tuple:
+            return tuple(process_tree(val, item) for val in item)
+        elif dtype == list:
+            dat = _SaverList(parent=parent)
+            dat._data.extend(process_tree(val, dat) for val in item)
+            return dat
+        elif dtype == dict:
+            dat = _SaverDict(parent=parent)
+            dat._data.update((key, process_tree(val, dat)) for key, val in item.items())
+            return dat
+        elif dtype == set:
+            dat = _SaverSet(parent=parent)
+            dat._data.update(process_tree(val, dat) for val in item)
+            return dat
+        return item
+    dat = _SaverDict(db_obj=db_obj)
+    dat._data.update((key, process_tree(val, dat)) for key, val in data.items())
+    return dat
+
+
+if __name__ == "__main__":
+
+    objs = list(ObjectDB.objects.all()[:10])
+    payload = make_payload(objs)
+    attr = Attribute(db_key="bench")
+
+    def timed(func, number=200):
+        return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+    old_stored = dbsafe_encode(old_to_pickle(payload), pickle_protocol=2)
+    new_stored = dbsafe_encode(to_pickle(payload), pickle_protocol=dbserialize.PICKLE_PROTOCOL)
+    # sanity check - both must read back the same
+    assert repr(old_from_pickle(dbsafe_decode(old_stored), attr)) == \
+           repr(from_pickle(dbsafe_decode(new_stored), db_obj=attr))
+
+    def old_read():
+        return old_from_pickle(dbsafe_decode(old_stored), attr)["stats"]["stat3"]
+
+    def new_read():
+        return from_pickle(dbsafe_decode(new_stored), db_obj=attr)["stats"]["stat3"]
+
+    def old_update():
+        value = old_from_pickle(dbsafe_decode(old_stored), attr)
+        value._data["stats"]._data["stat3"] += 1
+        return dbsafe_encode(old_to_pickle(value), pickle_protocol=2)
+
+    def new_update():
+        value = from_pickle(dbsafe_decode(new_stored), db_obj=attr)
+        value["stats"]._data["stat3"] += 1
+        return dbsafe_encode(to_pickle(value), pickle_protocol=dbserialize.PICKLE_PROTOCOL)
+
+    print "Stat block with %i skills, %i items and %i objects" % (NUM_SKILLS, NUM_ITEMS, len(objs))
+    print "%-16s %12s %12s" % ("", "old", "new")
+    print "%-16s %12i %12i" % ("stored (bytes)", len(old_stored), len(new_stored))
+    print "%-16s %12.3f %12.3f" % ("write (ms)",
+                                   timed(lambda: dbsafe_encode(old_to_pickle(payload), pickle_protocol=2)),
+                                   timed(lambda: dbsafe_encode(to_pickle(payload),
+                                                               pickle_protocol=dbserialize.PICKLE_PROTOCOL)))
+    print "%-16s %12.3f %12.3f" % ("read one (ms)", timed(old_read), timed(new_read))
+    print "%-16s %12.3f %12.3f" % ("read all (ms)",
+                                   timed(lambda: repr(old_from_pickle(dbsafe_decode(old_stored), attr))),
+                                   timed(lambda: repr(from_pickle(dbsafe_decode(new_stored), db_obj=attr))))
+    print "%-16s %12.3f %12.3f" % ("update one (ms)", timed(old_update), timed(new_update))
@@ -0,0 +1,79 @@
+"""
+Memory benchmark for object cmdsets.
+
+Every object held in the idmapper cache carries a CmdSetHandler.
+This measures how much memory 10000 such handlers add when all of
+them carry the default character cmdset, once with the shared cmdset
+templates used by the cmdsethandler and once with one cmdset instance
+per object (as with shared=False). It also shows the cost of keeping
+a bound copy of the merged set (handler.current) for every object,
+which the cmdhandler only makes for the cmdsets it merges.
+
+No database is used; the handlers are put on stand-in objects. Run
+from the game directory with
+
+    python ../src/utils/dummyrunner/cmdset_memory.py
+
+"""
+import os, sys
+import gc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
+from django.conf import settings
+from src.commands.command import Command
+from src.commands import cmdsethandler
+
+NUM_OBJECTS = 10000
+
+
+class _Obj(object):
+    "Stand-in for a database object with a stored default cmdset"
+    def __init__(self):
+        self.cmdset_storage = [settings.CMDSET_CHARACTER]
+
+    def msg(self, *args, **kwargs):
+        pass
+
+
+def rss():
+    "Resident memory of this process, in MB"
+    return float(os.popen('ps -p %d -o rss | tail -1' % os.getpid()).read()) / 1000.0
+
+
+def num_commands():
+    "Number of Command instances alive"
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Command))
+
+
+def measure(shared, bind=False):
+    "Create the handlers and report memory growth per NUM_OBJECTS"
+    cmdsetclass = cmdsethandler.import_cmdset(settings.CMDSET_CHARACTER, None).__class__
+    cmdsetclass.shared = shared
+    gc.collect()
+    mem0, ncmds0 = rss(), num_commands()
+    objs = []
+    for iobj in xrange(NUM_OBJECTS):
+        obj = _Obj()
+        obj.cmdset = cmdsethandler.CmdSetHandler(obj)
+        if bind:
+            obj.bound = obj.cmdset.current
+        objs.append(obj)
+    gc.collect()
+    mem1, ncmds1 = rss(), num_commands()
+    print "%-28s %8.1f MB %10i commands" % (
+        "%s%s:" % (shared and "shared templates" or "per-object cmdsets",
+                   bind and ", bound" or ""),
+        mem1 - mem0, ncmds1 - ncmds0)
+
+
+_CASES = {"unshared": (False, False), "shared": (True, False), "bound": (True, True)}
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        measure(*_CASES[sys.argv[1]])
+    else:
+        print "Growth per %i objects carrying %s" % (NUM_OBJECTS, settings.CMDSET_CHARACTER)
+        # each case runs in its own process, so freed memory is not reused
+        for case in ("unshared", "shared", "bound"):
+            os.system("%s %s %s" % (sys.executable, os.path.abspath(__file__), case))
@@ -0,0 +1,82 @@
+"""
+Benchmark for cmdset building and merging.
+
+This times adding 300 commands to a cmdset and merging two 300-command
+cmdsets (half of the commands in common) with each mergetype. The
+indexed CmdSet is compared to the list-based operations it replaced,
+reproduced below. No database is used; run from the game directory
+with
+
+    python ../src/utils/dummyrunner/cmdset_merge.py
+
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
+import timeit
+from src.commands.command import Command
+from src.commands.cmdset import CmdSet
+
+NUM_COMMANDS = 300
+MERGETYPES = ("Union", "Intersect", "Replace", "Remove")
+
+
+def make_commands(start, num=NUM_COMMANDS):
+    "Commands cmd<start> ... with one alias each"
+    return [Command(key="cmd%i" % icmd, aliases=["c%i" % icmd]) for icmd in xrange(start, start + num)]
+
+
+def make_cmdset(commands, mergetype="Union", priority=0):
+    cmdset = CmdSet()
+    cmdset.mergetype = mergetype
+    cmdset.priority = priority
+    cmdset.add(commands)
+    return cmdset
+
+
+# the list-based operations used before
+
+def list_add(commands, cmds):
+    "Old CmdSet.add for a list of commands"
+    for cmd in cmds:
+        try:
+            ic = commands.index(cmd)
+            commands[ic] = cmd
+        except ValueError:
+            commands.append(cmd)
+        commands = list(set(commands))
+    return commands
+
+
+def list_merge(mergetype, commands_a, commands_b):
+    "Old merge of A onto B (no duplicates)"
+    if mergetype == "Intersect":
+        return [cmd for cmd in commands_a if cmd in commands_b]
+    elif mergetype == "Replace":
+        return commands_a[:]
+    elif mergetype == "Remove":
+        return [cmd for cmd in commands_b if not cmd in commands_a]
+    return commands_a + [cmd for cmd in commands_b if not cmd in commands_a]
+
+
+if __name__ == "__main__":
+
+    cmds_a = make_commands(0)
+    cmds_b = make_commands(NUM_COMMANDS // 2)
+
+    def timed(func, number=10):
+        return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+    print "Cmdsets of %i commands, %i in common" % (NUM_COMMANDS, NUM_COMMANDS // 2)
+    print "%-12s %12s %12s" % ("", "lists (ms)", "indexed (ms)")
+    print "%-12s %12.3f %12.3f" % ("add", timed(lambda: list_add([], cmds_a)),
+                                   timed(lambda: make_cmdset(cmds_a)))
+    cmdset_b = make_cmdset(cmds_b)
+    for mergetype in MERGETYPES:
+        cmdset_a = make_cmdset(cmds_a, mergetype=mergetype, priority=1)
+        # sanity check - both must give the same commands
+        assert set(cmd.key for cmd in cmdset_a + cmdset_b) == \
+               set(cmd.key for cmd in list_merge(mergetype, cmds_a, cmds_b))
+        print "%-12s %12.3f %12.3f" % (mergetype.lower(),
+                                       timed(lambda: list_merge(mergetype, cmds_a, cmds_b)),
+                                       timed(lambda: cmdset_a + cmdset_b))
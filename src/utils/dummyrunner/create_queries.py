@@ -0,0 +1,61 @@
+"""
+Count the database queries used by create_object.
+
+This creates a number of objects with create.create_object and
+reports the number of queries (and time) each creation took. Run it
+from the game directory of an initialized game:
+
+    python ../src/utils/dummyrunner/create_queries.py [typeclass] [number]
+
+The objects are removed again afterwards. The target for a plain
+Object is less than 5 queries per create.
+
+"""
+import sys, os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ["DJANGO_SETTINGS_MODULE"] = "game.settings"
+import time
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+TARGET = 5
+
+
+def count_create_queries(typeclass, number=10, verbose=False):
+    """
+    Create number objects of the given typeclass, returning a list
+    of (nqueries, time) for each creation.
+    """
+    from src.utils import create
+    results = []
+    objs = []
+    for inum in range(number):
+        with CaptureQueriesContext(connection) as context:
+            t0 = time.time()
+            objs.append(create.create_object(typeclass, key="bench_%i" % inum))
+            dt = time.time() - t0
+        if verbose:
+            for query in context.captured_queries:
+                print query["time"], query["sql"]
+        results.append((len(context), dt))
+    from src.objects.models import ObjectDB
+    ObjectDB.objects.bulk_delete(objs)
+    return results
+
+
+if __name__ == "__main__":
+
+    typeclass = sys.argv[1] if len(sys.argv) > 1 else settings.BASE_OBJECT_TYPECLASS
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    # the first create also warms up caches, so show its queries
+    results = count_create_queries(typeclass, 1, verbose=True)
+    results.extend(count_create_queries(typeclass, number))
+    nqueries = [res[0] for res in results[1:]] or [results[0][0]]
+    times = [res[1] for res in results[1:]] or [results[0][1]]
+    print "typeclass: %s" % typeclass
+    print "first create: %i queries" % results[0][0]
+    print "queries per create: min %i, max %i, average %.1f (target < %i)" % (
+            min(nqueries), max(nqueries), float(sum(nqueries)) / len(nqueries), TARGET)
+    print "time per create: %.2f ms" % (1000.0 * sum(times) / len(times))
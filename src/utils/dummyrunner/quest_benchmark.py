@@ -0,0 +1,139 @@
+"""
+Benchmark for quest objective matching.
+
+This gives a QuestManager 50 active quests and times what it does
+for a kill: building the objective index (once per server run) and
+check_quest_flags, which looks up the objectives matching the mob and
+advances them. For comparison the matching alone is also timed the
+old way (a loop over every quest and objective doing string tests)
+and with the index. Run from the game directory of an initialized
+game with
+
+    python ../src/utils/dummyrunner/quest_benchmark.py
+
+The objects created are removed again afterwards.
+
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
+import django
+django.setup()
+import timeit
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from src.objects.models import ObjectDB
+from src.utils import create
+from game.gamesrc.objects.world.quests import mob_event_keys
+
+NUM_QUESTS = 50
+OBJECTIVES_PER_QUEST = 3
+NUM_EVENTS = 200
+
+_SUBJECTS = ["rat", "wolf", "bandit", "goblin", "spider", "skeleton", "boss"]
+_QUESTS = "game.gamesrc.objects.world.quests"
+
+
+def make_objectives(iquest):
+    "The objectives of a quest, as kept in quest.db.objectives"
+    objectives = {}
+    for iobj in range(OBJECTIVES_PER_QUEST):
+        subject = _SUBJECTS[(iquest + iobj) % len(_SUBJECTS)]
+        otype = "gather_%s_pelt" % subject if iobj == 2 else "kill_%s" % subject
+        name = "objective %i-%i" % (iquest, iobj)
+        # the threshold is never reached, so the quests stay active
+        objectives[name] = {'objective_name': name, 'counter': 0,
+                            'threshold': 10 ** 9, 'completed': False,
+                            'type': otype}
+    return objectives
+
+
+def linear_match(manager, mob_type, mob_name):
+    "The old check_quest_flags matching for a kill"
+    hits = []
+    active_quests = manager.db.active_quests
+    for quest in active_quests:
+        objectives = active_quests[quest].db.objectives
+        for objective in objectives:
+            if objectives[objective]['completed']:
+                continue
+            otype = objectives[objective]['type']
+            if 'kill_%s' % mob_type in otype:
+                hits.append((quest, objective))
+            elif 'kill_%s' % mob_name in otype:
+                hits.append((quest, objective))
+    return hits
+
+
+def index_match(manager, mob):
+    "The check_quest_flags matching with the objective index"
+    index = manager._get_objective_index()
+    hits = []
+    for key in mob_event_keys(mob):
+        hits.extend(index.get(key, ()))
+    return hits
+
+
+if __name__ == "__main__":
+
+    created = []
+
+    def make(typeclass, key):
+        obj = create.create_object(typeclass, key=key)
+        created.append(obj)
+        return obj
+
+    try:
+        character = make(settings.BASE_OBJECT_TYPECLASS, "quest_bench_character")
+        manager = make("%s.QuestManager" % _QUESTS, "quest_bench_manager")
+        manager.db.character = character
+        for iquest in range(NUM_QUESTS):
+            quest = make("%s.Quest" % _QUESTS, "quest_bench_%i" % iquest)
+            quest.db.quest_type = "kill"
+            quest.db.objectives = make_objectives(iquest)
+            manager.add_quest(quest)
+        mobs = []
+        for subject in _SUBJECTS:
+            mob = make(settings.BASE_OBJECT_TYPECLASS, "a mangy %s" % subject)
+            mob.db.mob_type = subject
+            mob.aliases.add("kill_%s" % subject)
+            mobs.append(mob)
+        events = [mobs[ievent % len(mobs)] for ievent in range(NUM_EVENTS)]
+
+        # sanity check - both must give the same objectives
+        for mob in mobs:
+            assert sorted(linear_match(manager, mob.db.mob_type, mob.name)) == \
+                   sorted(index_match(manager, mob))
+
+        def build_index():
+            manager.ndb.objective_index = None
+            manager._get_objective_index()
+
+        def run_linear():
+            for mob in events:
+                linear_match(manager, mob.db.mob_type, mob.name)
+
+        def run_index():
+            for mob in events:
+                index_match(manager, mob)
+
+        def run_check():
+            for mob in events:
+                manager.check_quest_flags(mob=mob)
+
+        t_build = min(timeit.repeat(build_index, number=1, repeat=5))
+        t_linear = min(timeit.repeat(run_linear, number=1, repeat=3))
+        t_index = min(timeit.repeat(run_index, number=1, repeat=3))
+        with CaptureQueriesContext(connection) as context:
+            t_check = min(timeit.repeat(run_check, number=1, repeat=1))
+
+        print "%i active quests, %i objectives each, %i kill events" % (
+                NUM_QUESTS, OBJECTIVES_PER_QUEST, NUM_EVENTS)
+        print "building index:    %.3f ms" % (t_build * 1000)
+        print "linear matching:   %.2f us/event" % (t_linear * 1e6 / NUM_EVENTS)
+        print "index matching:    %.2f us/event" % (t_index * 1e6 / NUM_EVENTS)
+        print "check_quest_flags: %.2f ms/event, %.1f queries/event" % (
+                t_check * 1000 / NUM_EVENTS, float(len(context)) / NUM_EVENTS)
+    finally:
+        ObjectDB.objects.bulk_delete(created)
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark for typeclass attribute access.
+
+This times reading attributes through a typeclass the way hot code
+(ticks, combat) does - self.key, self.location, a handler, a field
+and a miss caught with getattr - comparing the forwarding descriptors now
+added by the typeclass metaclass with the __getattribute__ override
+used before (reproduced below). No database is used; the object is
+never saved. Run from the game directory with
+
+    python ../src/utils/dummyrunner/typeclass_access.py
+
+"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
+import django
+django.setup()
+import timeit
+from src.objects.models import ObjectDB
+from src.objects.objects import Object
+
+NUM_ACCESSES = 100000
+NAMES = ("key", "location", "dbref", "aliases", "db_typeclass_path")
+
+_GA = object.__getattribute__
+
+
+class _OldTypeClass(object):
+    "The attribute lookup typeclasses used before"
+    def __init__(self, dbobj):
+        object.__setattr__(self, "dbobj", dbobj)
+
+    def __getattribute__(self, propname):
+        if propname.startswith('__') and propname.endswith('__'):
+            return _GA(self, propname)
+        try:
+            return _GA(self, propname)
+        except AttributeError:
+            dbobj = _GA(self, 'dbobj')
+            try:
+                return _GA(dbobj, propname)
+            except AttributeError:
+                raise AttributeError(propname)
+
+
+if __name__ == "__main__":
+
+    dbobj = ObjectDB(db_key="bench", db_typeclass_path=Object.path)
+    new = Object(dbobj)
+    old = _OldTypeClass(dbobj)
+
+    def timed(obj, name):
+        func = lambda: getattr(obj, name)
+        return min(timeit.repeat(func, number=NUM_ACCESSES, repeat=3))
+
+    print "%i accesses per attribute" % NUM_ACCESSES
+    print "%-20s %14s %14s" % ("", "old (M/s)", "new (M/s)")
+    for name in NAMES:
+        assert getattr(old, name) == getattr(new, name)
+        print "%-20s %14.2f %14.2f" % (name, NUM_ACCESSES / timed(old, name) / 1e6,
+                                       NUM_ACCESSES / timed(new, name) / 1e6)
+    # a miss, as in getattr(obj, "name", default)
+    tmiss_old = min(timeit.repeat(lambda: getattr(old, "no_such_thing", None), number=NUM_ACCESSES, repeat=3))
+    tmiss_new = min(timeit.repeat(lambda: getattr(new, "no_such_thing", None), number=NUM_ACCESSES, repeat=3))
+    print "%-20s %14.2f %14.2f" % ("(miss)", NUM_ACCESSES / tmiss_old / 1e6, NUM_ACCESSES / tmiss_new / 1e6)
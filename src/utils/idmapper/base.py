@@ -184,6 +184,14 @@ class SharedMemoryModel(Model):
 
     objects = SharedMemoryManager()
 
+    # Batch-creation support. When _deferred_fields is set to a set() on an
+    # instance, save() will not touch the database but only remember
+    # which fields were changed. New m2m relations (Attributes, Tags) are
+    # similarly queued in _deferred_m2m instead of being stored. The
+    # batch is then written in bulk (see src.utils.spawner).
+    _deferred_fields = None
+    _deferred_m2m = None
+
     class Meta:
         abstract = True
 
@@ -285,6 +293,12 @@ class SharedMemoryModel(Model):
     def save(cls, *args, **kwargs):
         "save method tracking process/thread issues"
 
+        deferred = _GA(cls, "_deferred_fields")
+        if deferred is not None:
+            # we are part of a batch; store what to save for later
+            deferred.update(kwargs.get("update_fields") or ("__all__",))
+            return
+
         if _IS_SUBPROCESS:
             # we keep a store of objects modified in subprocesses so
             # we know to update their caches in the central process
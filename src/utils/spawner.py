@@ -28,6 +28,7 @@ Possible keywords are:
     permissions - string or list of permission strings
     locks - a lock-string
     aliases - string or list of strings
+    tags - string or list of strings
 
     ndb_<name> - value of a nattribute (ndb_ is stripped)
     any other keywords are interpreted as Attributes and their values.
@@ -74,13 +75,16 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspa
 os.environ['DJANGO_SETTINGS_MODULE'] = 'game.settings'
 
 from django.conf import settings
+from django.db import transaction
 from random import randint
 from src.objects.models import ObjectDB
-from src.utils.create import handle_dbref
+from src.utils.create import handle_dbref, _bulk_insert, _field_values, _store_deferred
 from src.utils.utils import make_iter, all_from_module
 
 _CREATE_OBJECT_KWARGS = ("key", "location", "home", "destination")
 
+_SA = object.__setattr__
+
 _handle_dbref = lambda inp: handle_dbref(inp, ObjectDB)
 
 
@@ -117,54 +121,85 @@ def _get_prototype(dic, prot, protparents):
     prot.pop("prototype", None) # we don't need this anymore
     return prot
 
-def _batch_create_object(*objparams):
+def _batch_create_object(*objparams, **kwargs):
     """
     This is a cut-down version of the create_object() function,
     optimized for speed. It does NOT check and convert various input
     so make sure the spawned Typeclass works before using this!
 
+    All objects are created in one database transaction using
+    multi-row inserts. The creation hooks are run with database saves
+    deferred, so whatever the hooks store (fields, Attributes, Tags,
+    locks) is written in bulk afterwards. Objects are created directly
+    at their given location; no move hooks are called.
+
     Input:
     objsparams - each argument should be a tuple of arguments for the respective
                  creation/add handlers in the following order:
-                    (create, permissions, locks, aliases, nattributes, attributes)
+                    (create, permissions, locks, aliases, nattributes, attributes, tags)
+    at_spawn - optional keyword callable at_spawn(obj). This is called
+                 on every new object after all other creation hooks, and
+                 anything it stores is saved together with the batch.
     Returns:
     A list of created objects
     """
+    at_spawn = kwargs.get("at_spawn", None)
 
-    # bulk create all objects in one go
     dbobjs = [ObjectDB(**objparam[0]) for objparam in objparams]
-    # unfortunately this doesn't work since bulk_create don't creates pks;
-    # the result are double objects at the next stage
-    #dbobjs = _ObjectDB.objects.bulk_create(dbobjs)
-
     objs = []
-    for iobj, dbobj in enumerate(dbobjs):
-        # call all setup hooks on each object
-        objparam = objparams[iobj]
-        obj = dbobj.typeclass # this saves dbobj if not done already
-        obj.basetype_setup()
-        obj.at_object_creation()
-
-        if objparam[1]:
-            # permissions
-            obj.permissions.add(objparam[1])
-        if objparam[2]:
-            # locks
-            obj.locks.add(objparam[2])
-        if objparam[3]:
-            # aliases
-            obj.aliases.add(objparam[3])
-        if objparam[4]:
-            # nattributes
-            for key, value in objparam[4].items():
-                obj.nattributes.add(key, value)
-        if objparam[5]:
-            # attributes
-            keys, values = objparam[5].keys(), objparam[5].values()
-            obj.attributes.batch_add(keys, values)
-
+    try:
+        with transaction.atomic():
+            # insert all objects in one go
+            _bulk_insert(ObjectDB, dbobjs)
+            initial_values = [_field_values(dbobj) for dbobj in dbobjs]
+
+            for iobj, dbobj in enumerate(dbobjs):
+                # defer all saving while calling the setup hooks
+                _SA(dbobj, "_deferred_fields", set())
+                _SA(dbobj, "_deferred_m2m", {})
+                ObjectDB.cache_instance(dbobj)
+
+                objparam = objparams[iobj]
+                obj = dbobj.typeclass
+                obj.basetype_setup()
+                obj.at_object_creation()
+
+                if objparam[1]:
+                    # permissions
+                    obj.permissions.add(objparam[1])
+                if objparam[2]:
+                    # locks
+                    obj.locks.add(objparam[2])
+                if objparam[3]:
+                    # aliases
+                    obj.aliases.add(objparam[3])
+                if objparam[4]:
+                    # nattributes
+                    for key, value in objparam[4].items():
+                        obj.nattributes.add(key, value)
+                if objparam[5]:
+                    # attributes
+                    keys, values = objparam[5].keys(), objparam[5].values()
+                    obj.attributes.batch_add(keys, values)
+                if len(objparam) > 6 and objparam[6]:
+                    # tags
+                    obj.tags.add(objparam[6])
+                if at_spawn:
+                    at_spawn(obj)
+                objs.append(obj)
+
+            _store_deferred(dbobjs, initial_values)
+    except Exception:
+        # the transaction was rolled back; don't leave ghosts in the cache
+        for dbobj in dbobjs:
+            _SA(dbobj, "_deferred_fields", None)
+            _SA(dbobj, "_deferred_m2m", None)
+            if dbobj.id is not None:
+                ObjectDB.flush_cached_instance(dbobj)
+        raise
+
+    for obj in objs:
         obj.basetype_posthook_setup()
-        objs.append(obj)
     return objs
 
 
@@ -183,6 +218,9 @@ def spawn(*prototypes, **kwargs):
                       overload same-named prototypes from prototype_modules.
         return_prototypes - only return a list of the prototype-parents
                             (no object creation happens)
+        at_spawn - a callable at_spawn(obj) called on every spawned object
+                   after its creation hooks. Changes it does are stored
+                   in bulk together with the rest of the spawn.
     """
 
     protparents = {}
@@ -202,6 +240,7 @@ def spawn(*prototypes, **kwargs):
         return copy.deepcopy(protparents)
 
     objsparams = []
+    homes = {}
     for prototype in prototypes:
 
         _validate_prototype(None, prototype, protparents, [])
@@ -213,7 +252,11 @@ def spawn(*prototypes, **kwargs):
         create_kwargs = {}
         create_kwargs["db_key"] = prot.pop("key", "Spawned Object %06i" % randint(1,100000))
         create_kwargs["db_location"] = _handle_dbref(prot.pop("location", None))
-        create_kwargs["db_home"] = _handle_dbref(prot.pop("home", settings.DEFAULT_HOME))
+        home = prot.pop("home", settings.DEFAULT_HOME)
+        if home not in homes:
+            # all objects usually share the same home; only look it up once
+            homes[home] = _handle_dbref(home)
+        create_kwargs["db_home"] = homes[home]
         create_kwargs["db_destination"] = _handle_dbref(prot.pop("destination", None))
         create_kwargs["db_typeclass_path"] = prot.pop("typeclass", settings.BASE_OBJECT_TYPECLASS)
 
@@ -221,6 +264,7 @@ def spawn(*prototypes, **kwargs):
         permission_string = prot.pop("permissions", "")
         lock_string = prot.pop("locks", "")
         alias_string = prot.pop("aliases", "")
+        tags = prot.pop("tags", "")
 
         # extract ndb assignments
         nattributes = dict((key.split("_", 1)[1], value if callable(value) else value)
@@ -229,13 +273,13 @@ def spawn(*prototypes, **kwargs):
         # the rest are attributes
         attributes = dict((key, value() if callable(value) else value)
                            for key, value in prot.items()
-                           if not (key in _CREATE_OBJECT_KWARGS or key in nattributes))
+                           if not (key in _CREATE_OBJECT_KWARGS or key.startswith("ndb_")))
 
         # pack for call into _batch_create_object
         objsparams.append( (create_kwargs, permission_string, lock_string,
-                            alias_string, nattributes, attributes) )
+                            alias_string, nattributes, attributes, tags) )
 
-    return _batch_create_object(*objsparams)
+    return _batch_create_object(*objsparams, at_spawn=kwargs.get("at_spawn", None))
 
 
 if __name__ == "__main__":
@@ -554,9 +554,7 @@ def clean_object_caches(obj):
         pass
 
 
-_PPOOL = None
-_PCMD = None
-_PROC_ERR = "A process has ended with a probable error condition: process ended by signal 9."
+_PROCPOOL = None
 def run_async(to_execute, *args, **kwargs):
     """
     Runs a function or executes a code snippet asynchronously.
@@ -565,10 +563,20 @@ def run_async(to_execute, *args, **kwargs):
     to_execute (callable) - if this is a callable, it will
             be executed with *args and non-reserver *kwargs as
             arguments.
-            The callable will be executed using ProcPool, or in
-            a thread if ProcPool is not available.
+            The callable will be executed using the process pool
+            (src.server.procpool), or in a thread if the pool is not
+            running or the callable can't be pickled (only module-level
+            functions can be sent to another process).
+    to_execute (string) - this is only available if the process pool
+            is running. The string is treated as a code snippet to run
+            in a worker process. *args are then not used and
+            non-reserved *kwargs define the environment available to the
+            code. The snippet returns data by calling _return(retval).
 
     reserved kwargs:
+        'use_thread' (bool) - run a callable in a thread even if the
+                     process pool is available. Use this for code that
+                     must work on the in-memory state of the server.
         'at_return' -should point to a callable with one argument.
                     It will be called with the return value from
                     to_execute.
@@ -587,7 +595,10 @@ def run_async(to_execute, *args, **kwargs):
               instead are used to define the executable environment
               that should be available to execute the code in to_execute.
 
-    run_async will relay executed code to a thread or procpool.
+    run_async will relay executed code to a worker process or a thread.
+    Database objects in the arguments (and the return value) are sent
+    to worker processes as references and loaded again on the other
+    side, so they must be saved to the database.
 
     Use this function with restrain and only for features/commands
     that you know has no influence on the cause-and-effect order of your
@@ -602,14 +613,27 @@ def run_async(to_execute, *args, **kwargs):
     tracebacks.
 
     """
+    global _PROCPOOL
+    if not _PROCPOOL:
+        from src.server.procpool import PROCPOOL as _PROCPOOL
 
     # handle special reserved input kwargs
+    use_thread = kwargs.pop("use_thread", False)
     callback = kwargs.pop("at_return", None)
     errback = kwargs.pop("at_err", None)
     callback_kwargs = kwargs.pop("at_return_kwargs", {})
     errback_kwargs = kwargs.pop("at_err_kwargs", {})
 
-    if callable(to_execute):
+    deferred = None
+    if _PROCPOOL.available() and not use_thread:
+        if isinstance(to_execute, basestring):
+            deferred = _PROCPOOL.submit(None, to_str(to_execute), (), kwargs)
+        elif callable(to_execute):
+            deferred = _PROCPOOL.submit(to_execute, None, args, kwargs)
+
+    if deferred:
+        pass
+    elif callable(to_execute):
         # no process pool available, fall back to old deferToThread mechanism.
         deferred = threads.deferToThread(to_execute, *args, **kwargs)
     else:
@@ -619,7 +643,11 @@ def run_async(to_execute, *args, **kwargs):
     # attach callbacks
     if callback:
         deferred.addCallback(callback, **callback_kwargs)
-    deferred.addErrback(errback, **errback_kwargs)
+    if errback:
+        deferred.addErrback(errback, **errback_kwargs)
+    else:
+        from src.utils import logger
+        deferred.addErrback(lambda err: logger.log_errmsg("run_async: %s" % err.getErrorMessage()))
 
 
 def check_evennia_dependencies():
@@ -6,14 +6,12 @@ templates on the fly.
 
 """
 from django.contrib.admin.sites import site
-from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 
-from src.objects.models import ObjectDB
 from src.players.models import PlayerDB
-
-_BASE_CHAR_TYPECLASS = settings.BASE_CHARACTER_TYPECLASS
+from src.server.sessionhandler import SESSIONS
+from src.server.stats import SERVER_STATS
 
 
 def page_index(request):
@@ -24,18 +22,20 @@ def page_index(request):
     # TODO: Move this to either SQL or settings.py based configuration.
     fpage_player_limit = 4
 
-    # A QuerySet of the most recently connected players.
-    recent_users = PlayerDB.objects.get_recently_connected_players()[:fpage_player_limit]
+    # The counts come from the running server statistics, so
+    # page views don't hit the database.
+    recent_users = SERVER_STATS.recently_connected_players(limit=fpage_player_limit)
     nplyrs_conn_recent = len(recent_users) or "none"
-    nplyrs = PlayerDB.objects.num_total_players() or "none"
-    nplyrs_reg_recent = len(PlayerDB.objects.get_recently_created_players()) or "none"
-    nsess = len(PlayerDB.objects.get_connected_players()) or "no one"
-
-    nobjs = ObjectDB.objects.all().count()
-    nrooms = ObjectDB.objects.filter(db_location__isnull=True).exclude(db_typeclass_path=_BASE_CHAR_TYPECLASS).count()
-    nexits = ObjectDB.objects.filter(db_location__isnull=False, db_destination__isnull=False).count()
-    nchars = ObjectDB.objects.filter(db_typeclass_path=_BASE_CHAR_TYPECLASS).count()
-    nothers = nobjs - nrooms - nchars - nexits
+    nplyrs = SERVER_STATS.num_players() or "none"
+    nplyrs_reg_recent = SERVER_STATS.num_recently_created_players() or "none"
+    nsess = SESSIONS.player_count() or "no one"
+
+    totals = SERVER_STATS.object_totals()
+    nobjs = totals["objects"]
+    nrooms = totals["rooms"]
+    nexits = totals["exits"]
+    nchars = totals["characters"]
+    nothers = totals["others"]
 
     pagevars = {
         "page_title": "Front Page",